@@ -2,65 +2,126 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser
-import codecs
+import heapq
+import io
 import os
 import random
+import shutil
 import tempfile
+import time
 
-import numpy as np
-
-from prepare_dict import load_lexicon
-from compare_lexicons import compare_lexicons
-
-
-def create_tmp_file_name():
-    basedir = os.path.join(os.path.dirname(__file__), 'data', 'tmp')
-    fp = tempfile.NamedTemporaryFile(mode='w', dir=basedir, delete=False)
-    filename = fp.name
-    fp.close()
-    return filename
-
-
-def split_words_and_transcriptions_for_cv(words_and_transcriptions, cv):
-    assert len(words_and_transcriptions) > 0, 'List of texts is empty!'
-    assert cv > 0, 'Number of folds for crossvalidation must be a positive integer value!'
-    assert len(words_and_transcriptions) >= cv, '{0} > {1}. Number of folds for crossvalidation is too large!'.format(
-        cv, len(words_and_transcriptions)
-    )
-    folds = list()
-    fold_size = len(words_and_transcriptions) // cv
-    words = sorted(list(words_and_transcriptions.keys()))
-    random.shuffle(words)
-    for fold_ind in range(cv):
-        start_text_idx = fold_ind * fold_size
-        end_text_idx = (fold_ind + 1) * fold_size
-        words_for_training = list()
-        for cur_word in sorted(words[:start_text_idx] + words[end_text_idx:]):
-            for cur_transcription in words_and_transcriptions[cur_word]:
-                words_for_training.append(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
-        words_for_testing = list()
-        for cur_word in sorted(words[start_text_idx:end_text_idx]):
-            for cur_transcription in words_and_transcriptions[cur_word]:
-                words_for_testing.append(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
-        folds.append((tuple(words_for_training), tuple(words_for_testing)))
-    return folds
+from prepare_dict import read_word_list
+from g2p_engine import create_g2p_engine
+from transcription_cache import TranscriptionCache
+from lookup_table import LookupTableTranscriber, open_lookup_table
+from lexicon_io import LEXICON_FORMATS, is_readable, iterate_merged_entries, merge_transcriptions, write_lexicon
+from profiling import profile_stage, profiler
+
+
+def iterate_chunks(source, chunk_size):
+    chunk = list()
+    for cur in source:
+        chunk.append(cur)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = list()
+    if len(chunk) > 0:
+        yield chunk
+
+
+def transcribe_words(words, g2p_engine, cache, lookup_table=None):
+    if lookup_table is None:
+        return cache.transcribe(g2p_engine, words)
+    return lookup_table.transcribe(words, lambda missed_words: cache.transcribe(g2p_engine, missed_words))
+
+
+def transcribe_chunks(words, g2p_engine, cache, chunk_size, lookup_table=None):
+    for chunk in iterate_chunks(words, chunk_size):
+        chunk.sort()
+        for idx in range(1, len(chunk)):
+            assert chunk[idx] != chunk[idx - 1], u'{0} is duplicated!'.format(chunk[idx])
+        predicted = transcribe_words(chunk, g2p_engine, cache, lookup_table)
+        yield [(cur_word, merge_transcriptions(predicted.get(cur_word, ())))
+               for cur_word in sorted(set(chunk) | set(predicted.keys()))]
+
+
+def save_run(entries, file_name):
+    with io.open(file_name, mode='w', encoding='utf-8', newline=u'\n') as fp:
+        for cur_word, transcriptions in entries:
+            fp.write(u'\t'.join([cur_word] + transcriptions) + u'\n')
+
+
+def load_run(file_name):
+    with io.open(file_name, mode='r', encoding='utf-8', newline=u'\n') as fp:
+        for cur_line in fp:
+            parts = cur_line.rstrip(u'\n').split(u'\t')
+            yield parts[0], parts[1:]
+
+
+def merge_runs(run_names):
+    previous_word = None
+    for cur_word, transcriptions in heapq.merge(*[load_run(cur_name) for cur_name in run_names]):
+        assert cur_word != previous_word, u'{0} is duplicated!'.format(cur_word)
+        previous_word = cur_word
+        yield cur_word, transcriptions
+
+
+def count_transcribed_words(cache, lookup_table=None):
+    return cache.n_hits + cache.n_misses + (0 if lookup_table is None else lookup_table.n_hits)
+
+
+def print_decoding_statistics(g2p_engine, cache, duration, lookup_table=None):
+    for shard_idx, n_words, shard_duration in getattr(g2p_engine, 'shard_statistics', []):
+        print(u'Shard {0}: {1} words, {2:.1f} words/sec.'.format(shard_idx + 1, n_words,
+                                                                n_words / max(shard_duration, 1e-6)))
+    n_words = count_transcribed_words(cache, lookup_table)
+    print(u'Total: {0} words, {1:.1f} words/sec.'.format(n_words, n_words / max(duration, 1e-6)))
+    if lookup_table is not None:
+        lookup_table.print_statistics()
+    print(u'Transcription cache: {0} hits, {1} misses.'.format(cache.n_hits, cache.n_misses))
 
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('-s', '--src', dest='word_list', required=True, type=str,
-                        help='Source file with words without their phonetical transcriptions.')
+                        help='Source file with words without their phonetical transcriptions (it may be compressed, '
+                             'and "-" means the standard input).')
     parser.add_argument('-d', '--dst', dest='destination_lexicon', type=str, required=True,
                         help='Destination file into which the creating phonetic transcriptions shall be written.')
+    parser.add_argument('--format', dest='lexicon_format', type=str, required=False, default='cmu',
+                        choices=LEXICON_FORMATS,
+                        help='Format of the destination file: "cmu" (variants are marked as "word(2)") or "tab" (the '
+                             'tab-separated training format). It is compressed if its name ends with ".gz", ".xz" '
+                             'or ".zst".')
     parser.add_argument('-m', '--model', dest='model_dir', type=str, default=None,
                         required=False, help='A directory with trained model.')
     parser.add_argument('-p', '--pmass', dest='pmass', type=float, required=False, default=0.85,
                         help='% of total probability mass constraint for transcriptions generating.')
     parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help='Random seed.')
+    parser.add_argument('--decoder', dest='decoder', type=str, required=False, default=None,
+                        help='A decoder command with the same interface as phonetisaurus-apply (if it is not '
+                             'specified, then the Phonetisaurus Python binding or phonetisaurus-apply is used).')
+    parser.add_argument('--cache', dest='cache', action='store_true', required=False, default=False,
+                        help='Persist generated transcriptions into the SQLite cache next to the model.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, required=False, default=100000,
+                        help='Maximal number of words in the in-memory LRU cache of transcriptions.')
+    parser.add_argument('--lookup-table', dest='lookup_table', type=str, required=False, default=None,
+                        help='A lookup table with precomputed transcriptions of frequent words (it is built by '
+                             'lookup_table.py and rebuilt automatically if the model is changed).')
+    parser.add_argument('--stream', dest='stream', action='store_true', required=False, default=False,
+                        help='Transcribe the word list by chunks with bounded memory usage.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, required=False, default=100000,
+                        help='Number of words in a chunk for the streaming mode.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, required=False, default=1,
+                        help='Number of parallel processes for transcriptions generating.')
+    parser.add_argument('--timeout', dest='timeout', type=float, required=False, default=None,
+                        help='Maximal time (in seconds) of each run of the decoder.')
+    parser.add_argument('--profile-json', dest='profile_json', type=str, required=False, default=None,
+                        help='A JSON file into which time, CPU and memory usage of all stages shall be written.')
     args = parser.parse_args()
 
     src_wordlist_name = os.path.normpath(args.word_list)
-    assert os.path.isfile(src_wordlist_name), u'File "{0}" does not exist!'.format(src_wordlist_name)
+    assert is_readable(src_wordlist_name), u'File "{0}" does not exist!'.format(src_wordlist_name)
     dst_vocabulary_name = os.path.normpath(args.destination_lexicon)
     dst_vocabulary_dir = os.path.dirname(dst_vocabulary_name)
     assert os.path.isdir(dst_vocabulary_dir), u'Directory "{0}" does not exist!'.format(dst_vocabulary_dir)
@@ -72,43 +133,75 @@ def main():
     else:
         model_dir = os.path.normpath(args.model_dir)
         assert os.path.isdir(model_dir), 'A directory "{0}" does not exist!'.format(model_dir)
+    assert args.cache_size > 0, u'Size of the transcription cache must be a positive integer value!'
+    assert args.jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+    assert (args.timeout is None) or (args.timeout > 0.0), u'Timeout must be a positive value!'
+    assert args.chunk_size > 0, u'Size of the word chunk must be a positive integer value!'
+    lookup_table_name = None
+    if args.lookup_table is not None:
+        lookup_table_name = os.path.normpath(args.lookup_table)
+        assert os.path.isfile(lookup_table_name), u'File "{0}" does not exist!'.format(lookup_table_name)
     random.seed(args.seed)
-    words_and_transcriptions = dict()
-    with codecs.open(src_wordlist_name, mode='r', encoding='utf-8') as fp:
-        curline = fp.readline()
-        while len(curline) > 0:
-            prepline = curline.strip().lower()
-            if len(prepline) > 0:
-                assert prepline not in words_and_transcriptions, u'{0} is duplicated!'.format(prepline)
-                words_and_transcriptions[prepline] = []
-            curline = fp.readline()
-    del words_
-    tmp_file_for_result = create_tmp_file_name()
-    try:
+    model_name = os.path.join(model_dir, 'russian_g2p.fst')
+    cache_name = os.path.join(model_dir, 'russian_g2p.cache') if args.cache else None
+    if args.stream:
+        tmp_dir_name = tempfile.mkdtemp(dir=os.path.join(os.path.dirname(__file__), 'data', 'tmp'))
+        try:
+            print(u'Final recognition of transcriptions for words is started...')
+            start_time = time.time()
+            run_names = list()
+            with profile_stage(u'decoding') as cur_stage:
+                with create_g2p_engine(model_name, pmass, decoder=args.decoder, n_jobs=args.jobs,
+                                       timeout=args.timeout) as g2p_engine, \
+                        TranscriptionCache(model_name, pmass, capacity=args.cache_size, db_name=cache_name,
+                                           decoder=g2p_engine.decoder) as cache:
+                    lookup_table = None if lookup_table_name is None else LookupTableTranscriber(
+                        open_lookup_table(lookup_table_name, model_name, pmass, g2p_engine), lookup_table_name
+                    )
+                    for run_idx, entries in enumerate(transcribe_chunks(read_word_list(src_wordlist_name),
+                                                                        g2p_engine, cache, args.chunk_size,
+                                                                        lookup_table)):
+                        run_names.append(os.path.join(tmp_dir_name, u'run{0}.txt'.format(run_idx)))
+                        save_run(entries, run_names[-1])
+                cur_stage['items'] = count_transcribed_words(cache, lookup_table)
+            print(u'')
+            print(u'Final recognition of transcriptions for words is finished...')
+            print_decoding_statistics(g2p_engine, cache, time.time() - start_time, lookup_table)
+            with profile_stage(u'writing') as cur_stage:
+                cur_stage['items'] = write_lexicon(dst_vocabulary_name, merge_runs(run_names), args.lexicon_format)
+        finally:
+            shutil.rmtree(tmp_dir_name, ignore_errors=True)
+    else:
+        with profile_stage(u'word_list_reading') as cur_stage:
+            words_and_transcriptions = dict()
+            for cur_word in read_word_list(src_wordlist_name):
+                assert cur_word not in words_and_transcriptions, u'{0} is duplicated!'.format(cur_word)
+                words_and_transcriptions[cur_word] = []
+            cur_stage['items'] = len(words_and_transcriptions)
         print(u'Final recognition of transcriptions for words is started...')
-        cmd = u'phonetisaurus-apply --model "{0}" --word_list "{1}" -p {2} -a > "{3}"'.format(
-            os.path.join(model_dir, 'russian_g2p.fst'), src_wordlist_name, pmass, tmp_file_for_result
-        )
-        os.system(cmd)
+        start_time = time.time()
+        with profile_stage(u'decoding') as cur_stage:
+            with create_g2p_engine(model_name, pmass, decoder=args.decoder, n_jobs=args.jobs,
+                                   timeout=args.timeout) as g2p_engine, \
+                    TranscriptionCache(model_name, pmass, capacity=args.cache_size, db_name=cache_name,
+                                       decoder=g2p_engine.decoder) as cache:
+                lookup_table = None if lookup_table_name is None else LookupTableTranscriber(
+                    open_lookup_table(lookup_table_name, model_name, pmass, g2p_engine), lookup_table_name
+                )
+                predicted_phonetic_dictionary = transcribe_words(sorted(words_and_transcriptions.keys()), g2p_engine,
+                                                                 cache, lookup_table)
+            cur_stage['items'] = len(words_and_transcriptions)
         print(u'')
         print(u'Final recognition of transcriptions for words is finished...')
-        predicted_phonetic_dictionary = load_lexicon(tmp_file_for_result)
-    finally:
-        if os.path.isfile(tmp_file_for_result):
-            os.remove(tmp_file_for_result)
-
-    for cur_word in predicted_phonetic_dictionary:
-        if cur_word in words_and_transcriptions:
-            for cur_transcription in predicted_phonetic_dictionary[cur_word]:
-                if cur_transcription not in words_and_transcriptions[cur_word]:
-                    words_and_transcriptions[cur_word].append(cur_transcription)
-        else:
-            words_and_transcriptions[cur_word] = predicted_phonetic_dictionary[cur_word]
-    with codecs.open(dst_vocabulary_name, mode='w', encoding='utf-8', errors='ignore') as fp:
-        for cur_word in sorted(list(words_and_transcriptions.keys())):
-            fp.write(u'{0} {1}\n'.format(cur_word, words_and_transcriptions[cur_word][0]))
-            for ind in range(1, len(words_and_transcriptions[cur_word])):
-                fp.write(u'{0}({1}) {2}\n'.format(cur_word, ind + 1, words_and_transcriptions[cur_word][ind]))
+        print_decoding_statistics(g2p_engine, cache, time.time() - start_time, lookup_table)
+
+        with profile_stage(u'writing') as cur_stage:
+            cur_stage['items'] = write_lexicon(
+                dst_vocabulary_name, iterate_merged_entries(words_and_transcriptions, predicted_phonetic_dictionary),
+                args.lexicon_format
+            )
+    if args.profile_json is not None:
+        profiler.save_json(args.profile_json, script_name=u'apply.py')
 
 
 if __name__ == '__main__':
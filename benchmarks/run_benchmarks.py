@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+import codecs
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from prepare_dict import load_lexicon, save_binary_lexicon
+from compare_lexicons import calculate_error_rates, find_best_pair
+from do_experiments import split_words_and_transcriptions_for_cv
+from g2p_engine import G2PEngine
+from synthetic_lexicon import save_distorted_lexicon, save_synthetic_lexicon, save_word_list
+
+
+STUB_DECODER_NAME = os.path.join(BENCHMARKS_DIR, 'stub_decoder.py')
+
+
+def prepare_data(data_dir, n_words, max_variants, seed):
+    data = {
+        'true_lexicon_name': os.path.join(data_dir, 'true.dic'),
+        'predicted_lexicon_name': os.path.join(data_dir, 'predicted.dic'),
+        'binary_lexicon_name': os.path.join(data_dir, 'true.lex'),
+        'word_list_name': os.path.join(data_dir, 'words.txt'),
+        'model_dir': os.path.join(data_dir, 'model'),
+        'n_words': n_words
+    }
+    save_synthetic_lexicon(data['true_lexicon_name'], n_words, max_variants, seed)
+    save_distorted_lexicon(data['predicted_lexicon_name'], n_words, max_variants, seed)
+    save_word_list(data['word_list_name'], n_words, seed)
+    os.mkdir(data['model_dir'])
+    with codecs.open(os.path.join(data['model_dir'], 'russian_g2p.fst'), mode='w', encoding='utf-8') as fp:
+        fp.write(u'Dummy model for the stub decoder.\n')
+    data['true_lexicon'] = load_lexicon(data['true_lexicon_name'])
+    data['predicted_lexicon'] = load_lexicon(data['predicted_lexicon_name'])
+    save_binary_lexicon(data['true_lexicon'], data['binary_lexicon_name'])
+    data['words'] = sorted(data['true_lexicon'].keys())
+    return data
+
+
+def benchmark_load_text(data):
+    return len(load_lexicon(data['true_lexicon_name']))
+
+
+def benchmark_load_compact(data):
+    return len(load_lexicon(data['true_lexicon_name'], compact=True))
+
+
+def benchmark_load_binary(data):
+    lexicon = load_lexicon(data['binary_lexicon_name'])
+    n_words = 0
+    for cur_word in lexicon:
+        lexicon[cur_word]
+        n_words += 1
+    return n_words
+
+
+def benchmark_split_for_cv(data):
+    fold_name = os.path.join(os.path.dirname(data['word_list_name']), 'fold.dic')
+    for cur_fold in split_words_and_transcriptions_for_cv(data['true_lexicon'], 5):
+        cur_fold.save_training_part(fold_name)
+        cur_fold.save_testing_part(fold_name)
+    os.remove(fold_name)
+    return len(data['true_lexicon'])
+
+
+def benchmark_find_best_pair(data):
+    true_lexicon = data['true_lexicon']
+    predicted_lexicon = data['predicted_lexicon']
+    n_words = 0
+    for cur_word in data['words']:
+        if cur_word in predicted_lexicon:
+            find_best_pair(true_lexicon[cur_word], predicted_lexicon[cur_word])
+            n_words += 1
+    return n_words
+
+
+def benchmark_error_rates(data):
+    calculate_error_rates(data['true_lexicon'], data['predicted_lexicon'])
+    return len(data['true_lexicon'])
+
+
+def benchmark_decoding(data):
+    with G2PEngine(os.path.join(data['model_dir'], 'russian_g2p.fst'), decoder=STUB_DECODER_NAME) as g2p_engine:
+        predicted = g2p_engine.transcribe(data['words'])
+    assert len(predicted) == len(data['words']), u'The stub decoder has not transcribed all words!'
+    return len(predicted)
+
+
+def run_apply(data, additional_args):
+    dst_name = os.path.join(os.path.dirname(data['word_list_name']), 'applied.dic')
+    cmd = [sys.executable, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'apply.py'),
+           '-s', data['word_list_name'], '-d', dst_name, '-m', data['model_dir'],
+           '--decoder', STUB_DECODER_NAME] + additional_args
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(cmd, stdout=devnull)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    assert status == 0, u'Command "{0}" is failed with status {1}!'.format(u' '.join(cmd), status)
+    os.remove(dst_name)
+    # peak RSS of the apply.py process (ru_maxrss is measured in kilobytes on Linux and in bytes on macOS)
+    return data['n_words'], rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def benchmark_apply(data):
+    return run_apply(data, [])
+
+
+def benchmark_apply_stream(data):
+    return run_apply(data, ['--stream', '--chunk-size', str(max(data['n_words'] // 10, 1))])
+
+
+BENCHMARKS = [
+    ('load_lexicon', benchmark_load_text),
+    ('load_lexicon_compact', benchmark_load_compact),
+    ('load_lexicon_binary', benchmark_load_binary),
+    ('split_words_and_transcriptions_for_cv', benchmark_split_for_cv),
+    ('find_best_pair', benchmark_find_best_pair),
+    ('calculate_error_rates', benchmark_error_rates),
+    ('decoding', benchmark_decoding),
+    ('apply', benchmark_apply),
+    ('apply_stream', benchmark_apply_stream)
+]
+
+
+def measure(benchmark_function, data, n_repeats):
+    """ Measure the best wall time of several runs and then the peak memory in a separate run, because tracing of
+    memory allocations slows down the benchmark. Benchmarks, which run an external process, return its peak RSS
+    together with the number of processed items, and tracemalloc is not used for them.
+    """
+    best_time = None
+    n_items = None
+    peak_memory = None
+    for _ in range(n_repeats):
+        gc.collect()
+        start_time = timeit.default_timer()
+        res = benchmark_function(data)
+        duration = timeit.default_timer() - start_time
+        if isinstance(res, tuple):
+            n_items, peak_memory = res
+        else:
+            n_items = res
+        if (best_time is None) or (duration < best_time):
+            best_time = duration
+    if peak_memory is None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            benchmark_function(data)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'items': n_items, 'wall_time': best_time, 'items_per_second': n_items / max(best_time, 1e-9),
+            'peak_memory': peak_memory}
+
+
+def compare_with_baseline(results, baseline, threshold):
+    baseline_results = dict(((cur['benchmark'], cur['size'], cur['variants']), cur) for cur in baseline['results'])
+    regressions = list()
+    for cur in results:
+        key = (cur['benchmark'], cur['size'], cur['variants'])
+        if key not in baseline_results:
+            continue
+        old = baseline_results[key]
+        if cur['items_per_second'] < old['items_per_second'] * (1.0 - threshold):
+            regressions.append(u'{0} ({1} words): throughput {2:.1f} items/sec < {3:.1f} items/sec'.format(
+                key[0], key[1], cur['items_per_second'], old['items_per_second']))
+        # small absolute tolerance, so a change of a few allocations in a benchmark with tiny peak is not a regression
+        if cur['peak_memory'] > old['peak_memory'] * (1.0 + threshold) + (1 << 16):
+            regressions.append(u'{0} ({1} words): peak memory {2} bytes > {3} bytes'.format(
+                key[0], key[1], cur['peak_memory'], old['peak_memory']))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--sizes', dest='sizes', type=str, required=False, default='10000,100000',
+                        help=u'Comma-separated sizes of synthetic lexicons (from 10000 to 5000000 words).')
+    parser.add_argument('--variants', dest='max_variants', type=int, required=False, default=2,
+                        help=u'Maximal number of transcription variants per word (from 1 to 5).')
+    parser.add_argument('--benchmarks', dest='benchmarks', type=str, required=False, default=None,
+                        help=u'Comma-separated names of benchmarks (by default all benchmarks are run).')
+    parser.add_argument('--repeat', dest='n_repeats', type=int, required=False, default=3,
+                        help=u'Number of timed runs of each benchmark (the best time is reported).')
+    parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help=u'Random seed.')
+    parser.add_argument('-o', '--output', dest='output', type=str, required=False, default=None,
+                        help=u'A JSON file into which results shall be written.')
+    parser.add_argument('--baseline', dest='baseline', type=str, required=False, default=None,
+                        help=u'A JSON file with results of the baseline run.')
+    parser.add_argument('--threshold', dest='threshold', type=float, required=False, default=0.1,
+                        help=u'Maximal relative decrease of throughput (or increase of peak memory) in comparison '
+                             u'with the baseline, which is not considered as a regression.')
+    args = parser.parse_args()
+
+    sizes = [int(cur) for cur in args.sizes.split(',') if len(cur.strip()) > 0]
+    assert len(sizes) > 0, u'Sizes of synthetic lexicons are not specified!'
+    for cur_size in sizes:
+        assert cur_size > 0, u'Size of synthetic lexicon must be a positive integer value!'
+    assert (args.max_variants > 0) and (args.max_variants <= 5), \
+        u'Maximal number of transcription variants must be from 1 to 5!'
+    assert args.n_repeats > 0, u'Number of timed runs must be a positive integer value!'
+    assert (args.threshold >= 0.0) and (args.threshold < 1.0), u'Regression threshold is wrong!'
+    benchmarks = BENCHMARKS
+    if args.benchmarks is not None:
+        selected_names = set([cur.strip() for cur in args.benchmarks.split(',') if len(cur.strip()) > 0])
+        unknown_names = selected_names - set([cur[0] for cur in BENCHMARKS])
+        assert len(unknown_names) == 0, u'Benchmarks {0} are unknown!'.format(u', '.join(sorted(unknown_names)))
+        benchmarks = [cur for cur in BENCHMARKS if cur[0] in selected_names]
+    baseline = None
+    if args.baseline is not None:
+        assert os.path.isfile(args.baseline), u'File "{0}" does not exist!'.format(args.baseline)
+        with codecs.open(args.baseline, mode='r', encoding='utf-8', errors='ignore') as fp:
+            baseline = json.load(fp)
+
+    results = list()
+    for cur_size in sizes:
+        data_dir = tempfile.mkdtemp()
+        try:
+            data = prepare_data(data_dir, cur_size, args.max_variants, args.seed)
+            for benchmark_name, benchmark_function in benchmarks:
+                res = measure(benchmark_function, data, args.n_repeats)
+                res.update({'benchmark': benchmark_name, 'size': cur_size, 'variants': args.max_variants})
+                results.append(res)
+                print(u'{0:<40} {1:>8} words  {2:>12.1f} items/sec  {3:>8.1f} MB'.format(
+                    benchmark_name, cur_size, res['items_per_second'], res['peak_memory'] / float(1 << 20)))
+            del data
+        finally:
+            shutil.rmtree(data_dir)
+    report = {
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output is not None:
+        with codecs.open(args.output, mode='w', encoding='utf-8', errors='ignore') as fp:
+            fp.write(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(u'')
+            print(u'Regressions in comparison with the baseline:')
+            for cur in regressions:
+                print(u'  ' + cur)
+            sys.exit(1)
+        print(u'')
+        print(u'There are no regressions in comparison with the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+import io
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_lexicon import transcribe_word
+
+
+# negative log probability, which is added for each next stress position, so the first syllable is the most probable
+STRESS_SCORE = 1.5
+
+
+def create_nbest_list(word, nbest):
+    nbest_list = list()
+    for stress_idx in range(nbest):
+        transcription = transcribe_word(word, stress_idx)
+        if transcription is None:
+            break
+        nbest_list.append((stress_idx * STRESS_SCORE, transcription))
+    return nbest_list
+
+
+def select_by_pmass(nbest_list, pmass):
+    # probabilities are normalized over the N-best list, as in `filter_by_pmass()` of the G2P engine
+    probabilities = [math.exp(-score) for score, _ in nbest_list]
+    total_probability = sum(probabilities)
+    selected = list()
+    accumulated_probability = 0.0
+    for cur_variant, probability in zip(nbest_list, probabilities):
+        selected.append(cur_variant)
+        accumulated_probability += probability / total_probability
+        if accumulated_probability >= pmass:
+            break
+    return selected
+
+
+def main():
+    parser = ArgumentParser(description=u'Offline stand-in for the phonetisaurus-apply, which transcribes words of '
+                                        u'synthetic lexicons deterministically: its N-best list contains a variant '
+                                        u'for each stress position, and the first syllable is the most probable one.')
+    parser.add_argument('--model', dest='model', type=str, required=True, help=u'Name of model (it is not used).')
+    parser.add_argument('--word_list', dest='word_list', type=str, required=True, help=u'Name of word list.')
+    parser.add_argument('-n', '--nbest', dest='nbest', type=int, required=False, default=1,
+                        help=u'Maximal number of variants in the N-best list of each word.')
+    parser.add_argument('-p', '--pmass', dest='pmass', type=float, required=False, default=0.85,
+                        help=u'% of total probability mass constraint, which selects variants from the N-best list.')
+    parser.add_argument('-a', '--accumulate', dest='accumulate', action='store_true', required=False, default=False,
+                        help=u'Accumulate probabilities across unique pronunciations (it is not used).')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', required=False, default=False,
+                        help=u'Print scores of pronunciations.')
+    args = parser.parse_args()
+
+    assert os.path.isfile(args.model), u'File "{0}" does not exist!'.format(args.model)
+    assert args.nbest > 0, u'Size of the N-best list must be a positive integer value!'
+    output = io.open(sys.stdout.fileno(), mode='w', encoding='utf-8', closefd=False)
+    with io.open(args.word_list, mode='r', encoding='utf-8', errors='ignore') as fp:
+        for cur_line in fp:
+            cur_word = cur_line.strip()
+            for score, transcription in select_by_pmass(create_nbest_list(cur_word, args.nbest), args.pmass):
+                if args.verbose:
+                    output.write(u'{0}\t{1:.4f}\t{2}\n'.format(cur_word, score, transcription))
+                else:
+                    output.write(u'{0}\t{1}\n'.format(cur_word, transcription))
+    output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+import codecs
+import os
+import random
+
+
+CONSONANTS = [
+    (u'б', u'B'), (u'в', u'V'), (u'г', u'G'), (u'д', u'D'), (u'ж', u'ZH'), (u'з', u'Z'), (u'к', u'K'),
+    (u'л', u'L'), (u'м', u'M'), (u'н', u'N'), (u'п', u'P'), (u'р', u'R'), (u'с', u'S'), (u'т', u'T'),
+    (u'ф', u'F'), (u'х', u'H'), (u'ц', u'C'), (u'ч', u'CH'), (u'ш', u'SH'), (u'щ', u'SCH')
+]
+VOWELS = [
+    (u'а', u'A', u'A0'), (u'е', u'E', u'E0'), (u'и', u'I', u'I0'), (u'о', u'O', u'A0'), (u'у', u'U', u'U0'),
+    (u'ы', u'Y', u'Y0'), (u'э', u'E', u'E0'), (u'ю', u'U', u'U0'), (u'я', u'A', u'I0')
+]
+SYLLABLES = [(consonant + vowel, (consonant_phone, stressed_phone, reduced_phone))
+             for consonant, consonant_phone in CONSONANTS for vowel, stressed_phone, reduced_phone in VOWELS]
+SYLLABLE_IDS = dict((syllable, syllable_idx) for syllable_idx, (syllable, _) in enumerate(SYLLABLES))
+WORD_INDEX_MULTIPLIER = 2654435761
+
+
+def create_word(word_idx, n_words):
+    # words consist of 3-5 syllables, so a word may have up to 5 transcription variants (one per stress position)
+    n_syllables = 3 + word_idx % 3
+    capacity = len(SYLLABLES) ** n_syllables
+    while capacity < n_words:
+        capacity *= len(SYLLABLES)
+        n_syllables += 1
+    # the multiplier is a prime, which is coprime with the capacity, so different indices give different words
+    code = (word_idx * WORD_INDEX_MULTIPLIER) % capacity
+    syllable_ids = list()
+    for _ in range(n_syllables):
+        syllable_ids.append(code % len(SYLLABLES))
+        code //= len(SYLLABLES)
+    return syllable_ids
+
+
+def create_transcriptions(syllable_ids, rnd, max_variants):
+    transcriptions = list()
+    n_variants = rnd.randint(1, max_variants)
+    stress_positions = list(range(len(syllable_ids)))
+    rnd.shuffle(stress_positions)
+    for stress_idx in stress_positions[:n_variants]:
+        phones = list()
+        for syllable_idx, cur_syllable in enumerate(syllable_ids):
+            consonant_phone, stressed_phone, reduced_phone = SYLLABLES[cur_syllable][1]
+            phones.append(consonant_phone)
+            phones.append(stressed_phone if syllable_idx == stress_idx else reduced_phone)
+        transcriptions.append(u' '.join(phones))
+    return transcriptions
+
+
+def transcribe_word(word, stress_idx=0):
+    if (len(word) == 0) or (len(word) % 2 != 0) or (stress_idx >= len(word) // 2):
+        return None
+    phones = list()
+    for syllable_idx in range(len(word) // 2):
+        cur_syllable = SYLLABLE_IDS.get(word[(2 * syllable_idx):(2 * syllable_idx + 2)])
+        if cur_syllable is None:
+            return None
+        consonant_phone, stressed_phone, reduced_phone = SYLLABLES[cur_syllable][1]
+        phones.append(consonant_phone)
+        phones.append(stressed_phone if syllable_idx == stress_idx else reduced_phone)
+    return u' '.join(phones)
+
+
+def iterate_synthetic_lexicon(n_words, max_variants=2, seed=0):
+    rnd = random.Random(seed)
+    for word_idx in range(n_words):
+        syllable_ids = create_word(word_idx, n_words)
+        word = u''.join([SYLLABLES[cur][0] for cur in syllable_ids])
+        yield word, create_transcriptions(syllable_ids, rnd, max_variants)
+
+
+def distort_transcription(transcription, rnd, error_probability=0.1):
+    phones = transcription.split()
+    distorted = list()
+    for cur_phone in phones:
+        random_value = rnd.random()
+        if random_value < error_probability / 3.0:
+            continue
+        if random_value < 2.0 * error_probability / 3.0:
+            distorted.append(rnd.choice(CONSONANTS)[1])
+        elif random_value < error_probability:
+            distorted.append(cur_phone)
+            distorted.append(rnd.choice(VOWELS)[2])
+        else:
+            distorted.append(cur_phone)
+    if len(distorted) == 0:
+        distorted.append(phones[0])
+    return u' '.join(distorted)
+
+
+def save_synthetic_lexicon(file_name, n_words, max_variants=2, seed=0):
+    with codecs.open(file_name, mode='w', encoding='utf-8', errors='ignore') as fp:
+        for cur_word, transcriptions in iterate_synthetic_lexicon(n_words, max_variants, seed):
+            fp.write(u'{0} {1}\n'.format(cur_word, transcriptions[0]))
+            for ind in range(1, len(transcriptions)):
+                fp.write(u'{0}({1}) {2}\n'.format(cur_word, ind + 1, transcriptions[ind]))
+
+
+def save_distorted_lexicon(file_name, n_words, max_variants=2, seed=0, error_probability=0.1):
+    rnd = random.Random(seed + 1)
+    with codecs.open(file_name, mode='w', encoding='utf-8', errors='ignore') as fp:
+        for cur_word, transcriptions in iterate_synthetic_lexicon(n_words, max_variants, seed):
+            for cur_transcription in transcriptions[:rnd.randint(1, len(transcriptions))]:
+                fp.write(u'{0}\t{1}\n'.format(cur_word, distort_transcription(cur_transcription, rnd,
+                                                                               error_probability)))
+
+
+def save_word_list(file_name, n_words, seed=0):
+    with codecs.open(file_name, mode='w', encoding='utf-8', errors='ignore') as fp:
+        for cur_word, _ in iterate_synthetic_lexicon(n_words, 1, seed):
+            fp.write(cur_word + u'\n')
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--dst', dest='dst', type=str, required=True,
+                        help=u'Destination name of synthetic dictionary.')
+    parser.add_argument('-n', '--words', dest='n_words', type=int, required=False, default=10000,
+                        help=u'Number of words in synthetic dictionary.')
+    parser.add_argument('-v', '--variants', dest='max_variants', type=int, required=False, default=2,
+                        help=u'Maximal number of transcription variants per word.')
+    parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help=u'Random seed.')
+    args = parser.parse_args()
+
+    assert args.n_words > 0, u'Number of words must be a positive integer value!'
+    assert args.max_variants > 0, u'Maximal number of transcription variants must be a positive integer value!'
+    dst_name = os.path.normpath(args.dst)
+    save_synthetic_lexicon(dst_name, args.n_words, args.max_variants, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser
-import copy
+from collections import deque
+import codecs
+import math
+import multiprocessing
 import os
 
 from Levenshtein import editops
+import numpy as np
 
 from prepare_dict import load_lexicon
+from lexicon_io import open_for_writing
+from profiling import profile_stage, profiler
 
 
 def prepare_transcriptions_for_levenshtein(first_transcription, second_transcription):
@@ -38,61 +44,450 @@ def prepare_ops(ops):
     return {'replace': n_substitutions, 'delete': n_deletions, 'insert': n_insertions}
 
 
+def encode_transcription(transcription, phonecodes):
+    encoded = list()
+    for cur in transcription.split():
+        if cur not in phonecodes:
+            phonecodes[cur] = 128 + len(phonecodes)
+        encoded.append(chr(phonecodes[cur]))
+    return u''.join(encoded)
+
+
 def find_best_pair(left_transcriptions, right_transcriptions):
-    prep_left, prep_right = prepare_transcriptions_for_levenshtein(left_transcriptions[0], right_transcriptions[0])
-    best_ops = prepare_ops(editops(prep_left, prep_right))
-    best_phone_error_rate = (best_ops['replace'] + best_ops['delete'] + best_ops['insert']) / float(len(prep_left))
-    best_pair = (left_transcriptions[0], right_transcriptions[0])
-    for cur_left in left_transcriptions:
-        for cur_right in right_transcriptions:
-            prep_left, prep_right = prepare_transcriptions_for_levenshtein(cur_left, cur_right)
+    phonecodes = dict()
+    prepared_left = [encode_transcription(cur, phonecodes) for cur in left_transcriptions]
+    prepared_right = [encode_transcription(cur, phonecodes) for cur in right_transcriptions]
+    best_phone_error_rate = None
+    best_ops = None
+    best_pair = None
+    for left_idx, prep_left in enumerate(prepared_left):
+        for right_idx, prep_right in enumerate(prepared_right):
             cur_ops = prepare_ops(editops(prep_left, prep_right))
             cur_phone_error_rate = (cur_ops['replace'] + cur_ops['delete'] + cur_ops['insert']) / float(len(prep_left))
-            if cur_phone_error_rate < best_phone_error_rate:
+            if (best_phone_error_rate is None) or (cur_phone_error_rate < best_phone_error_rate):
                 best_phone_error_rate = cur_phone_error_rate
-                best_ops = copy.copy(cur_ops)
-                best_pair = (cur_left, cur_right)
+                best_ops = cur_ops
+                best_pair = (left_transcriptions[left_idx], right_transcriptions[right_idx])
     return best_pair, best_ops
 
 
-def compare_lexicons(true_lexicon_name, predicted_lexicon_name):
-    true_lexicon = load_lexicon(true_lexicon_name)
-    predicted_lexicon = load_lexicon(predicted_lexicon_name)
-    true_words_set = set(true_lexicon.keys())
-    predicted_words_set = set(predicted_lexicon.keys())
-    if true_words_set != predicted_words_set:
-        for cur_word in (predicted_words_set - true_words_set):
-            true_lexicon[cur_word]= []
-        for cur_word in (true_words_set - predicted_words_set):
-            predicted_lexicon[cur_word] = []
-    assert set(true_lexicon.keys()) == set(predicted_lexicon.keys()), \
-        u'File "{0}" does not correspond to file "{1}": word lists are not equal!'.format(true_lexicon_name,
-                                                                                          predicted_lexicon_name)
-    all_words = sorted(list(true_lexicon))
-    n_substitutions = 0
-    n_deletions = 0
-    n_insertions = 0
-    n_all = 0
-    word_errors = 0
-    for cur_word in all_words:
-        if (len(true_lexicon[cur_word]) == 0) and (len(predicted_lexicon[cur_word]) == 0):
+def calculate_edit_distances(codes, left_offsets, left_lengths, right_offsets, right_lengths, batch_size=16384):
+    distances = np.zeros(left_lengths.shape, dtype=np.int32)
+    order = np.lexsort((right_lengths, left_lengths))
+    for batch_start in range(0, order.shape[0], batch_size):
+        batch = order[batch_start:(batch_start + batch_size)]
+        batch_left_lengths = left_lengths[batch]
+        batch_right_lengths = right_lengths[batch]
+        max_left_length = int(batch_left_lengths.max())
+        max_right_length = int(batch_right_lengths.max())
+        left_positions = np.arange(max_left_length, dtype=np.int64)
+        left_codes = np.where(left_positions < batch_left_lengths[:, np.newaxis],
+                              codes[np.minimum(left_offsets[batch][:, np.newaxis] + left_positions,
+                                               codes.shape[0] - 1)], -1)
+        right_positions = np.arange(max_right_length, dtype=np.int64)
+        right_codes = np.where(right_positions < batch_right_lengths[:, np.newaxis],
+                               codes[np.minimum(right_offsets[batch][:, np.newaxis] + right_positions,
+                                                codes.shape[0] - 1)], -2)
+        columns = np.arange(max_right_length + 1, dtype=np.int32)
+        previous_row = np.tile(columns, (batch.shape[0], 1))
+        batch_rows = np.arange(batch.shape[0])
+        for row_idx in range(1, max_left_length + 1):
+            substitution_costs = (left_codes[:, row_idx - 1][:, np.newaxis] != right_codes).astype(np.int32)
+            candidates = np.empty_like(previous_row)
+            candidates[:, 0] = row_idx
+            candidates[:, 1:] = np.minimum(previous_row[:, 1:] + 1, previous_row[:, :-1] + substitution_costs)
+            current_row = np.minimum.accumulate(candidates - columns, axis=1) + columns
+            finished = (batch_left_lengths == row_idx)
+            distances[batch[finished]] = current_row[batch_rows[finished], batch_right_lengths[finished]]
+            previous_row = current_row
+    return distances
+
+
+ERROR_COUNTERS = ('substitutions', 'deletions', 'insertions', 'phones', 'word_errors', 'words')
+LENGTH_COUNTERS = ('words', 'word_errors', 'phones', 'phone_errors')
+EPSILON = u'<eps>'
+REPORT_HEADER = u'word\ttrue\tpredicted\tsubstitutions\tdeletions\tinsertions\tdiff'
+
+
+class ErrorStatistics(object):
+    """ Error counters and breakdowns, which are accumulated while words are scored.
+
+    Phones are interned into IDs of the global phone inventory `phones`, whose first item is the epsilon. Rows of the
+    `confusion` matrix are true phones, and its columns are predicted phones, so deletions are counted in the epsilon
+    column, insertions are counted in the epsilon row, and correct phones are counted on the diagonal. The i-th row of
+    `length_counters` contains numbers of words, erroneous words, true phones and phone errors for words of i letters.
+    """
+
+    def __init__(self):
+        self.counters = dict((cur, 0) for cur in ERROR_COUNTERS)
+        self.phones = [EPSILON]
+        self.phone_ids = {EPSILON: 0}
+        self.confusion = np.zeros((1, 1), dtype=np.int64)
+        self.length_counters = np.zeros((1, len(LENGTH_COUNTERS)), dtype=np.int64)
+
+    def get_phone_id(self, phone):
+        phone_id = self.phone_ids.get(phone)
+        if phone_id is None:
+            phone_id = len(self.phones)
+            self.phone_ids[phone] = phone_id
+            self.phones.append(phone)
+            self.confusion = np.pad(self.confusion, ((0, 1), (0, 1)), mode='constant')
+        return phone_id
+
+    def reserve_lengths(self, max_length):
+        if max_length >= self.length_counters.shape[0]:
+            self.length_counters = np.pad(self.length_counters,
+                                          ((0, max_length + 1 - self.length_counters.shape[0]), (0, 0)),
+                                          mode='constant')
+
+    def merge(self, other):
+        phone_map = np.array([self.get_phone_id(cur) for cur in other.phones], dtype=np.int64)
+        self.confusion[np.ix_(phone_map, phone_map)] += other.confusion
+        self.reserve_lengths(other.length_counters.shape[0] - 1)
+        self.length_counters[:other.length_counters.shape[0]] += other.length_counters
+        for cur in ERROR_COUNTERS:
+            self.counters[cur] += other.counters[cur]
+        return self
+
+    def get_error_rates(self):
+        n_errors = self.counters['substitutions'] + self.counters['deletions'] + self.counters['insertions']
+        return self.counters['word_errors'] / float(self.counters['words']), n_errors / float(self.counters['phones'])
+
+    def get_sorted(self):
+        # phones are sorted (after the epsilon), so statistics accumulated in any order are exported identically
+        order = [0] + sorted(range(1, len(self.phones)), key=lambda it: self.phones[it])
+        return [self.phones[cur] for cur in order], self.confusion[np.ix_(order, order)]
+
+
+def merge_error_statistics(statistics_list):
+    merged = ErrorStatistics()
+    for cur in statistics_list:
+        merged.merge(cur)
+    return merged
+
+
+def save_error_statistics(file_name, statistics_list):
+    arrays = {'n_statistics': np.array(len(statistics_list))}
+    for statistics_idx, cur in enumerate(statistics_list):
+        arrays['{0}_phones'.format(statistics_idx)] = np.array(cur.phones)
+        arrays['{0}_confusion'.format(statistics_idx)] = cur.confusion
+        arrays['{0}_length_counters'.format(statistics_idx)] = cur.length_counters
+        arrays['{0}_counters'.format(statistics_idx)] = np.array([cur.counters[name] for name in ERROR_COUNTERS],
+                                                                 dtype=np.int64)
+    with open(file_name, 'wb') as fp:
+        np.savez_compressed(fp, **arrays)
+
+
+def load_error_statistics(file_name):
+    statistics_list = list()
+    with np.load(file_name) as arrays:
+        for statistics_idx in range(int(arrays['n_statistics'])):
+            cur = ErrorStatistics()
+            for cur_phone in arrays['{0}_phones'.format(statistics_idx)].tolist()[1:]:
+                cur.get_phone_id(cur_phone)
+            cur.confusion = arrays['{0}_confusion'.format(statistics_idx)]
+            cur.length_counters = arrays['{0}_length_counters'.format(statistics_idx)]
+            cur.counters = dict(zip(ERROR_COUNTERS, arrays['{0}_counters'.format(statistics_idx)].tolist()))
+            statistics_list.append(cur)
+    return statistics_list
+
+
+def save_error_analysis(file_prefix, labeled_statistics):
+    """ Save the confusion matrix, per-phone and per-word-length breakdowns of each labeled statistics (e.g. of each
+    crossvalidation fold) into the NPZ file and into three CSV files with the same prefix.
+    """
+    merged = merge_error_statistics([cur for _, cur in labeled_statistics])
+    phones = merged.get_sorted()[0]
+    n_lengths = merged.length_counters.shape[0]
+    confusion = np.zeros((len(labeled_statistics), len(phones), len(phones)), dtype=np.int64)
+    length_counters = np.zeros((len(labeled_statistics), n_lengths, len(LENGTH_COUNTERS)), dtype=np.int64)
+    counters = np.zeros((len(labeled_statistics), len(ERROR_COUNTERS)), dtype=np.int64)
+    for label_idx, (_, cur_statistics) in enumerate(labeled_statistics):
+        aligned = ErrorStatistics()
+        for cur_phone in phones:
+            aligned.get_phone_id(cur_phone)
+        aligned.merge(cur_statistics)
+        confusion[label_idx] = aligned.confusion
+        length_counters[label_idx, :aligned.length_counters.shape[0]] = aligned.length_counters
+        counters[label_idx] = [aligned.counters[cur] for cur in ERROR_COUNTERS]
+    labels = [cur for cur, _ in labeled_statistics]
+    np.savez_compressed(file_prefix + u'.npz', labels=np.array(labels), phones=np.array(phones), confusion=confusion,
+                        length_counters=length_counters, length_counter_names=np.array(LENGTH_COUNTERS),
+                        counters=counters, counter_names=np.array(ERROR_COUNTERS))
+    with codecs.open(file_prefix + u'_confusion.csv', mode='w', encoding='utf-8', errors='ignore') as fp:
+        fp.write(u'fold,true,predicted,count\n')
+        for label_idx, cur_label in enumerate(labels):
+            for true_id, predicted_id in zip(*np.nonzero(confusion[label_idx])):
+                fp.write(u'{0},{1},{2},{3}\n'.format(cur_label, phones[true_id], phones[predicted_id],
+                                                     confusion[label_idx, true_id, predicted_id]))
+    with codecs.open(file_prefix + u'_phones.csv', mode='w', encoding='utf-8', errors='ignore') as fp:
+        fp.write(u'fold,phone,occurrences,substitutions,deletions,insertions,error_rate\n')
+        for label_idx, cur_label in enumerate(labels):
+            for phone_id in range(1, len(phones)):
+                occurrences = int(confusion[label_idx, phone_id].sum())
+                deletions = int(confusion[label_idx, phone_id, 0])
+                substitutions = occurrences - deletions - int(confusion[label_idx, phone_id, phone_id])
+                if occurrences + int(confusion[label_idx, 0, phone_id]) == 0:
+                    continue
+                fp.write(u'{0},{1},{2},{3},{4},{5},{6:.6f}\n'.format(
+                    cur_label, phones[phone_id], occurrences, substitutions, deletions,
+                    int(confusion[label_idx, 0, phone_id]),
+                    (substitutions + deletions) / float(occurrences) if occurrences > 0 else 0.0))
+    with codecs.open(file_prefix + u'_lengths.csv', mode='w', encoding='utf-8', errors='ignore') as fp:
+        fp.write(u'fold,length,words,word_errors,phones,phone_errors,word_error_rate,phone_error_rate\n')
+        for label_idx, cur_label in enumerate(labels):
+            for word_length in range(n_lengths):
+                n_words, n_word_errors, n_phones, n_phone_errors = length_counters[label_idx, word_length].tolist()
+                if n_words == 0:
+                    continue
+                fp.write(u'{0},{1},{2},{3},{4},{5},{6:.6f},{7:.6f}\n'.format(
+                    cur_label, word_length, n_words, n_word_errors, n_phones, n_phone_errors,
+                    n_word_errors / float(n_words), n_phone_errors / float(n_phones) if n_phones > 0 else 0.0))
+
+
+def format_word_report(word, true_transcription, predicted_transcription, ops):
+    true_phones = true_transcription.split()
+    predicted_phones = predicted_transcription.split()
+    diff = list()
+    for op_name, true_idx, predicted_idx in ops:
+        if op_name == 'replace':
+            diff.append(u'{0}>{1}'.format(true_phones[true_idx], predicted_phones[predicted_idx]))
+        elif op_name == 'delete':
+            diff.append(u'-' + true_phones[true_idx])
+        else:
+            diff.append(u'+' + predicted_phones[predicted_idx])
+    n_ops = prepare_ops(ops)
+    return u'\t'.join([word, true_transcription, predicted_transcription, str(n_ops['replace']),
+                       str(n_ops['delete']), str(n_ops['insert']), u' '.join(diff)])
+
+
+def score_words(words, true_lexicon, predicted_lexicon, statistics, report=None):
+    """ Score words by the best pair of true and predicted transcriptions and accumulate errors into `statistics`.
+    Edit distances of all pairs are calculated by the vectorized dynamic programming, and edit operations are restored
+    only for erroneous best pairs, so the confusion matrix and breakdowns need no extra alignment. Lines of the
+    per-word report (only for erroneous words, in order of `words`) are appended into `report` if it is specified.
+    """
+    phone_ids = statistics.phone_ids
+    counters = statistics.counters
+    codes = list()
+    left_offsets = list()
+    left_lengths = list()
+    right_offsets = list()
+    right_lengths = list()
+    pair_words = list()
+    word_lengths = list()
+    word_reports = list()
+    missing_true_ids = list()
+    missing_predicted_ids = list()
+    length_updates = list()
+    for word_idx, cur_word in enumerate(words):
+        word_lengths.append(len(cur_word))
+        true_transcriptions = true_lexicon.get(cur_word, [])
+        predicted_transcriptions = predicted_lexicon.get(cur_word, [])
+        if (len(true_transcriptions) == 0) and (len(predicted_transcriptions) == 0):
             continue
-        if (len(true_lexicon[cur_word]) > 0) and (len(predicted_lexicon[cur_word]) > 0):
-            best_pair, ops = find_best_pair(true_lexicon[cur_word], predicted_lexicon[cur_word])
-            n_all += len(best_pair[0].split())
-            n_deletions += ops['delete']
-            n_insertions += ops['insert']
-            n_substitutions += ops['replace']
-            if (ops['delete'] > 0) or (ops['insert'] > 0) or (ops['replace'] > 0):
-                word_errors += 1
+        counters['words'] += 1
+        if (len(true_transcriptions) > 0) and (len(predicted_transcriptions) > 0):
+            encoded = list()
+            for cur_transcription in list(true_transcriptions) + list(predicted_transcriptions):
+                phones = cur_transcription.split()
+                encoded.append((len(codes), len(phones)))
+                try:
+                    codes.extend([phone_ids[cur_phone] for cur_phone in phones])
+                except KeyError:
+                    codes.extend([statistics.get_phone_id(cur_phone) for cur_phone in phones])
+            for left_offset, left_length in encoded[:len(true_transcriptions)]:
+                for right_offset, right_length in encoded[len(true_transcriptions):]:
+                    left_offsets.append(left_offset)
+                    left_lengths.append(left_length)
+                    right_offsets.append(right_offset)
+                    right_lengths.append(right_length)
+                    pair_words.append(word_idx)
         else:
-            if len(true_lexicon[cur_word]) > 0:
-                n_all += len(true_lexicon[cur_word][0].split())
-                n_deletions += len(true_lexicon[cur_word][0].split())
+            if len(true_transcriptions) > 0:
+                phones = true_transcriptions[0].split()
+                counters['phones'] += len(phones)
+                counters['deletions'] += len(phones)
+                missing_true_ids += [statistics.get_phone_id(cur_phone) for cur_phone in phones]
+                missing_predicted_ids += [0] * len(phones)
+                length_updates.append((len(cur_word), len(phones), len(phones)))
+                if report is not None:
+                    word_reports.append((word_idx, format_word_report(
+                        cur_word, true_transcriptions[0], u'', [('delete', idx, 0) for idx in range(len(phones))]
+                    )))
             else:
-                n_insertions += len(predicted_lexicon[cur_word][0].split())
-            word_errors += 1
-    return word_errors / float(len(all_words)), (n_substitutions + n_deletions + n_insertions) / float(n_all)
+                phones = predicted_transcriptions[0].split()
+                counters['insertions'] += len(phones)
+                missing_true_ids += [0] * len(phones)
+                missing_predicted_ids += [statistics.get_phone_id(cur_phone) for cur_phone in phones]
+                length_updates.append((len(cur_word), 0, len(phones)))
+                if report is not None:
+                    word_reports.append((word_idx, format_word_report(
+                        cur_word, u'', predicted_transcriptions[0], [('insert', 0, idx) for idx in range(len(phones))]
+                    )))
+            counters['word_errors'] += 1
+    statistics.reserve_lengths(max(word_lengths) if len(word_lengths) > 0 else 0)
+    confusion_true_ids = list()
+    confusion_predicted_ids = list()
+    if len(missing_true_ids) > 0:
+        confusion_true_ids.append(np.array(missing_true_ids, dtype=np.int64))
+        confusion_predicted_ids.append(np.array(missing_predicted_ids, dtype=np.int64))
+    if len(length_updates) > 0:
+        length_updates = np.array(length_updates, dtype=np.int64)
+        np.add.at(statistics.length_counters, (length_updates[:, 0], 0), 1)
+        np.add.at(statistics.length_counters, (length_updates[:, 0], 1), 1)
+        np.add.at(statistics.length_counters, (length_updates[:, 0], 2), length_updates[:, 1])
+        np.add.at(statistics.length_counters, (length_updates[:, 0], 3), length_updates[:, 2])
+    if len(pair_words) > 0:
+        codes = np.array(codes, dtype=np.int32)
+        pair_left_offsets = np.array(left_offsets, dtype=np.int64)
+        pair_left_lengths = np.array(left_lengths, dtype=np.int64)
+        distances = calculate_edit_distances(
+            codes, pair_left_offsets, pair_left_lengths,
+            np.array(right_offsets, dtype=np.int64), np.array(right_lengths, dtype=np.int64)
+        )
+        pair_words = np.array(pair_words, dtype=np.int64)
+        phone_error_rates = distances / pair_left_lengths.astype(np.float64)
+        order = np.lexsort((phone_error_rates, pair_words))
+        is_best = np.ones(order.shape, dtype=bool)
+        is_best[1:] = pair_words[order[1:]] != pair_words[order[:-1]]
+        best_pairs = order[is_best]
+        counters['phones'] += int(pair_left_lengths[best_pairs].sum())
+        best_word_lengths = np.array(word_lengths, dtype=np.int64)[pair_words[best_pairs]]
+        np.add.at(statistics.length_counters, (best_word_lengths, 0), 1)
+        np.add.at(statistics.length_counters, (best_word_lengths, 1), (distances[best_pairs] > 0).astype(np.int64))
+        np.add.at(statistics.length_counters, (best_word_lengths, 2), pair_left_lengths[best_pairs])
+        np.add.at(statistics.length_counters, (best_word_lengths, 3), distances[best_pairs])
+        # all true phones of the best pairs are counted as correct, and then erroneous ones are moved off the diagonal
+        best_lengths = pair_left_lengths[best_pairs]
+        best_positions = np.repeat(pair_left_offsets[best_pairs] - np.cumsum(best_lengths) + best_lengths,
+                                   best_lengths) + np.arange(int(best_lengths.sum()), dtype=np.int64)
+        statistics.confusion[np.diag_indices(statistics.confusion.shape[0])] += np.bincount(
+            codes[best_positions], minlength=statistics.confusion.shape[0]
+        )
+        erroneous_pairs = best_pairs[distances[best_pairs] > 0]
+        counters['word_errors'] += int(erroneous_pairs.shape[0])
+        if erroneous_pairs.shape[0] > 0:
+            # all phone codes as a single string, so edit operations are restored by slices without re-encoding
+            encoded_codes = (codes + 128).astype('<u4').tobytes().decode('utf-32-le')
+            all_ops = list()
+            n_ops = list()
+            for pair_idx in erroneous_pairs.tolist():
+                left_start = left_offsets[pair_idx]
+                left_end = left_start + left_lengths[pair_idx]
+                right_start = right_offsets[pair_idx]
+                right_end = right_start + right_lengths[pair_idx]
+                ops = editops(encoded_codes[left_start:left_end], encoded_codes[right_start:right_end])
+                all_ops += ops
+                n_ops.append(len(ops))
+                if report is not None:
+                    word_idx = int(pair_words[pair_idx])
+                    word_reports.append((word_idx, format_word_report(
+                        words[word_idx],
+                        u' '.join([statistics.phones[cur] for cur in codes[left_start:left_end].tolist()]),
+                        u' '.join([statistics.phones[cur] for cur in codes[right_start:right_end].tolist()]), ops
+                    )))
+            op_names, op_true_indices, op_predicted_indices = zip(*all_ops)
+            op_names = np.array(op_names)
+            is_insertion = (op_names == 'insert')
+            is_deletion = (op_names == 'delete')
+            n_ops = np.array(n_ops, dtype=np.int64)
+            op_true_positions = np.repeat(pair_left_offsets[erroneous_pairs], n_ops) + \
+                np.array(op_true_indices, dtype=np.int64)
+            op_predicted_positions = np.repeat(np.array(right_offsets, dtype=np.int64)[erroneous_pairs], n_ops) + \
+                np.array(op_predicted_indices, dtype=np.int64)
+            # an insertion has no true phone, and a deletion has no predicted phone (their positions may be wrong)
+            op_true_ids = np.where(is_insertion, 0, codes[np.minimum(op_true_positions, codes.shape[0] - 1)])
+            op_predicted_ids = np.where(is_deletion, 0, codes[np.minimum(op_predicted_positions, codes.shape[0] - 1)])
+            counters['insertions'] += int(np.count_nonzero(is_insertion))
+            counters['deletions'] += int(np.count_nonzero(is_deletion))
+            counters['substitutions'] += int(op_names.shape[0] - np.count_nonzero(is_insertion | is_deletion))
+            confusion_true_ids.append(op_true_ids)
+            confusion_predicted_ids.append(op_predicted_ids)
+            # substituted and deleted true phones were counted on the diagonal as correct ones
+            statistics.confusion[np.diag_indices(statistics.confusion.shape[0])] -= np.bincount(
+                op_true_ids[~is_insertion], minlength=statistics.confusion.shape[0]
+            )
+    if len(confusion_true_ids) > 0:
+        n_phones = statistics.confusion.shape[0]
+        confusion_true_ids = np.concatenate(confusion_true_ids)
+        confusion_predicted_ids = np.concatenate(confusion_predicted_ids)
+        statistics.confusion += np.bincount(confusion_true_ids * n_phones + confusion_predicted_ids,
+                                            minlength=n_phones * n_phones).reshape((n_phones, n_phones))
+    if report is not None:
+        word_reports.sort(key=lambda it: it[0])
+        report.extend([cur[1] for cur in word_reports])
+    return statistics
+
+
+def _score_chunk(task):
+    entries, with_report = task
+    true_lexicon = dict((cur_word, true_transcriptions) for cur_word, true_transcriptions, _ in entries)
+    predicted_lexicon = dict((cur_word, predicted_transcriptions) for cur_word, _, predicted_transcriptions in entries)
+    report = list() if with_report else None
+    statistics = score_words([cur[0] for cur in entries], true_lexicon, predicted_lexicon, ErrorStatistics(), report)
+    return statistics, report
+
+
+def iterate_chunk_tasks(all_words, true_lexicon, predicted_lexicon, words_per_chunk, with_report):
+    for chunk_start in range(0, len(all_words), words_per_chunk):
+        yield [(cur_word, list(true_lexicon.get(cur_word, [])), list(predicted_lexicon.get(cur_word, [])))
+               for cur_word in all_words[chunk_start:(chunk_start + words_per_chunk)]], with_report
+
+
+def count_errors(true_lexicon, predicted_lexicon, n_jobs=1, report_fp=None, words_per_batch=50000):
+    """ Count substitutions, deletions, insertions and word errors for all words of both lexicons, together with the
+    confusion matrix and breakdowns (see `ErrorStatistics`).
+
+    The sorted word set is split into chunks, and if `n_jobs` > 1, then chunks with their transcriptions are scored in
+    worker processes. No more than 2 * `n_jobs` chunks are in flight, and results are merged in order of chunks, so
+    statistics are exactly the same as for a single process, and the per-word report (if `report_fp` is specified) is
+    streamed into this file in order of words without keeping it in memory.
+    """
+    all_words = sorted(set(true_lexicon.keys()) | set(predicted_lexicon.keys()))
+    statistics = ErrorStatistics()
+    if report_fp is not None:
+        report_fp.write(REPORT_HEADER + u'\n')
+
+    def write_chunk_report(chunk_report):
+        if (report_fp is not None) and (len(chunk_report) > 0):
+            report_fp.write(u'\n'.join(chunk_report) + u'\n')
+
+    if n_jobs > 1:
+        words_per_chunk = max(min(words_per_batch, int(math.ceil(len(all_words) / float(4 * n_jobs)))), 1000)
+        pool = multiprocessing.Pool(processes=n_jobs)
+        try:
+            pending = deque()
+            for cur_task in iterate_chunk_tasks(all_words, true_lexicon, predicted_lexicon, words_per_chunk,
+                                                report_fp is not None):
+                if len(pending) >= 2 * n_jobs:
+                    chunk_statistics, chunk_report = pending.popleft().get()
+                    statistics.merge(chunk_statistics)
+                    write_chunk_report(chunk_report)
+                pending.append(pool.apply_async(_score_chunk, (cur_task,)))
+            while len(pending) > 0:
+                chunk_statistics, chunk_report = pending.popleft().get()
+                statistics.merge(chunk_statistics)
+                write_chunk_report(chunk_report)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for batch_start in range(0, len(all_words), words_per_batch):
+            report = None if report_fp is None else list()
+            score_words(all_words[batch_start:(batch_start + words_per_batch)], true_lexicon, predicted_lexicon,
+                        statistics, report)
+            write_chunk_report(report)
+    return statistics
+
+
+def calculate_error_rates(true_lexicon, predicted_lexicon, words_per_batch=50000, n_jobs=1):
+    statistics = count_errors(true_lexicon, predicted_lexicon, n_jobs=n_jobs, words_per_batch=words_per_batch)
+    return statistics.get_error_rates()
+
+
+def compare_lexicons(true_lexicon_name, predicted_lexicon_name, n_jobs=1):
+    return calculate_error_rates(load_lexicon(true_lexicon_name), load_lexicon(predicted_lexicon_name), n_jobs=n_jobs)
 
 
 def main():
@@ -101,6 +496,15 @@ def main():
                         help=u'Name of true phonetical dictionary.')
     parser.add_argument('-p', '--predicted', dest='predicted_lexicon_name', type=str, required=True,
                         help=u'Name of predicted phonetical dictionary.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, required=False, default=1,
+                        help=u'Number of parallel processes for scoring.')
+    parser.add_argument('--per-word-report', dest='per_word_report', type=str, required=False, default=None,
+                        help=u'A TSV file into which differences of erroneous words shall be written.')
+    parser.add_argument('--error-analysis', dest='error_analysis', type=str, required=False, default=None,
+                        help=u'A prefix of NPZ and CSV files into which the phone confusion matrix and error '
+                             u'breakdowns by phone and by word length shall be written.')
+    parser.add_argument('--profile-json', dest='profile_json', type=str, required=False, default=None,
+                        help=u'A JSON file into which time, CPU and memory usage of all stages shall be written.')
     args = parser.parse_args()
 
     true_file_name = os.path.normpath(args.true_lexicon_name)
@@ -108,9 +512,40 @@ def main():
 
     predicted_file_name = os.path.normpath(args.predicted_lexicon_name)
     assert os.path.isfile(predicted_file_name), 'File "{0}" does not exist!'.format(predicted_file_name)
+    assert args.jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+    report_name = None
+    if args.per_word_report is not None:
+        report_name = os.path.normpath(args.per_word_report)
+        report_dir = os.path.dirname(report_name)
+        assert (len(report_dir) == 0) or os.path.isdir(report_dir), \
+            u'Directory "{0}" does not exist!'.format(report_dir)
+    if args.error_analysis is not None:
+        analysis_dir = os.path.dirname(args.error_analysis)
+        assert (len(analysis_dir) == 0) or os.path.isdir(analysis_dir), \
+            u'Directory "{0}" does not exist!'.format(analysis_dir)
 
-    wer, per = compare_lexicons(true_file_name, predicted_file_name)
+    with profile_stage(u'lexicon_loading', lexicon=u'true') as cur_stage:
+        true_lexicon = load_lexicon(true_file_name)
+        cur_stage['items'] = len(true_lexicon)
+    with profile_stage(u'lexicon_loading', lexicon=u'predicted') as cur_stage:
+        predicted_lexicon = load_lexicon(predicted_file_name)
+        cur_stage['items'] = len(predicted_lexicon)
+    with profile_stage(u'scoring', jobs=args.jobs) as cur_stage:
+        if report_name is None:
+            statistics = count_errors(true_lexicon, predicted_lexicon, n_jobs=args.jobs)
+        else:
+            with open_for_writing(report_name) as fp:
+                statistics = count_errors(true_lexicon, predicted_lexicon, n_jobs=args.jobs, report_fp=fp)
+        cur_stage['items'] = statistics.counters['words']
+    if args.error_analysis is not None:
+        save_error_analysis(args.error_analysis, [(u'all', statistics)])
+    if args.profile_json is not None:
+        profiler.save_json(args.profile_json, script_name=u'compare_lexicons.py')
+    counters = statistics.counters
+    wer, per = statistics.get_error_rates()
     print(u'')
+    print(u'Substitutions: {0}, deletions: {1}, insertions: {2} (of {3} phones).'.format(
+        counters['substitutions'], counters['deletions'], counters['insertions'], counters['phones']))
     print(u'Word error rate: {0:.2%}'.format(wer))
     print(u'Phone error rate: {0:.2%}'.format(per))
 
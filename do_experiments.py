@@ -2,15 +2,26 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser
-import codecs
+import asyncio
+from functools import partial
+import json
+import multiprocessing
 import os
 import random
+import shutil
+import signal
 import tempfile
 
 import numpy as np
 
-from prepare_dict import load_lexicon
-from compare_lexicons import compare_lexicons
+from prepare_dict import add_to_lexicon, load_lexicon, read_word_list
+from lexicon_io import LEXICON_FORMATS, LexiconWriter, is_readable, iterate_merged_entries, write_lexicon
+from compare_lexicons import count_errors, load_error_statistics, merge_error_statistics, save_error_analysis, \
+    save_error_statistics
+from g2p_engine import G2PEngine, filter_by_pmass
+from model_store import ModelStore, calculate_file_hash, install_model, prune_model_store
+from job_runner import JobRunner, run_until_complete
+from profiling import StageProfiler, profile_stage, profiler
 
 
 def create_tmp_file_name():
@@ -21,40 +32,383 @@ def create_tmp_file_name():
     return filename
 
 
-def split_words_and_transcriptions_for_cv(words_and_transcriptions, cv):
+def create_tmp_dir_name():
+    basedir = os.path.join(os.path.dirname(__file__), 'data', 'tmp')
+    return tempfile.mkdtemp(dir=basedir)
+
+
+def prepare_fold(fold, fold_dir, fold_profiler):
+    tmp_file_for_training = os.path.join(fold_dir, 'training.dic')
+    with fold_profiler.stage(u'fold_writing') as cur_stage:
+        n_training_entries = fold.save_training_part(tmp_file_for_training)
+        true_lexicon = dict()
+        for cur_word, cur_transcription in fold.iterate_entries(fold.get_testing_indices()):
+            add_to_lexicon(true_lexicon, cur_word, cur_transcription)
+        cur_stage['items'] = n_training_entries
+    return tmp_file_for_training, n_training_entries, true_lexicon
+
+
+async def evaluate_fold(fold, ngram, pmass, store_dir, runner, fold_profiler):
+    fold_dir = create_tmp_dir_name()
+    try:
+        tmp_file_for_training, n_training_entries, true_lexicon = prepare_fold(fold, fold_dir, fold_profiler)
+        model_store = ModelStore(store_dir, verbose=False, runner=runner)
+        with fold_profiler.stage(u'training') as cur_stage:
+            fst_name = await model_store.train_async(tmp_file_for_training, ngram)
+            cur_stage['items'] = n_training_entries
+        with fold_profiler.stage(u'decoding') as cur_stage:
+            with G2PEngine(fst_name, pmass, runner=runner) as g2p_engine:
+                predicted_lexicon = await g2p_engine.transcribe_async(sorted(true_lexicon.keys()))
+            cur_stage['items'] = len(true_lexicon)
+        with fold_profiler.stage(u'scoring') as cur_stage:
+            statistics = count_errors(true_lexicon, predicted_lexicon)
+            cur_stage['items'] = len(true_lexicon)
+    finally:
+        shutil.rmtree(fold_dir, ignore_errors=True)
+    return statistics, model_store.stages_log
+
+
+async def evaluate_fold_sweep(fold, ngrams, pmasses, store_dir, runner, fold_profiler):
+    """ Evaluate all combinations of N-gram sizes and probability mass constraints on the fold. The training lexicon is
+    aligned once for all N-gram sizes, the test words are decoded once by each model with the widest N-best list, and
+    variants for each probability mass constraint are selected from this N-best list without decoding.
+    """
+    fold_dir = create_tmp_dir_name()
+    error_rates = np.zeros((len(ngrams), len(pmasses), 2), dtype=np.float64)
+    statistics = [[None for _ in range(len(pmasses))] for _ in range(len(ngrams))]
+    try:
+        tmp_file_for_training, n_training_entries, true_lexicon = prepare_fold(fold, fold_dir, fold_profiler)
+        model_store = ModelStore(store_dir, verbose=False, runner=runner)
+        words = sorted(true_lexicon.keys())
+
+        async def evaluate_ngram(ngram_idx):
+            with fold_profiler.stage(u'training', ngram=ngrams[ngram_idx]) as cur_stage:
+                fst_name = await model_store.train_async(tmp_file_for_training, ngrams[ngram_idx])
+                cur_stage['items'] = n_training_entries
+            with fold_profiler.stage(u'decoding', ngram=ngrams[ngram_idx]) as cur_stage:
+                with G2PEngine(fst_name, runner=runner) as g2p_engine:
+                    scored_lexicon = await g2p_engine.transcribe_with_scores_async(words)
+                cur_stage['items'] = len(words)
+            with fold_profiler.stage(u'scoring', ngram=ngrams[ngram_idx]) as cur_stage:
+                for pmass_idx, cur_pmass in enumerate(pmasses):
+                    predicted_lexicon = dict((cur_word, filter_by_pmass(scored_lexicon[cur_word], cur_pmass))
+                                             for cur_word in scored_lexicon)
+                    statistics[ngram_idx][pmass_idx] = count_errors(true_lexicon, predicted_lexicon)
+                    error_rates[ngram_idx, pmass_idx] = statistics[ngram_idx][pmass_idx].get_error_rates()
+                cur_stage['items'] = len(words) * len(pmasses)
+
+        await asyncio.gather(*[evaluate_ngram(ngram_idx) for ngram_idx in range(len(ngrams))])
+    finally:
+        shutil.rmtree(fold_dir, ignore_errors=True)
+    return error_rates, statistics, model_store.stages_log
+
+
+_fold_lexicon = None
+
+
+def set_fold_lexicon(words_and_transcriptions, words, permutation):
+    global _fold_lexicon
+    _fold_lexicon = (words_and_transcriptions, words, permutation)
+
+
+def stop_fold_worker(signum, frame):
+    # the signal is handled only once, so cleanup of the fold is not interrupted by another one
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit(1)
+
+
+def _initialize_fold_worker(lexicon_name, permutation):
+    # Ctrl-C is handled by the parent process, which terminates the pool by SIGTERM, and this signal is turned into an
+    # exception, so the job runner kills running commands of the fold, and its temporary directory is removed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, stop_fold_worker)
+    words_and_transcriptions = load_lexicon(lexicon_name)
+    set_fold_lexicon(words_and_transcriptions, sorted(words_and_transcriptions.keys()), permutation)
+
+
+def evaluate_fold_task(task):
+    fold_idx, start_idx, end_idx, evaluate, max_concurrency, timeout = task
+    fold = CrossValidationFold(*(_fold_lexicon + (start_idx, end_idx)))
+    fold_profiler = StageProfiler()
+    with fold_profiler.stage(u'fold', fold=fold_idx + 1):
+        result = run_until_complete(evaluate(fold, runner=JobRunner(max_concurrency, timeout),
+                                             fold_profiler=fold_profiler))
+    for cur_record in fold_profiler.records:
+        cur_record['labels']['fold'] = fold_idx + 1
+    return fold_idx, result, fold_profiler.records
+
+
+def evaluate_folds(folds, lexicon_name, evaluate, n_jobs, timeout, fold_handler):
+    """ Evaluate folds (pairs of a fold index and a fold, so a resumed run evaluates only folds, which are not
+    completed yet) of the lexicon from the file `lexicon_name` and pass results to the handler as soon as they are
+    ready.
+
+    Folds are evaluated in a pool of worker processes, so CPU-bound work of a fold (fold writing, scoring and
+    in-process decoding) does not compete with other folds for the GIL, and the profile of each fold is recorded in the
+    process, which evaluates it. Each worker loads the lexicon from the file by itself (a binary lexicon is opened
+    through mmap, and it cannot be pickled), so the pool works with any start method. No more than n_jobs external
+    commands are running at any moment: each of min(n_jobs, number of folds) workers has its own job runner with an
+    equal share of n_jobs. If any fold fails, then other workers are terminated, and their running commands are killed.
+    """
+    if len(folds) == 0:
+        return
+    first_fold = folds[0][1]
+    n_processes = min(n_jobs, len(folds))
+    tasks = [(fold_idx, cur_fold.start_idx, cur_fold.end_idx, evaluate, n_jobs // n_processes, timeout)
+             for fold_idx, cur_fold in folds]
+    if n_processes > 1:
+        pool = multiprocessing.Pool(processes=n_processes, initializer=_initialize_fold_worker,
+                                    initargs=(lexicon_name, first_fold.permutation))
+    else:
+        pool = None
+        set_fold_lexicon(first_fold.words_and_transcriptions, first_fold.words, first_fold.permutation)
+    try:
+        if pool is None:
+            evaluated_folds = map(evaluate_fold_task, tasks)
+        else:
+            evaluated_folds = pool.imap_unordered(evaluate_fold_task, tasks)
+        for fold_idx, result, fold_records in evaluated_folds:
+            fold_handler(fold_idx, result, fold_records)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        set_fold_lexicon(None, None, None)
+
+
+def print_stages_log(fold_idx, stages_log):
+    for stage_name, target_name, is_cached in stages_log:
+        print(u'Fold {0}: stage "{1}" is {2}: {3}'.format(fold_idx + 1, stage_name,
+                                                         u'cached' if is_cached else u'rebuilt', target_name))
+
+
+def parse_sweep(sweep_items):
+    sweep = dict()
+    for cur_item in sweep_items:
+        parts = cur_item.split(u'=')
+        assert (len(parts) == 2) and (parts[0] in {'ngram', 'pmass'}) and (parts[0] not in sweep), \
+            u'Sweep parameter "{0}" is wrong!'.format(cur_item)
+        values = list()
+        try:
+            for cur_value in parts[1].split(u','):
+                if parts[0] == 'pmass':
+                    values.append(float(cur_value))
+                elif u'..' in cur_value:
+                    start_value, end_value = cur_value.split(u'..')
+                    values += list(range(int(start_value), int(end_value) + 1))
+                else:
+                    values.append(int(cur_value))
+        except ValueError:
+            values = list()
+        assert len(values) > 0, u'Sweep parameter "{0}" is wrong!'.format(cur_item)
+        sweep[parts[0]] = sorted(set(values))
+    for cur_ngram in sweep.get('ngram', []):
+        assert cur_ngram > 1, u'Maximal N-gram size is too small!'
+    for cur_pmass in sweep.get('pmass', []):
+        assert (cur_pmass > 0.0) and (cur_pmass <= 1.0), u'% of total probability mass constraint is wrong!'
+    return sweep
+
+
+def print_fold_result(fold_idx, word_error_rate, phone_error_rate, stages_log):
+    print_stages_log(fold_idx, stages_log)
+    print(u'Fold {0}: word error rate is {1:.2%}, phone error rate is {2:.2%}.'.format(
+        fold_idx + 1, word_error_rate, phone_error_rate))
+
+
+class CrossValidationFold(object):
+    """ Lazy view of a crossvalidation fold: a range of positions in the shuffled permutation of word indices.
+
+    Indices refer to the sorted list of words shared by all folds, so sorted indices give sorted words, and training
+    and testing parts are written into files straight from the lexicon, without formatted copies of its entries.
+    """
+
+    def __init__(self, words_and_transcriptions, words, permutation, start_idx, end_idx):
+        self.words_and_transcriptions = words_and_transcriptions
+        self.words = words
+        self.permutation = permutation
+        self.start_idx = start_idx
+        self.end_idx = end_idx
+
+    def __len__(self):
+        return self.end_idx - self.start_idx
+
+    def get_testing_indices(self):
+        return np.sort(self.permutation[self.start_idx:self.end_idx])
+
+    def get_training_indices(self):
+        mask = np.ones(len(self.words), dtype=np.bool_)
+        mask[self.permutation[self.start_idx:self.end_idx]] = False
+        return np.flatnonzero(mask)
+
+    def iterate_entries(self, indices):
+        for word_idx in indices:
+            cur_word = self.words[word_idx]
+            for cur_transcription in self.words_and_transcriptions[cur_word]:
+                yield cur_word, cur_transcription
+
+    def save(self, indices, file_name):
+        with LexiconWriter(file_name, 'tab') as writer:
+            for word_idx in indices:
+                cur_word = self.words[word_idx]
+                writer.write(cur_word, self.words_and_transcriptions[cur_word])
+        return writer.n_entries
+
+    def save_training_part(self, file_name):
+        return self.save(self.get_training_indices(), file_name)
+
+    def save_testing_part(self, file_name):
+        return self.save(self.get_testing_indices(), file_name)
+
+
+class CrossValidationRun(object):
+    """ Run directory of the crossvalidation with its settings, the shuffled permutation of words and results of
+    completed folds ("foldN.npz" and "foldN.json", which is written last), so an interrupted run can be resumed.
+    """
+
+    def __init__(self, run_dir, settings):
+        self.run_dir = run_dir
+        self.settings = json.loads(json.dumps(settings, sort_keys=True))
+
+    def get_file_name(self, base_name):
+        return os.path.join(self.run_dir, base_name)
+
+    def get_fold_file_name(self, fold_idx, extension):
+        return self.get_file_name(u'fold{0}{1}'.format(fold_idx + 1, extension))
+
+    def save_file(self, file_name, save):
+        tmp_name = u'{0}.tmp{1}'.format(file_name, os.getpid())
+        try:
+            save(tmp_name)
+            os.rename(tmp_name, file_name)
+        finally:
+            if os.path.isfile(tmp_name):
+                os.remove(tmp_name)
+
+    def save_json(self, file_name, data):
+        def save(tmp_name):
+            with open(tmp_name, mode='w', encoding='utf-8') as fp:
+                json.dump(data, fp, ensure_ascii=False, indent=4, sort_keys=True)
+        self.save_file(file_name, save)
+
+    def start(self, resume):
+        """ Prepare the run directory and return True, if the previous run with the same settings is resumed.
+        Otherwise results of the previous run are removed.
+        """
+        settings_name = self.get_file_name(u'run.json')
+        if resume and os.path.isfile(settings_name):
+            with open(settings_name, mode='r', encoding='utf-8') as fp:
+                saved_settings = json.load(fp)
+            assert saved_settings == self.settings, u'Run directory "{0}" is created with other settings, so this ' \
+                                                    u'run cannot be resumed!'.format(self.run_dir)
+            return True
+        if os.path.isdir(self.run_dir):
+            for base_name in os.listdir(self.run_dir):
+                if base_name.startswith(u'fold') or (base_name in {u'run.json', u'permutation.npy'}):
+                    os.remove(self.get_file_name(base_name))
+        else:
+            os.makedirs(self.run_dir)
+        self.save_json(settings_name, self.settings)
+        return False
+
+    def load_permutation(self):
+        permutation_name = self.get_file_name(u'permutation.npy')
+        if not os.path.isfile(permutation_name):
+            return None
+        return np.load(permutation_name)
+
+    def save_permutation(self, permutation):
+        def save(tmp_name):
+            with open(tmp_name, 'wb') as fp:
+                np.save(fp, permutation)
+        self.save_file(self.get_file_name(u'permutation.npy'), save)
+
+    def load_fold(self, fold_idx):
+        summary_name = self.get_fold_file_name(fold_idx, u'.json')
+        if not os.path.isfile(summary_name):
+            return None
+        with open(summary_name, mode='r', encoding='utf-8') as fp:
+            summary = json.load(fp)
+        stages_log = [tuple(cur) for cur in summary['stages_log']]
+        fold_records = summary['profile']
+        for cur_record in fold_records:
+            cur_record['labels']['restored'] = True
+        return load_error_statistics(self.get_fold_file_name(fold_idx, u'.npz')), stages_log, fold_records
+
+    def save_fold(self, fold_idx, statistics_list, stages_log, fold_records):
+        self.save_file(self.get_fold_file_name(fold_idx, u'.npz'),
+                       lambda tmp_name: save_error_statistics(tmp_name, statistics_list))
+        self.save_json(self.get_fold_file_name(fold_idx, u'.json'), {
+            'fold': fold_idx + 1,
+            'error_rates': [list(cur.get_error_rates()) for cur in statistics_list],
+            'stages_log': [list(cur) for cur in stages_log],
+            'profile': fold_records
+        })
+
+    def restore_folds(self, folds, fold_handler, restore_result):
+        """ Pass results of completed folds to the handler and return other folds, which are to be evaluated. Stages
+        of the training and profile records of completed folds are restored too (records are labeled as restored).
+        """
+        remaining_folds = list()
+        for fold_idx, cur_fold in folds:
+            saved_fold = self.load_fold(fold_idx)
+            if saved_fold is None:
+                remaining_folds.append((fold_idx, cur_fold))
+            else:
+                statistics_list, stages_log, fold_records = saved_fold
+                print(u'Fold {0} is restored from the run directory.'.format(fold_idx + 1))
+                fold_handler(fold_idx, restore_result(statistics_list, stages_log), fold_records)
+        return remaining_folds
+
+    def create_fold_handler(self, fold_handler, get_statistics):
+        """ Wrap the handler of fold results, so each evaluated fold is saved before its handling. """
+        def handle_fold_result(fold_idx, result, fold_records):
+            self.save_fold(fold_idx, get_statistics(result), result[-1], fold_records)
+            fold_handler(fold_idx, result, fold_records)
+        return handle_fold_result
+
+
+def iterate_folds(words_and_transcriptions, words, permutation, cv):
+    for fold_ind in range(cv):
+        yield CrossValidationFold(words_and_transcriptions, words, permutation,
+                                  (fold_ind * len(words)) // cv, ((fold_ind + 1) * len(words)) // cv)
+
+
+def create_permutation(n_words):
+    # shuffling of indices consumes the same random numbers as shuffling of words
+    permutation = list(range(n_words))
+    random.shuffle(permutation)
+    return np.array(permutation, dtype=np.int64)
+
+
+def split_words_and_transcriptions_for_cv(words_and_transcriptions, cv, permutation=None):
     assert len(words_and_transcriptions) > 0, 'List of texts is empty!'
     assert cv > 0, 'Number of folds for crossvalidation must be a positive integer value!'
     assert len(words_and_transcriptions) >= cv, '{0} > {1}. Number of folds for crossvalidation is too large!'.format(
         cv, len(words_and_transcriptions)
     )
-    folds = list()
-    fold_size = len(words_and_transcriptions) // cv
-    words = sorted(list(words_and_transcriptions.keys()))
-    random.shuffle(words)
-    for fold_ind in range(cv):
-        start_text_idx = fold_ind * fold_size
-        end_text_idx = (fold_ind + 1) * fold_size
-        words_for_training = list()
-        for cur_word in sorted(words[:start_text_idx] + words[end_text_idx:]):
-            for cur_transcription in words_and_transcriptions[cur_word]:
-                words_for_training.append(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
-        words_for_testing = list()
-        for cur_word in sorted(words[start_text_idx:end_text_idx]):
-            for cur_transcription in words_and_transcriptions[cur_word]:
-                words_for_testing.append(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
-        folds.append((tuple(words_for_training), tuple(words_for_testing)))
-    return folds
+    words = sorted(words_and_transcriptions.keys())
+    if permutation is None:
+        permutation = create_permutation(len(words))
+    assert len(permutation) == len(words), u'Permutation of words does not correspond to the lexicon!'
+    # fold boundaries are rounded, so all words (including the last len % cv ones) are distributed among folds
+    return iterate_folds(words_and_transcriptions, words, permutation, cv)
 
 
 def main():
     parser = ArgumentParser()
     parser.add_argument('-s', '--src', dest='word_list', required=True, type=str,
-                        help='Source file with words without their phonetical transcriptions.')
+                        help='Source file with words without their phonetical transcriptions (it may be compressed, '
+                             'and "-" means the standard input).')
     parser.add_argument('-t', '--train', dest='lexicon_for_training', type=str, required=False,
                         default=os.path.join(os.path.dirname(__file__), 'data', 'ru_training.dic'),
                         help='File with source vocabulary for training.')
     parser.add_argument('-d', '--dst', dest='destination_lexicon', type=str, required=True,
                         help='Destination file into which the creating phonetic transcriptions shall be written.')
+    parser.add_argument('--format', dest='lexicon_format', type=str, required=False, default='cmu',
+                        choices=LEXICON_FORMATS,
+                        help='Format of the destination file: "cmu" (variants are marked as "word(2)") or "tab" (the '
+                             'tab-separated training format). It is compressed if its name ends with ".gz", ".xz" '
+                             'or ".zst".')
     parser.add_argument('--cv', dest='cv', type=int, required=False, default=None,
                         help='Fold number for crossvalidation (if it is not '
                              'specified, then cross-validation will not be '
@@ -64,10 +418,36 @@ def main():
     parser.add_argument('-p', '--pmass', dest='pmass', type=float, required=False, default=0.85,
                         help='% of total probability mass constraint for transcriptions generating.')
     parser.add_argument('--seed', dest='seed', type=int, required=False, default=0, help='Random seed.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, required=False, default=1,
+                        help='Maximal number of concurrently running external commands (and of crossvalidation folds, '
+                             'which are evaluated in parallel worker processes).')
+    parser.add_argument('--timeout', dest='timeout', type=float, required=False, default=None,
+                        help='Maximal time (in seconds) of each external command (training stage or decoding).')
+    parser.add_argument('--store', dest='store_dir', type=str, required=False, default=None,
+                        help='A directory with stored model artifacts, which are reused if the training lexicon and '
+                             'N-gram size are not changed (by default, it is the "model/store").')
+    parser.add_argument('--store-limit', dest='store_limit', type=int, required=False, default=4096,
+                        help='Maximal size (in megabytes) of the model store: least recently used models are removed '
+                             'after the final training (if it is 0, then the store is not pruned).')
+    parser.add_argument('--profile-json', dest='profile_json', type=str, required=False, default=None,
+                        help='A JSON file into which time, CPU and memory usage of all stages shall be written.')
+    parser.add_argument('--error-analysis', dest='error_analysis', type=str, required=False, default=None,
+                        help='A prefix of NPZ and CSV files into which the phone confusion matrix and error breakdowns '
+                             'by phone and by word length for each crossvalidation fold shall be written.')
+    parser.add_argument('--sweep', dest='sweep', type=str, nargs='+', required=False, default=None,
+                        help='Hyperparameter sweep by crossvalidation, e.g. "ngram=3..10 pmass=0.5,0.85,0.95" (the '
+                             'best combination is used for the final training).')
+    parser.add_argument('--run-dir', dest='run_dir', type=str, required=False, default=None,
+                        help='A directory into which the shuffled permutation of words, results of crossvalidation '
+                             'folds and their models shall be saved (models are kept there, if the model store is not '
+                             'specified).')
+    parser.add_argument('--resume', dest='resume', action='store_true', required=False, default=False,
+                        help='Resume the interrupted crossvalidation from the run directory: completed folds are not '
+                             'evaluated again.')
     args = parser.parse_args()
 
     src_wordlist_name = os.path.normpath(args.word_list)
-    assert os.path.isfile(src_wordlist_name), u'File "{0}" does not exist!'.format(src_wordlist_name)
+    assert is_readable(src_wordlist_name), u'File "{0}" does not exist!'.format(src_wordlist_name)
     dst_vocabulary_name = os.path.normpath(args.destination_lexicon)
     dst_vocabulary_dir = os.path.dirname(dst_vocabulary_name)
     assert os.path.isdir(dst_vocabulary_dir), u'Directory "{0}" does not exist!'.format(dst_vocabulary_dir)
@@ -80,106 +460,186 @@ def main():
     assert ngram > 1, u'Maximal N-gram size is too small!'
     pmass = args.pmass
     assert (pmass > 0.0) and (pmass <= 1.0), u'% of total probability mass constraint is wrong!'
+    n_jobs = args.jobs
+    assert n_jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+    assert (args.timeout is None) or (args.timeout > 0.0), u'Timeout must be a positive value!'
+    assert args.store_limit >= 0, u'Maximal size of the model store must be a non-negative integer value!'
+    sweep = None
+    if args.sweep is not None:
+        assert cv is not None, u'Hyperparameter sweep requires crossvalidation!'
+        sweep = parse_sweep(args.sweep)
+    if args.error_analysis is not None:
+        assert cv is not None, u'Error analysis requires crossvalidation!'
+        analysis_dir = os.path.dirname(args.error_analysis)
+        assert (len(analysis_dir) == 0) or os.path.isdir(analysis_dir), \
+            u'Directory "{0}" does not exist!'.format(analysis_dir)
+    run_dir = None
+    if args.run_dir is not None:
+        assert cv is not None, u'Run directory requires crossvalidation!'
+        run_dir = os.path.normpath(args.run_dir)
+    assert (not args.resume) or (run_dir is not None), u'Resuming requires the run directory!'
 
     model_dir = os.path.join(os.path.dirname(__file__), 'model')
+    if args.store_dir is not None:
+        store_dir = os.path.normpath(args.store_dir)
+    elif run_dir is not None:
+        store_dir = os.path.join(run_dir, 'store')
+    else:
+        store_dir = os.path.join(model_dir, 'store')
+    cv_run = None
+    if run_dir is not None:
+        cv_run = CrossValidationRun(run_dir, {
+            'training_lexicon': calculate_file_hash(training_vocabulary_name),
+            'cv': cv,
+            'seed': args.seed,
+            'ngram': ngram,
+            'pmass': pmass,
+            'sweep': sweep
+        })
+        if cv_run.start(args.resume):
+            print(u'Crossvalidation is resumed from the run directory "{0}".'.format(run_dir))
     random.seed(args.seed)
-    words_and_transcriptions = load_lexicon(training_vocabulary_name)
+    with profile_stage(u'lexicon_loading') as cur_stage:
+        words_and_transcriptions = load_lexicon(training_vocabulary_name)
+        cur_stage['items'] = len(words_and_transcriptions)
     if cv is not None:
-        folds = split_words_and_transcriptions_for_cv(words_and_transcriptions, cv)
-        WERs = list()
-        PERs = list()
-        for cur_fold in folds:
-            tmp_file_for_training = create_tmp_file_name()
-            tmp_file_for_testing = create_tmp_file_name()
-            tmp_file_for_wordlist = create_tmp_file_name()
-            tmp_file_for_result = create_tmp_file_name()
-            try:
-                with codecs.open(tmp_file_for_training, mode='w',
-                                 encoding='utf-8', errors='ignore') as fp:
-                    for cur in cur_fold[0]:
-                        fp.write(cur)
-                with codecs.open(tmp_file_for_testing, mode='w',
-                                 encoding='utf-8', errors='ignore') as fp:
-                    for cur in cur_fold[1]:
-                        fp.write(cur)
-                with codecs.open(tmp_file_for_wordlist, mode='w',
-                                 encoding='utf-8', errors='ignore') as fp:
-                    for cur in cur_fold[1]:
-                        fp.write(cur.split()[0] + '\n')
-                cmd = u'phonetisaurus-train --lexicon "{0}" --dir_prefix "{1}" --model_prefix russian_g2p ' \
-                      u'--ngram_order {2} --seq2_del'.format(
-                    tmp_file_for_training, model_dir, ngram)
-                os.system(cmd)
-                cmd = u'phonetisaurus-apply --model "{0}" --word_list "{1}" -p {2} -a > "{3}"'.format(
-                    os.path.join(model_dir, 'russian_g2p.fst'),
-                    tmp_file_for_wordlist, pmass, tmp_file_for_result
+        with profile_stage(u'fold_splitting') as cur_stage:
+            permutation = None if cv_run is None else cv_run.load_permutation()
+            if permutation is None:
+                permutation = create_permutation(len(words_and_transcriptions))
+                if cv_run is not None:
+                    cv_run.save_permutation(permutation)
+            folds = list(enumerate(split_words_and_transcriptions_for_cv(words_and_transcriptions, cv, permutation)))
+            cur_stage['items'] = len(words_and_transcriptions)
+        if sweep is None:
+            WERs = [None for _ in range(cv)]
+            PERs = [None for _ in range(cv)]
+            fold_statistics = [None for _ in range(cv)]
+
+            def handle_fold_result(fold_idx, result, fold_records):
+                fold_statistics[fold_idx], stages_log = result
+                word_error_rate, phone_error_rate = fold_statistics[fold_idx].get_error_rates()
+                print_fold_result(fold_idx, word_error_rate, phone_error_rate, stages_log)
+                profiler.extend(fold_records)
+                WERs[fold_idx] = word_error_rate
+                PERs[fold_idx] = phone_error_rate
+
+            if cv_run is not None:
+                folds = cv_run.restore_folds(folds, handle_fold_result,
+                                             lambda statistics_list, stages_log: (statistics_list[0], stages_log))
+                handle_fold_result = cv_run.create_fold_handler(handle_fold_result, lambda result: [result[0]])
+            evaluate_folds(folds, training_vocabulary_name,
+                           partial(evaluate_fold, ngram=ngram, pmass=pmass, store_dir=store_dir), n_jobs,
+                           args.timeout, handle_fold_result)
+            WERs = np.array(WERs, dtype=np.float64)
+            PERs = np.array(PERs, dtype=np.float64)
+            print(u'')
+            print(u'Word error rate is {0:.2%} +- {1:.2%}'.format(WERs.mean(), WERs.std()))
+            print(u'Phone error rate is {0:.2%} +- {1:.2%}'.format(PERs.mean(), PERs.std()))
+        else:
+            ngrams = sweep.get('ngram', [ngram])
+            pmasses = sweep.get('pmass', [pmass])
+            fold_error_rates = [None for _ in range(cv)]
+            fold_sweep_statistics = [None for _ in range(cv)]
+
+            def handle_fold_sweep_result(fold_idx, result, fold_records):
+                fold_error_rates[fold_idx], fold_sweep_statistics[fold_idx], stages_log = result
+                print_stages_log(fold_idx, stages_log)
+                print(u'Fold {0}: {1} combinations of hyperparameters are evaluated.'.format(
+                    fold_idx + 1, len(ngrams) * len(pmasses)))
+                profiler.extend(fold_records)
+
+            def restore_fold_sweep_result(statistics_list, stages_log):
+                statistics = [statistics_list[(ngram_idx * len(pmasses)):((ngram_idx + 1) * len(pmasses))]
+                              for ngram_idx in range(len(ngrams))]
+                error_rates = np.array([[cur.get_error_rates() for cur in row] for row in statistics],
+                                       dtype=np.float64)
+                return error_rates, statistics, stages_log
+
+            if cv_run is not None:
+                folds = cv_run.restore_folds(folds, handle_fold_sweep_result, restore_fold_sweep_result)
+                handle_fold_sweep_result = cv_run.create_fold_handler(
+                    handle_fold_sweep_result, lambda result: [cur for row in result[1] for cur in row]
                 )
-                os.system(cmd)
-                word_error_rate, phone_error_rate = compare_lexicons(
-                    tmp_file_for_testing, tmp_file_for_result)
-                WERs.append(word_error_rate)
-                PERs.append(phone_error_rate)
-            finally:
-                if os.path.isfile(tmp_file_for_training):
-                    os.remove(tmp_file_for_training)
-                if os.path.isfile(tmp_file_for_testing):
-                    os.remove(tmp_file_for_testing)
-                if os.path.isfile(tmp_file_for_wordlist):
-                    os.remove(tmp_file_for_wordlist)
-                if os.path.isfile(tmp_file_for_result):
-                    os.remove(tmp_file_for_result)
-                for cur in filter(lambda it: it.startswith(u'russian_g2p'),
-                                  os.listdir(model_dir)):
-                    os.remove(os.path.join(model_dir, cur))
-        WERs = np.array(WERs, dtype=np.float64)
-        PERs = np.array(PERs, dtype=np.float64)
-        print(u'')
-        print(u'Word error rate is {0:.2%} +- {1:.2%}'.format(WERs.mean(), WERs.std()))
-        print(u'Phone error rate is {0:.2%} +- {1:.2%}'.format(PERs.mean(), PERs.std()))
+            evaluate_folds(folds, training_vocabulary_name,
+                           partial(evaluate_fold_sweep, ngrams=ngrams, pmasses=pmasses, store_dir=store_dir), n_jobs,
+                           args.timeout, handle_fold_sweep_result)
+            fold_error_rates = np.array(fold_error_rates, dtype=np.float64)
+            mean_error_rates = fold_error_rates.mean(axis=0)
+            std_error_rates = fold_error_rates.std(axis=0)
+            print(u'')
+            print(u'{0:>5} {1:>6} {2:>18} {3:>18}'.format(u'ngram', u'pmass', u'WER', u'PER'))
+            for ngram_idx, cur_ngram in enumerate(ngrams):
+                for pmass_idx, cur_pmass in enumerate(pmasses):
+                    print(u'{0:>5} {1:>6.3f} {2:>18} {3:>18}'.format(
+                        cur_ngram, cur_pmass,
+                        u'{0:.2%} +- {1:.2%}'.format(mean_error_rates[ngram_idx, pmass_idx, 0],
+                                                     std_error_rates[ngram_idx, pmass_idx, 0]),
+                        u'{0:.2%} +- {1:.2%}'.format(mean_error_rates[ngram_idx, pmass_idx, 1],
+                                                     std_error_rates[ngram_idx, pmass_idx, 1])
+                    ))
+            best_ngram_idx, best_pmass_idx = min(
+                [(ngram_idx, pmass_idx) for ngram_idx in range(len(ngrams)) for pmass_idx in range(len(pmasses))],
+                key=lambda it: (mean_error_rates[it[0], it[1], 0], mean_error_rates[it[0], it[1], 1])
+            )
+            ngram = ngrams[best_ngram_idx]
+            pmass = pmasses[best_pmass_idx]
+            fold_statistics = [cur[best_ngram_idx][best_pmass_idx] for cur in fold_sweep_statistics]
+            print(u'')
+            print(u'Note: in the sweep, variants for each pmass are selected from the N-best list of each word, and '
+                  u'their probabilities are normalized over this list, so error rates may differ from ones of a '
+                  u'single run with the same --pmass, in which variants are selected by the decoder itself.')
+            print(u'')
+            print(u'The best combination of hyperparameters is ngram={0}, pmass={1}.'.format(ngram, pmass))
+        if args.error_analysis is not None:
+            save_error_analysis(args.error_analysis,
+                                [(str(fold_idx + 1), cur) for fold_idx, cur in enumerate(fold_statistics)] +
+                                [(u'all', merge_error_statistics(fold_statistics))])
         print(u'')
         print(u'Crossvalidation is finised...')
 
     tmp_file_for_training = create_tmp_file_name()
-    tmp_file_for_result = create_tmp_file_name()
     try:
-        with codecs.open(tmp_file_for_training, mode='w', encoding='utf-8', errors='ignore') as fp:
-            for cur_word in sorted(list(words_and_transcriptions.keys())):
-                for cur_transcription in words_and_transcriptions[cur_word]:
-                    fp.write(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
+        with profile_stage(u'training_file_writing') as cur_stage:
+            cur_stage['items'] = write_lexicon(
+                tmp_file_for_training, ((cur_word, words_and_transcriptions[cur_word])
+                                        for cur_word in sorted(words_and_transcriptions.keys())), 'tab'
+            )
         print(u'')
         print(u'Final training is started...')
-        cmd = u'phonetisaurus-train --lexicon "{0}" --dir_prefix "{1}" --model_prefix russian_g2p ' \
-              u'--ngram_order {2} --seq2_del'.format(tmp_file_for_training, model_dir, ngram)
-        os.system(cmd)
+        with profile_stage(u'training') as cur_stage:
+            fst_name = ModelStore(store_dir, runner=JobRunner(timeout=args.timeout)).train(tmp_file_for_training,
+                                                                                           ngram)
+            install_model(fst_name, model_dir)
+            cur_stage['items'] = len(words_and_transcriptions)
         print(u'')
         print(u'Final training is finished...')
+        if args.store_limit > 0:
+            n_removed, freed_size = prune_model_store(store_dir, args.store_limit * (1 << 20),
+                                                      keep_dirs=[os.path.dirname(fst_name)])
+            if n_removed > 0:
+                print(u'{0} least recently used models are removed from the model store ({1:.1f} MB).'.format(
+                    n_removed, freed_size / float(1 << 20)))
         print(u'')
         print(u'Final recognition of transcriptions for words is started...')
-        cmd = u'phonetisaurus-apply --model "{0}" --word_list "{1}" -p {2} -a > "{3}"'.format(
-            os.path.join(model_dir, 'russian_g2p.fst'), src_wordlist_name, pmass, tmp_file_for_result
-        )
-        os.system(cmd)
+        with profile_stage(u'decoding') as cur_stage:
+            with G2PEngine(os.path.join(model_dir, 'russian_g2p.fst'), pmass,
+                           runner=JobRunner(timeout=args.timeout)) as g2p_engine:
+                predicted_phonetic_dictionary = g2p_engine.transcribe(read_word_list(src_wordlist_name))
+            cur_stage['items'] = len(predicted_phonetic_dictionary)
         print(u'')
         print(u'Final recognition of transcriptions for words is finished...')
-        predicted_phonetic_dictionary = load_lexicon(tmp_file_for_result)
     finally:
         if os.path.isfile(tmp_file_for_training):
             os.remove(tmp_file_for_training)
-        if os.path.isfile(tmp_file_for_result):
-            os.remove(tmp_file_for_result)
-
-    for cur_word in predicted_phonetic_dictionary:
-        if cur_word in words_and_transcriptions:
-            for cur_transcription in predicted_phonetic_dictionary[cur_word]:
-                if cur_transcription not in words_and_transcriptions[cur_word]:
-                    words_and_transcriptions[cur_word].append(cur_transcription)
-        else:
-            words_and_transcriptions[cur_word] = predicted_phonetic_dictionary[cur_word]
-    with codecs.open(dst_vocabulary_name, mode='w', encoding='utf-8', errors='ignore') as fp:
-        for cur_word in sorted(list(words_and_transcriptions.keys())):
-            fp.write(u'{0} {1}\n'.format(cur_word, words_and_transcriptions[cur_word][0]))
-            for ind in range(1, len(words_and_transcriptions[cur_word])):
-                fp.write(u'{0}({1}) {2}\n'.format(cur_word, ind + 1, words_and_transcriptions[cur_word][ind]))
+
+    with profile_stage(u'writing') as cur_stage:
+        cur_stage['items'] = write_lexicon(
+            dst_vocabulary_name, iterate_merged_entries(words_and_transcriptions, predicted_phonetic_dictionary),
+            args.lexicon_format
+        )
+    if args.profile_json is not None:
+        profiler.save_json(args.profile_json, script_name=u'do_experiments.py')
 
 
 if __name__ == '__main__':
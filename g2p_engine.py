@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import math
+import multiprocessing
+import os
+import time
+
+from prepare_dict import TRANSCRIPTION_RE, add_to_lexicon, check_transcription, get_token, parse_lexicon_line
+from job_runner import JobRunner, run_until_complete
+
+try:
+    from Phonetisaurus import PhonetisaurusScript
+except ImportError:
+    PhonetisaurusScript = None
+
+
+def resolve_decoder(decoder=None):
+    """ Return the decoder command, which will be used, or None if words will be decoded by the Python binding. """
+    if (decoder is None) and (PhonetisaurusScript is not None):
+        return None
+    return u'phonetisaurus-apply' if decoder is None else decoder
+
+
+class G2PEngine(object):
+    """ Grapheme-to-phoneme decoder with the same interface for the in-process model and for an external decoder.
+
+    If the Phonetisaurus Python binding is available, the FST model is loaded only once and kept resident, and words
+    are decoded in-process. Otherwise (or if the decoder is specified explicitly) each call of `transcribe()` starts a
+    new decoder process, which loads the model again, so words should be passed in large batches. The batch is
+    streamed to the decoder over its stdin by the job runner, and the decoder output is parsed line by line straight
+    from its stdout without any temporary files. The decoder must have the same command line interface as the
+    `phonetisaurus-apply`, so a local stub can be used instead of it.
+    """
+
+    def __init__(self, model_name, pmass=0.85, decoder=None, nbest=20, beam=10000, threshold=99.0, runner=None):
+        assert os.path.isfile(model_name), u'File "{0}" does not exist!'.format(model_name)
+        assert (pmass > 0.0) and (pmass <= 1.0), u'% of total probability mass constraint is wrong!'
+        self.model_name = model_name
+        self.pmass = pmass
+        self.nbest = nbest
+        self.beam = beam
+        self.threshold = threshold
+        self.runner = JobRunner() if runner is None else runner
+        self.decoder = resolve_decoder(decoder)
+        self.model = PhonetisaurusScript(model_name) if self.decoder is None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.model = None
+
+    def transcribe(self, words):
+        if self.model is not None:
+            return self._transcribe_in_process(words)
+        return run_until_complete(self._transcribe_with_decoder(words))
+
+    async def transcribe_async(self, words):
+        if self.model is not None:
+            return await asyncio.get_event_loop().run_in_executor(None, self._transcribe_in_process, words)
+        return await self._transcribe_with_decoder(words)
+
+    def _transcribe_in_process(self, words):
+        predicted = dict()
+        for cur_word in words:
+            results = self.model.Phoneticize(cur_word, self.nbest, self.beam, self.threshold, False, True,
+                                             self.pmass)
+            for cur_result in results:
+                phones = [self.model.FindOsym(cur_id) for cur_id in cur_result.Uniques]
+                if check_transcription(phones):
+                    new_transcription = u' '.join(phones)
+                    if new_transcription not in predicted.get(cur_word, []):
+                        add_to_lexicon(predicted, cur_word, new_transcription)
+        return predicted
+
+    async def transcribe_with_scores_async(self, words):
+        """ Decode words with the widest N-best list, i.e. without the probability mass constraint, and return a
+        dictionary of (score, transcription) lists sorted by score (negative log probability). Variants for any
+        probability mass constraint can be selected from this list by `filter_by_pmass()` without decoding.
+        """
+        if self.model is not None:
+            return await asyncio.get_event_loop().run_in_executor(None, self._transcribe_with_scores_in_process,
+                                                                  words)
+        predicted = dict()
+
+        def parse_line(line, line_idx):
+            res = parse_scored_line(line, self.decoder, line_idx)
+            if res is not None:
+                add_to_lexicon(predicted, res[0], (res[1], res[2]))
+
+        await self.runner.run(
+            [self.decoder, '--model', self.model_name, '--word_list', '/dev/stdin', '-n', str(self.nbest),
+             '-p', '1.0', '-a', '-v'],
+            input_lines=words, line_handler=parse_line
+        )
+        return dict((cur_word, sort_scored_transcriptions(predicted[cur_word])) for cur_word in predicted)
+
+    def _transcribe_with_scores_in_process(self, words):
+        predicted = dict()
+        for cur_word in words:
+            results = self.model.Phoneticize(cur_word, self.nbest, self.beam, self.threshold, False, True, 1.0)
+            for cur_result in results:
+                phones = [self.model.FindOsym(cur_id) for cur_id in cur_result.Uniques]
+                if check_transcription(phones):
+                    add_to_lexicon(predicted, cur_word, (cur_result.PathWeight, u' '.join(phones)))
+        return dict((cur_word, sort_scored_transcriptions(predicted[cur_word])) for cur_word in predicted)
+
+    async def _transcribe_with_decoder(self, words):
+        predicted = dict()
+
+        def parse_line(line, line_idx):
+            res = parse_lexicon_line(line, self.decoder, line_idx)
+            if res is not None:
+                add_to_lexicon(predicted, res[0], res[1])
+
+        await self.runner.run(
+            [self.decoder, '--model', self.model_name, '--word_list', '/dev/stdin', '-p', str(self.pmass), '-a'],
+            input_lines=words, line_handler=parse_line
+        )
+        return predicted
+
+
+def parse_scored_line(source_line, file_name, line_idx):
+    parts = source_line.strip().split(u'\t')
+    if (len(parts) == 1) and (len(parts[0]) == 0):
+        return None
+    assert len(parts) == 3, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    try:
+        score = float(parts[1])
+    except ValueError:
+        score = None
+    assert score is not None, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    new_transcription = u' '.join(parts[2].split())
+    assert TRANSCRIPTION_RE.match(new_transcription) is not None, \
+        u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    new_token = get_token(parts[0])
+    assert len(new_token) > 0, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    return new_token, score, new_transcription
+
+
+def sort_scored_transcriptions(scored_transcriptions):
+    prepared = list()
+    for score, transcription in sorted(scored_transcriptions, key=lambda it: it[0]):
+        if transcription not in [cur[1] for cur in prepared]:
+            prepared.append((score, transcription))
+    return prepared
+
+
+def filter_by_pmass(scored_transcriptions, pmass):
+    """ Select the best variants, whose total probability reaches the probability mass constraint. Probabilities
+    are normalized over the N-best list, and the variant, with which the total probability reaches `pmass`, is
+    included (so the best variant is always selected).
+    """
+    if len(scored_transcriptions) == 0:
+        return []
+    best_score = scored_transcriptions[0][0]
+    probabilities = [math.exp(best_score - cur[0]) for cur in scored_transcriptions]
+    total_probability = sum(probabilities)
+    selected = list()
+    accumulated_probability = 0.0
+    for (_, transcription), probability in zip(scored_transcriptions, probabilities):
+        selected.append(transcription)
+        accumulated_probability += probability / total_probability
+        if accumulated_probability >= pmass:
+            break
+    return selected
+
+
+def split_into_shards(words, n_shards):
+    shards = [list() for _ in range(n_shards)]
+    shard_loads = [(0, shard_idx) for shard_idx in range(n_shards)]
+    for cur_word in sorted(words, key=lambda it: (-len(it), it)):
+        cur_load, shard_idx = heapq.heappop(shard_loads)
+        shards[shard_idx].append(cur_word)
+        heapq.heappush(shard_loads, (cur_load + len(cur_word), shard_idx))
+    return [sorted(cur_shard) for cur_shard in shards if len(cur_shard) > 0]
+
+
+_worker_engine = None
+
+
+def _initialize_worker(model_name, pmass, decoder, timeout):
+    global _worker_engine
+    _worker_engine = G2PEngine(model_name, pmass, decoder=decoder, runner=JobRunner(timeout=timeout))
+
+
+def _transcribe_shard(task):
+    shard_idx, shard = task
+    start_time = time.time()
+    predicted = _worker_engine.transcribe(shard)
+    return shard_idx, len(shard), time.time() - start_time, predicted
+
+
+class ParallelG2PEngine(object):
+    """ Grapheme-to-phoneme decoder, which splits each batch of words into shards balanced by the total number of
+    characters and transcribes these shards in parallel worker processes (each worker keeps its own G2PEngine).
+    A number of words and a decoding time are recorded for each shard, and shards are numbered over all calls of
+    `transcribe()`.
+    """
+
+    def __init__(self, model_name, pmass=0.85, decoder=None, n_jobs=2, timeout=None):
+        assert os.path.isfile(model_name), u'File "{0}" does not exist!'.format(model_name)
+        assert n_jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+        self.model_name = model_name
+        self.pmass = pmass
+        self.decoder = resolve_decoder(decoder)
+        self.n_jobs = n_jobs
+        self.shard_statistics = list()
+        self.pool = multiprocessing.Pool(processes=n_jobs, initializer=_initialize_worker,
+                                         initargs=(model_name, pmass, decoder, timeout))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def transcribe(self, words):
+        predicted = dict()
+        shards = split_into_shards(words, self.n_jobs)
+        first_shard_idx = len(self.shard_statistics)
+        for shard_idx, n_words, duration, shard_predicted in self.pool.imap_unordered(
+                _transcribe_shard, enumerate(shards, first_shard_idx)):
+            self.shard_statistics.append((shard_idx, n_words, duration))
+            predicted.update(shard_predicted)
+        self.shard_statistics[first_shard_idx:] = sorted(self.shard_statistics[first_shard_idx:])
+        return predicted
+
+
+def create_g2p_engine(model_name, pmass=0.85, decoder=None, n_jobs=1, timeout=None):
+    if n_jobs > 1:
+        return ParallelG2PEngine(model_name, pmass, decoder=decoder, n_jobs=n_jobs, timeout=timeout)
+    return G2PEngine(model_name, pmass, decoder=decoder, runner=JobRunner(timeout=timeout))
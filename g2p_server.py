@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import signal
+from socketserver import ThreadingMixIn, UnixStreamServer
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from prepare_dict import get_token, load_lexicon, normalize_word
+from g2p_engine import PhonetisaurusScript, create_g2p_engine
+from transcription_cache import TranscriptionCache
+
+
+class BatchRequest(object):
+    def __init__(self, words):
+        self.words = words
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """ Collector of concurrent requests into micro-batches for the G2P engine.
+
+    Words of all requests, which are waiting in the queue, are decoded by a single call of the G2P engine in the
+    batching thread. A batch is started after `max_wait` seconds since the arrival of its first request, or right away
+    when it contains `max_batch_size` words. Only the batching thread uses the G2P engine and the transcription cache,
+    so they need not be thread-safe.
+    """
+
+    def __init__(self, g2p_engine, cache, max_batch_size=256, max_wait=0.01, metrics=None):
+        assert max_batch_size > 0, u'Maximal size of batch must be a positive integer value!'
+        assert max_wait >= 0.0, u'Maximal waiting time of batch must be a non-negative value!'
+        self.g2p_engine = g2p_engine
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self._queue = deque()
+        self._n_queued_words = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue), self._n_queued_words
+
+    def transcribe(self, words, timeout=None):
+        request = BatchRequest(words)
+        with self._condition:
+            assert not self._stopped, u'The batcher is stopped!'
+            self._queue.append(request)
+            self._n_queued_words += len(words)
+            if self.metrics is not None:
+                self.metrics.add_queue_depth(len(self._queue), self._n_queued_words)
+            self._condition.notify_all()
+        if not request.done.wait(timeout):
+            raise RuntimeError(u'Transcription of words is timed out!')
+        if request.error is not None:
+            raise RuntimeError(u'Transcription of words is failed: {0}'.format(request.error))
+        return request.result
+
+    def _take_batch(self):
+        with self._condition:
+            while (len(self._queue) == 0) and (not self._stopped):
+                self._condition.wait()
+            if len(self._queue) == 0:
+                return None
+            deadline = time.time() + self.max_wait
+            while (self._n_queued_words < self.max_batch_size) and (not self._stopped):
+                remaining_time = deadline - time.time()
+                if remaining_time <= 0.0:
+                    break
+                self._condition.wait(remaining_time)
+            batch = list()
+            n_words = 0
+            while (len(self._queue) > 0) and ((len(batch) == 0) or
+                                              (n_words + len(self._queue[0].words) <= self.max_batch_size)):
+                batch.append(self._queue.popleft())
+                n_words += len(batch[-1].words)
+            self._n_queued_words -= n_words
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                break
+            words = sorted(set([cur_word for cur_request in batch for cur_word in cur_request.words]))
+            try:
+                predicted = self.cache.transcribe(self.g2p_engine, words)
+                error = None
+            except Exception as err:
+                predicted = None
+                error = err
+            if self.metrics is not None:
+                self.metrics.add_batch(len(words))
+            for cur_request in batch:
+                if error is None:
+                    cur_request.result = dict((cur_word, predicted.get(cur_word, []))
+                                              for cur_word in cur_request.words)
+                else:
+                    cur_request.error = error
+                cur_request.done.set()
+
+
+class ServiceMetrics(object):
+    """ Thread-safe counters of the G2P service: request latencies (percentiles are calculated over a window of recent
+    requests), queue depth, batch sizes and numbers of words served from the lexicon and from the model.
+    """
+
+    def __init__(self, window_size=10000):
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        self.latencies = deque(maxlen=window_size)
+        self.batch_sizes = deque(maxlen=window_size)
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_lexicon_words = 0
+        self.n_decoded_words = 0
+        self.n_batches = 0
+        self.max_queue_depth = 0
+        self.max_queued_words = 0
+
+    def add_request(self, latency, n_lexicon_words, n_decoded_words, is_error=False):
+        with self._lock:
+            self.n_requests += 1
+            if is_error:
+                self.n_errors += 1
+            else:
+                self.latencies.append(latency)
+                self.n_lexicon_words += n_lexicon_words
+                self.n_decoded_words += n_decoded_words
+
+    def add_batch(self, n_words):
+        with self._lock:
+            self.n_batches += 1
+            self.batch_sizes.append(n_words)
+
+    def add_queue_depth(self, queue_depth, n_queued_words):
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            self.max_queued_words = max(self.max_queued_words, n_queued_words)
+
+    def summarize(self, queue_depth, n_queued_words):
+        with self._lock:
+            latencies = np.array(self.latencies, dtype=np.float64)
+            batch_sizes = np.array(self.batch_sizes, dtype=np.float64)
+            summary = {
+                'uptime': time.time() - self.start_time,
+                'requests': self.n_requests,
+                'errors': self.n_errors,
+                'lexicon_words': self.n_lexicon_words,
+                'decoded_words': self.n_decoded_words,
+                'batches': self.n_batches,
+                'queue_depth': queue_depth,
+                'queued_words': n_queued_words,
+                'max_queue_depth': self.max_queue_depth,
+                'max_queued_words': self.max_queued_words
+            }
+        if len(latencies) > 0:
+            summary['latency'] = dict(('p{0}'.format(cur), float(np.percentile(latencies, cur)))
+                                      for cur in (50, 90, 95, 99))
+            summary['latency']['max'] = float(latencies.max())
+        else:
+            summary['latency'] = None
+        summary['mean_batch_size'] = float(batch_sizes.mean()) if len(batch_sizes) > 0 else None
+        return summary
+
+
+class G2PService(object):
+    """ Transcriber of words for the G2P server. Words of the training lexicon are served from this lexicon without
+    decoding, and other words are sent to the micro-batcher.
+    """
+
+    def __init__(self, batcher, lexicon=None, metrics=None, timeout=60.0):
+        self.batcher = batcher
+        self.lexicon = dict() if lexicon is None else lexicon
+        self.metrics = ServiceMetrics() if metrics is None else metrics
+        self.timeout = timeout
+
+    def transcribe(self, source_words):
+        start_time = time.time()
+        words = list()
+        for cur_word in source_words:
+            prepared_word = get_token(normalize_word(cur_word))
+            assert len(prepared_word) > 0, u'Word "{0}" is wrong!'.format(cur_word)
+            words.append(prepared_word)
+        result = dict()
+        unknown_words = list()
+        for cur_word in words:
+            if cur_word in self.lexicon:
+                result[cur_word] = {'transcriptions': list(self.lexicon[cur_word]), 'source': 'lexicon'}
+            elif cur_word not in unknown_words:
+                unknown_words.append(cur_word)
+        if len(unknown_words) > 0:
+            predicted = self.batcher.transcribe(unknown_words, self.timeout)
+            for cur_word in unknown_words:
+                result[cur_word] = {'transcriptions': list(predicted[cur_word]), 'source': 'model'}
+        self.metrics.add_request(time.time() - start_time, len(words) - len(unknown_words), len(unknown_words))
+        return [dict([('word', cur_word)] + list(result[cur_word].items())) for cur_word in words]
+
+    def get_metrics(self):
+        queue_depth, n_queued_words = self.batcher.queue_depth()
+        return self.metrics.summarize(queue_depth, n_queued_words)
+
+
+class G2PRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP interface of the G2P service:
+
+    - `GET /transcribe?word=...&word=...` or `POST /transcribe` with a JSON body `{"words": [...]}` (or
+      `{"word": "..."}`) returns transcriptions of the words;
+    - `GET /metrics` returns latency percentiles, queue depth and other counters;
+    - `GET /health` returns `{"status": "ok"}`.
+    """
+
+    server_version = 'RussianG2P/1.0'
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple) and (len(self.client_address) > 0):
+            return str(self.client_address[0])
+        return u'unix-socket'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def transcribe(self, words):
+        service = self.server.service
+        start_time = time.time()
+        try:
+            assert len(words) > 0, u'Words are not specified!'
+            assert len(words) <= self.server.max_request_size, u'Too many words in the request!'
+            result = service.transcribe(words)
+        except AssertionError as err:
+            service.metrics.add_request(time.time() - start_time, 0, 0, is_error=True)
+            self.send_json(400, {'error': str(err)})
+            return
+        except Exception as err:
+            service.metrics.add_request(time.time() - start_time, 0, 0, is_error=True)
+            self.send_json(500, {'error': str(err)})
+            return
+        self.send_json(200, {'pmass': self.server.pmass, 'words': result})
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path == '/transcribe':
+            query = parse_qs(parsed_url.query)
+            self.transcribe(query.get('word', []) + query.get('words', []))
+        elif parsed_url.path == '/metrics':
+            self.send_json(200, self.server.service.get_metrics())
+        elif parsed_url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': u'Path "{0}" is unknown!'.format(parsed_url.path)})
+
+    def do_POST(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path != '/transcribe':
+            self.send_json(404, {'error': u'Path "{0}" is unknown!'.format(parsed_url.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            words = request['words'] if 'words' in request else [request['word']]
+            assert isinstance(words, list), u'Words must be specified as a list!'
+        except (ValueError, KeyError, TypeError, AssertionError) as err:
+            self.send_json(400, {'error': u'Request is wrong: {0}'.format(err)})
+            return
+        self.transcribe(words)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        self.server_name = u'localhost'
+        self.server_port = 0
+
+
+def stop_by_signal(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def create_server(server_class, address, service, pmass, max_request_size=10000, verbose=False):
+    server = server_class(address, G2PRequestHandler)
+    server.service = service
+    server.pmass = pmass
+    server.max_request_size = max_request_size
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-m', '--model', dest='model_dir', type=str, default=None,
+                        required=False, help='A directory with trained model.')
+    parser.add_argument('-t', '--train', dest='lexicon_for_training', type=str, required=False, default=None,
+                        help='File with the training lexicon, whose words are served without decoding.')
+    parser.add_argument('-p', '--pmass', dest='pmass', type=float, required=False, default=0.85,
+                        help='% of total probability mass constraint for transcriptions generating.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, required=False, default=100000,
+                        help='Maximal number of words in the in-memory LRU cache of transcriptions.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, required=False, default=1,
+                        help='Number of parallel processes for transcriptions generating.')
+    parser.add_argument('--host', dest='host', type=str, required=False, default='127.0.0.1',
+                        help='Host name or IP address of the HTTP server.')
+    parser.add_argument('--port', dest='port', type=int, required=False, default=8000,
+                        help='Port of the HTTP server (if it is 0, then the HTTP server is not started).')
+    parser.add_argument('--unix-socket', dest='unix_socket', type=str, required=False, default=None,
+                        help='A path of the Unix socket, on which the same HTTP interface is served.')
+    parser.add_argument('--max-batch-size', dest='max_batch_size', type=int, required=False, default=256,
+                        help='Maximal number of words in a micro-batch for the decoder.')
+    parser.add_argument('--max-wait', dest='max_wait', type=float, required=False, default=10.0,
+                        help='Maximal time (in milliseconds) of waiting for other requests before a micro-batch '
+                             'is decoded.')
+    parser.add_argument('--max-request-size', dest='max_request_size', type=int, required=False, default=10000,
+                        help='Maximal number of words in a single request.')
+    parser.add_argument('--timeout', dest='timeout', type=float, required=False, default=60.0,
+                        help='Maximal time (in seconds) of transcribing of a single request.')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', required=False, default=False,
+                        help='Log all HTTP requests.')
+    args = parser.parse_args()
+
+    pmass = args.pmass
+    assert (pmass > 0.0) and (pmass <= 1.0), u'% of total probability mass constraint is wrong!'
+    if args.model_dir is None:
+        model_dir = os.path.join(os.path.dirname(__file__), 'model')
+    else:
+        model_dir = os.path.normpath(args.model_dir)
+        assert os.path.isdir(model_dir), 'A directory "{0}" does not exist!'.format(model_dir)
+    assert args.cache_size > 0, u'Size of the transcription cache must be a positive integer value!'
+    assert args.jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+    assert args.max_request_size > 0, u'Maximal number of words in a request must be a positive integer value!'
+    assert args.timeout > 0.0, u'Timeout must be a positive value!'
+    assert (args.port > 0) or (args.unix_socket is not None), u'Neither HTTP port nor Unix socket is specified!'
+    model_name = os.path.join(model_dir, 'russian_g2p.fst')
+    # without the binding, each micro-batch would start phonetisaurus-apply, which loads the model again
+    assert PhonetisaurusScript is not None, u'The G2P server requires the Phonetisaurus Python binding!'
+    signal.signal(signal.SIGTERM, stop_by_signal)
+    lexicon = None
+    if args.lexicon_for_training is not None:
+        lexicon_name = os.path.normpath(args.lexicon_for_training)
+        assert os.path.isfile(lexicon_name), u'File "{0}" does not exist!'.format(lexicon_name)
+        lexicon = load_lexicon(lexicon_name, compact=True)
+        print(u'{0} words of the training lexicon are loaded.'.format(len(lexicon)))
+
+    with create_g2p_engine(model_name, pmass, n_jobs=args.jobs) as g2p_engine, \
+            TranscriptionCache(model_name, pmass, capacity=args.cache_size) as cache:
+        metrics = ServiceMetrics()
+        batcher = MicroBatcher(g2p_engine, cache, max_batch_size=args.max_batch_size,
+                               max_wait=args.max_wait / 1000.0, metrics=metrics)
+        service = G2PService(batcher, lexicon, metrics, timeout=args.timeout)
+        servers = list()
+        threads = list()
+        try:
+            if args.port > 0:
+                servers.append(create_server(ThreadingHTTPServer, (args.host, args.port), service, pmass,
+                                             args.max_request_size, args.verbose))
+                print(u'HTTP server is listening on {0}:{1}...'.format(args.host, args.port))
+            if args.unix_socket is not None:
+                servers.append(create_server(ThreadingUnixHTTPServer, os.path.normpath(args.unix_socket), service,
+                                             pmass, args.max_request_size, args.verbose))
+                print(u'HTTP server is listening on the Unix socket {0}...'.format(args.unix_socket))
+            for cur_server in servers:
+                threads.append(threading.Thread(target=cur_server.serve_forever))
+                threads[-1].daemon = True
+                threads[-1].start()
+            try:
+                while any(cur_thread.is_alive() for cur_thread in threads):
+                    time.sleep(1.0)
+            except KeyboardInterrupt:
+                print(u'')
+                print(u'G2P server is stopped...')
+        finally:
+            for server_idx, cur_server in enumerate(servers):
+                if server_idx < len(threads):
+                    cur_server.shutdown()
+                cur_server.server_close()
+                if isinstance(cur_server, ThreadingUnixHTTPServer) and os.path.exists(cur_server.server_address):
+                    os.remove(cur_server.server_address)
+            batcher.close()
+
+
+if __name__ == '__main__':
+    main()
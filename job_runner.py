@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import signal
+import subprocess
+
+
+async def feed_lines(stream, lines, chunk_size=1 << 16):
+    try:
+        buffer = list()
+        buffer_size = 0
+        for cur_line in lines:
+            buffer.append(cur_line + u'\n')
+            buffer_size += len(buffer[-1])
+            if buffer_size >= chunk_size:
+                stream.write(u''.join(buffer).encode('utf-8'))
+                await stream.drain()
+                buffer = list()
+                buffer_size = 0
+        if len(buffer) > 0:
+            stream.write(u''.join(buffer).encode('utf-8'))
+            await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
+
+
+async def communicate(proc, input_lines, line_handler):
+    feeder = None if input_lines is None else asyncio.ensure_future(feed_lines(proc.stdin, input_lines))
+    try:
+        if line_handler is not None:
+            line_idx = 0
+            cur_line = await proc.stdout.readline()
+            while len(cur_line) > 0:
+                line_idx += 1
+                line_handler(cur_line.decode('utf-8', errors='ignore'), line_idx)
+                cur_line = await proc.stdout.readline()
+        if feeder is not None:
+            await feeder
+    finally:
+        if (feeder is not None) and (not feeder.done()):
+            feeder.cancel()
+    return await proc.wait()
+
+
+def kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+async def run_command(cmd, input_lines=None, line_handler=None, timeout=None):
+    """ Run an external command without shell. If `input_lines` are specified, then they are written into stdin of
+    the command while its stdout is read, and each line of stdout is passed to `line_handler` as soon as it is read,
+    so neither input nor output of the command is kept in memory or in a temporary file as a whole. The command is
+    killed if it is not finished in `timeout` seconds, and its exit code is checked. The command is started in its own
+    process group, so child processes of wrapper scripts (e.g. `phonetisaurus-train`) are killed too.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=(None if input_lines is None else subprocess.PIPE),
+        stdout=(None if line_handler is None else subprocess.PIPE), start_new_session=True
+    )
+    is_timed_out = False
+    try:
+        returncode = await asyncio.wait_for(communicate(proc, input_lines, line_handler), timeout)
+    except asyncio.TimeoutError:
+        is_timed_out = True
+        returncode = None
+    finally:
+        if proc.returncode is None:
+            kill_process_group(proc)
+            await proc.wait()
+    assert not is_timed_out, u'Command "{0}" is timed out after {1} seconds!'.format(u' '.join(cmd), timeout)
+    assert returncode == 0, u'Command "{0}" is failed with exit code {1}!'.format(u' '.join(cmd), returncode)
+    return returncode
+
+
+class JobRunner(object):
+    """ Runner of external commands, which limits the number of commands running concurrently in the same event loop.
+
+    All steps of the pipeline (alignment, N-gram estimation, FST conversion, decoding) are run by a single runner, so
+    independent steps (e.g. of different crossvalidation folds) can be run concurrently, but no more than
+    `max_concurrency` commands are running at any moment.
+    """
+
+    def __init__(self, max_concurrency=1, timeout=None):
+        assert max_concurrency > 0, u'Maximal number of concurrent commands must be a positive integer value!'
+        assert (timeout is None) or (timeout > 0.0), u'Timeout must be a positive value!'
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._loop = None
+        self._semaphore = None
+
+    def get_semaphore(self):
+        # the semaphore is bound to the event loop, so a new semaphore is created for each new loop
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self, cmd, input_lines=None, line_handler=None, timeout=None):
+        async with self.get_semaphore():
+            return await run_command(cmd, input_lines, line_handler, self.timeout if timeout is None else timeout)
+
+
+def run_until_complete(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        # unfinished tasks (e.g. after KeyboardInterrupt) are cancelled, so their running commands are killed
+        all_tasks = asyncio.all_tasks if hasattr(asyncio, 'all_tasks') else asyncio.Task.all_tasks
+        pending = [cur_task for cur_task in all_tasks(loop) if not cur_task.done()]
+        for cur_task in pending:
+            cur_task.cancel()
+        if len(pending) > 0:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+from itertools import chain
+import lzma
+import os
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+LEXICON_FORMATS = ('cmu', 'tab')
+COMPRESSED_EXTENSIONS = ('.gz', '.xz', '.zst')
+STDIN_NAME = '-'
+
+
+def is_compressed(file_name):
+    return file_name.endswith(COMPRESSED_EXTENSIONS)
+
+
+def is_readable(file_name):
+    return (file_name == STDIN_NAME) or os.path.isfile(file_name)
+
+
+def check_zstandard(file_name):
+    assert zstandard is not None, u'File "{0}" cannot be opened, because the zstandard package is not ' \
+                                  u'installed!'.format(file_name)
+
+
+def open_for_reading(file_name, errors='ignore', newline=None):
+    """ Open a text file for streaming reading. The file is decompressed on the fly if its name ends with ".gz",
+    ".xz" or ".zst" (the last one requires the zstandard package), and "-" means the standard input.
+    """
+    if file_name == STDIN_NAME:
+        return io.open(sys.stdin.fileno(), mode='r', encoding='utf-8', errors=errors, newline=newline, closefd=False)
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode='rt', encoding='utf-8', errors=errors, newline=newline)
+    if file_name.endswith('.xz'):
+        return lzma.open(file_name, mode='rt', encoding='utf-8', errors=errors, newline=newline)
+    if file_name.endswith('.zst'):
+        check_zstandard(file_name)
+        reader = zstandard.ZstdDecompressor().stream_reader(open(file_name, 'rb'), read_across_frames=True,
+                                                             closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8', errors=errors, newline=newline)
+    return io.open(file_name, mode='r', encoding='utf-8', errors=errors, newline=newline)
+
+
+def merge_transcriptions(*transcription_lists):
+    # a dictionary keeps insertion order, so it is used as an insertion-ordered set of transcriptions
+    return list(dict.fromkeys(chain(*transcription_lists)))
+
+
+def iterate_merged_entries(*lexicons):
+    """ Iterate over sorted words of all lexicons with their unique transcriptions. Transcriptions of a word keep the
+    order of lexicons (e.g. transcriptions from the training lexicon go before predicted ones), and words without
+    transcriptions are skipped.
+    """
+    all_words = set()
+    for cur_lexicon in lexicons:
+        all_words |= set(cur_lexicon.keys())
+    for cur_word in sorted(all_words):
+        transcriptions = merge_transcriptions(*[cur_lexicon.get(cur_word, ()) for cur_lexicon in lexicons])
+        if len(transcriptions) > 0:
+            yield cur_word, transcriptions
+
+
+def open_for_writing(file_name):
+    """ Open a text file for writing. The output is compressed on the fly if the file name ends with ".gz", ".xz"
+    or ".zst" (the last one requires the zstandard package).
+    """
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode='wt', encoding='utf-8', errors='ignore', newline=u'\n', compresslevel=6)
+    if file_name.endswith('.xz'):
+        return lzma.open(file_name, mode='wt', encoding='utf-8', errors='ignore', newline=u'\n')
+    if file_name.endswith('.zst'):
+        check_zstandard(file_name)
+        writer = zstandard.ZstdCompressor().stream_writer(open(file_name, 'wb'), closefd=True)
+        return io.TextIOWrapper(writer, encoding='utf-8', errors='ignore', newline=u'\n')
+    return io.open(file_name, mode='w', encoding='utf-8', errors='ignore', newline=u'\n')
+
+
+class LexiconWriter(object):
+    """ Writer of a pronouncing dictionary in the CMU-style format (variants of a word are marked as "word(2)") or in
+    the tab-separated training format. Lines are joined into large chunks, so the file is written by a few big writes,
+    and the output is compressed according to the file name extension (see `open_for_writing`).
+    """
+
+    def __init__(self, file_name, lexicon_format='cmu', chunk_size=1 << 20):
+        assert lexicon_format in LEXICON_FORMATS, u'Format "{0}" of pronouncing dictionary is unknown!'.format(
+            lexicon_format)
+        self.lexicon_format = lexicon_format
+        self.chunk_size = chunk_size
+        self.n_words = 0
+        self.n_entries = 0
+        self._buffer = list()
+        self._buffer_size = 0
+        self._fp = open_for_writing(file_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._fp is not None:
+            try:
+                self.flush()
+            finally:
+                self._fp.close()
+                self._fp = None
+
+    def flush(self):
+        if len(self._buffer) > 0:
+            self._fp.write(u''.join(self._buffer))
+            self._buffer = list()
+            self._buffer_size = 0
+
+    def write(self, word, transcriptions):
+        if len(transcriptions) == 0:
+            return
+        if self.lexicon_format == 'cmu':
+            chunk = u'{0} {1}\n'.format(word, transcriptions[0])
+            if len(transcriptions) > 1:
+                chunk += u''.join([u'{0}({1}) {2}\n'.format(word, idx + 1, transcriptions[idx])
+                                   for idx in range(1, len(transcriptions))])
+        else:
+            chunk = u''.join([u'{0}\t{1}\n'.format(word, cur_transcription) for cur_transcription in transcriptions])
+        self._buffer.append(chunk)
+        self._buffer_size += len(chunk)
+        self.n_words += 1
+        self.n_entries += len(transcriptions)
+        if self._buffer_size >= self.chunk_size:
+            self.flush()
+
+
+def write_lexicon(file_name, entries, lexicon_format='cmu'):
+    with LexiconWriter(file_name, lexicon_format) as writer:
+        for cur_word, transcriptions in entries:
+            writer.write(cur_word, transcriptions)
+    return writer.n_words
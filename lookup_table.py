@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from argparse import ArgumentParser
+import heapq
+import os
+
+from prepare_dict import is_binary_lexicon, load_binary_lexicon, load_lexicon, normalize_word, save_binary_lexicon
+from g2p_engine import create_g2p_engine
+from lexicon_io import merge_transcriptions, open_for_reading
+from transcription_cache import calculate_model_fingerprint
+
+
+def read_word_frequencies(file_name):
+    """ Read a word frequency list. Each line contains a word and its frequency (in any order, e.g. "word 15" or the
+    output of `uniq -c`), or only a word, and then words are ranked by their order in the file.
+    """
+    frequencies = dict()
+    with open_for_reading(file_name) as fp:
+        for line_idx, cur_line in enumerate(fp):
+            parts = cur_line.split()
+            if len(parts) == 0:
+                continue
+            assert len(parts) <= 2, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx + 1)
+            if len(parts) == 1:
+                cur_word, cur_frequency = parts[0], 0
+            elif parts[0].isdigit() and (not parts[1].isdigit()):
+                cur_word, cur_frequency = parts[1], int(parts[0])
+            else:
+                assert parts[1].isdigit(), u'File "{0}": line {1} is wrong!'.format(file_name, line_idx + 1)
+                cur_word, cur_frequency = parts[0], int(parts[1])
+            cur_word = normalize_word(cur_word)
+            if cur_word in frequencies:
+                frequencies[cur_word] = (frequencies[cur_word][0] + cur_frequency, frequencies[cur_word][1])
+            else:
+                frequencies[cur_word] = (cur_frequency, line_idx)
+    return frequencies
+
+
+def select_top_words(frequencies, top_n):
+    return [cur_word for cur_word, _ in heapq.nsmallest(top_n, frequencies.items(),
+                                                         key=lambda it: (-it[1][0], it[1][1]))]
+
+
+def build_lookup_table(table_name, frequency_list_name, top_n, training_lexicon_name, model_name, pmass,
+                       g2p_engine):
+    """ Precompute pronunciations of the top-N most frequent words and save them as a binary lexicon. Words of the
+    training lexicon keep their transcriptions from this lexicon, and other words are transcribed by the G2P engine.
+    Sources, the model fingerprint and the probability mass constraint are saved into the metadata of the table, so it
+    can be rebuilt when the model is retrained.
+    """
+    top_words = select_top_words(read_word_frequencies(frequency_list_name), top_n)
+    training_lexicon = load_lexicon(training_lexicon_name)
+    table = dict()
+    unknown_words = list()
+    for cur_word in top_words:
+        if cur_word in training_lexicon:
+            table[cur_word] = list(training_lexicon[cur_word])
+        else:
+            unknown_words.append(cur_word)
+    del training_lexicon
+    if len(unknown_words) > 0:
+        predicted = g2p_engine.transcribe(sorted(unknown_words))
+        for cur_word in unknown_words:
+            transcriptions = merge_transcriptions(predicted.get(cur_word, ()))
+            if len(transcriptions) > 0:
+                table[cur_word] = transcriptions
+    metadata = {
+        'kind': 'lookup_table',
+        'model_fingerprint': calculate_model_fingerprint(model_name),
+        'pmass': float(pmass),
+        'top_n': top_n,
+        'frequency_list': os.path.abspath(frequency_list_name),
+        'training_lexicon': os.path.abspath(training_lexicon_name)
+    }
+    tmp_name = u'{0}.tmp{1}'.format(table_name, os.getpid())
+    try:
+        save_binary_lexicon(table, tmp_name, metadata)
+        os.rename(tmp_name, table_name)
+    finally:
+        if os.path.isfile(tmp_name):
+            os.remove(tmp_name)
+    return len(table)
+
+
+def is_lookup_table_actual(table, model_fingerprint, pmass):
+    return (table.metadata.get('kind') == 'lookup_table') and \
+        (table.metadata.get('model_fingerprint') == model_fingerprint) and (table.metadata.get('pmass') == float(pmass))
+
+
+def open_lookup_table(table_name, model_name, pmass, g2p_engine):
+    """ Open the lookup table through mmap. If it is built by another model (or with another probability mass
+    constraint), then it is rebuilt from the same sources with the current model.
+    """
+    assert os.path.isfile(table_name), u'File "{0}" does not exist!'.format(table_name)
+    assert is_binary_lexicon(table_name), u'File "{0}" is not a lookup table!'.format(table_name)
+    table = load_binary_lexicon(table_name)
+    model_fingerprint = calculate_model_fingerprint(model_name)
+    if is_lookup_table_actual(table, model_fingerprint, pmass):
+        return table
+    metadata = table.metadata
+    del table
+    assert metadata.get('kind') == 'lookup_table', u'File "{0}" is not a lookup table!'.format(table_name)
+    for source_name in (metadata['frequency_list'], metadata['training_lexicon']):
+        assert os.path.isfile(source_name), u'Lookup table "{0}" is outdated, but its source "{1}" does not ' \
+                                            u'exist!'.format(table_name, source_name)
+    print(u'Lookup table "{0}" is outdated, and it is rebuilt...'.format(table_name))
+    build_lookup_table(table_name, metadata['frequency_list'], metadata['top_n'], metadata['training_lexicon'],
+                       model_name, pmass, g2p_engine)
+    return load_binary_lexicon(table_name)
+
+
+class LookupTableTranscriber(object):
+    """ Transcriber, which takes pronunciations of frequent words from the lookup table and sends only other words to
+    the underlying transcriber (e.g. the transcription cache with the G2P engine). Words are looked up after the same
+    normalization as words of the frequency list, but results are keyed by the source words.
+    """
+
+    def __init__(self, table, table_name):
+        self.table = table
+        self.table_size = os.path.getsize(table_name)
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def transcribe(self, words, transcribe_missed):
+        predicted = dict()
+        missed_words = list()
+        for cur_word in words:
+            table_word = normalize_word(cur_word)
+            if table_word in self.table:
+                predicted[cur_word] = self.table[table_word]
+            else:
+                missed_words.append(cur_word)
+        self.n_hits += len(predicted)
+        self.n_misses += len(missed_words)
+        if len(missed_words) > 0:
+            predicted.update(transcribe_missed(missed_words))
+        return predicted
+
+    def print_statistics(self):
+        n_words = self.n_hits + self.n_misses
+        print(u'Lookup table: {0} words, {1:.1f} KB, {2} hits ({3:.2%} of words).'.format(
+            len(self.table), self.table_size / float(1 << 10), self.n_hits,
+            self.n_hits / float(n_words) if n_words > 0 else 0.0))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-f', '--frequencies', dest='frequency_list', type=str, required=True,
+                        help=u'Word frequency list (each line contains a word and its frequency, or only a word).')
+    parser.add_argument('-d', '--dst', dest='table_name', type=str, required=True,
+                        help=u'Destination name of the lookup table.')
+    parser.add_argument('-n', '--top', dest='top_n', type=int, required=False, default=100000,
+                        help=u'Number of the most frequent words in the lookup table.')
+    parser.add_argument('-t', '--train', dest='lexicon_for_training', type=str, required=False,
+                        default=os.path.join(os.path.dirname(__file__), 'data', 'ru_training.dic'),
+                        help=u'File with the training lexicon, whose transcriptions are used for its words.')
+    parser.add_argument('-m', '--model', dest='model_dir', type=str, default=None,
+                        required=False, help=u'A directory with trained model.')
+    parser.add_argument('-p', '--pmass', dest='pmass', type=float, required=False, default=0.85,
+                        help=u'% of total probability mass constraint for transcriptions generating.')
+    parser.add_argument('--decoder', dest='decoder', type=str, required=False, default=None,
+                        help=u'A decoder command with the same interface as phonetisaurus-apply.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, required=False, default=1,
+                        help=u'Number of parallel processes for transcriptions generating.')
+    args = parser.parse_args()
+
+    frequency_list_name = os.path.normpath(args.frequency_list)
+    assert os.path.isfile(frequency_list_name), u'File "{0}" does not exist!'.format(frequency_list_name)
+    training_lexicon_name = os.path.normpath(args.lexicon_for_training)
+    assert os.path.isfile(training_lexicon_name), u'File "{0}" does not exist!'.format(training_lexicon_name)
+    table_name = os.path.normpath(args.table_name)
+    table_dir = os.path.dirname(table_name)
+    assert (len(table_dir) == 0) or os.path.isdir(table_dir), u'Directory "{0}" does not exist!'.format(table_dir)
+    assert args.top_n > 0, u'Number of words in the lookup table must be a positive integer value!'
+    assert (args.pmass > 0.0) and (args.pmass <= 1.0), u'% of total probability mass constraint is wrong!'
+    assert args.jobs > 0, u'Number of parallel jobs must be a positive integer value!'
+    if args.model_dir is None:
+        model_dir = os.path.join(os.path.dirname(__file__), 'model')
+    else:
+        model_dir = os.path.normpath(args.model_dir)
+        assert os.path.isdir(model_dir), u'A directory "{0}" does not exist!'.format(model_dir)
+    model_name = os.path.join(model_dir, 'russian_g2p.fst')
+
+    with create_g2p_engine(model_name, args.pmass, decoder=args.decoder, n_jobs=args.jobs) as g2p_engine:
+        n_words = build_lookup_table(table_name, frequency_list_name, args.top_n, training_lexicon_name, model_name,
+                                     args.pmass, g2p_engine)
+    print(u'Lookup table: {0} words, {1:.1f} KB.'.format(n_words, os.path.getsize(table_name) / float(1 << 10)))
+
+
+if __name__ == '__main__':
+    main()
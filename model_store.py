@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+
+from job_runner import JobRunner, run_until_complete
+
+
+def calculate_file_hash(file_name, chunk_size=1 << 20):
+    assert os.path.isfile(file_name), u'File "{0}" does not exist!'.format(file_name)
+    hasher = hashlib.sha256()
+    with open(file_name, 'rb') as fp:
+        chunk = fp.read(chunk_size)
+        while len(chunk) > 0:
+            hasher.update(chunk)
+            chunk = fp.read(chunk_size)
+    return hasher.hexdigest()
+
+
+class ModelStore(object):
+    """ Store of G2P model artifacts, which are reused when their inputs are not changed.
+
+    The training is split into the same stages as in the `phonetisaurus-train`: alignment of the training lexicon
+    (`phonetisaurus-align`), estimation of the N-gram model (`estimate-ngram`) and its conversion into FST
+    (`phonetisaurus-arpa2wfst`). Artifacts are kept in a subdirectory keyed by the content hash of the training
+    lexicon and the alignment options, so the aligned corpus is reused for any N-gram order, and the ARPA and FST
+    models are reused for the same N-gram order. Each artifact is built into a temporary file and renamed after its
+    command is finished successfully, so an interrupted stage never leaves a broken artifact. Commands are run by the
+    job runner, so a failed or timed out command stops the training right away, and `train_async()` allows to train
+    several models concurrently under the concurrency limit of the runner. The modification time of a subdirectory is
+    updated at each use, so least recently used subdirectories can be removed by `prune_model_store()`.
+    """
+
+    def __init__(self, store_dir, seq1_del=False, seq2_del=True, seq1_max=2, seq2_max=2, grow=False,
+                 verbose=True, runner=None):
+        self.store_dir = store_dir
+        self.alignment_options = {
+            'seq1_del': seq1_del,
+            'seq2_del': seq2_del,
+            'seq1_max': seq1_max,
+            'seq2_max': seq2_max,
+            'grow': grow
+        }
+        self.verbose = verbose
+        self.runner = JobRunner() if runner is None else runner
+        self.stages_log = list()
+        self._running_stages = dict()
+
+    def get_model_dir(self, lexicon_file_name):
+        model_key = hashlib.sha1(json.dumps([calculate_file_hash(lexicon_file_name), self.alignment_options],
+                                            sort_keys=True).encode('utf-8')).hexdigest()
+        return os.path.join(self.store_dir, model_key)
+
+    async def _run_stage(self, stage_name, target_name, create_command):
+        # concurrent trainings may need the same artifact (e.g. the alignment for different N-gram sizes), so it is
+        # built once, and other trainings wait for it
+        while target_name in self._running_stages:
+            await self._running_stages[target_name].wait()
+        if os.path.isfile(target_name):
+            self.stages_log.append((stage_name, target_name, True))
+            if self.verbose:
+                print(u'Stage "{0}" is cached: {1}'.format(stage_name, target_name))
+            return
+        tmp_name = u'{0}.tmp{1}'.format(target_name, os.getpid())
+        self._running_stages[target_name] = asyncio.Event()
+        try:
+            cmd = create_command(tmp_name)
+            await self.runner.run(cmd)
+            assert os.path.isfile(tmp_name), u'Command "{0}" has not created a file "{1}"!'.format(u' '.join(cmd),
+                                                                                                  tmp_name)
+            os.rename(tmp_name, target_name)
+        finally:
+            if os.path.isfile(tmp_name):
+                os.remove(tmp_name)
+            self._running_stages.pop(target_name).set()
+        self.stages_log.append((stage_name, target_name, False))
+        if self.verbose:
+            print(u'Stage "{0}" is rebuilt: {1}'.format(stage_name, target_name))
+
+    async def align_async(self, lexicon_file_name):
+        model_dir = self.get_model_dir(lexicon_file_name)
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+        os.utime(model_dir, None)
+        corpus_name = os.path.join(model_dir, 'russian_g2p.corpus')
+        await self._run_stage(u'alignment', corpus_name, lambda output_name: [
+            'phonetisaurus-align', '--input={0}'.format(lexicon_file_name), '--ofile={0}'.format(output_name),
+            '--seq1_del={0}'.format(str(self.alignment_options['seq1_del']).lower()),
+            '--seq2_del={0}'.format(str(self.alignment_options['seq2_del']).lower()),
+            '--seq1_max={0}'.format(self.alignment_options['seq1_max']),
+            '--seq2_max={0}'.format(self.alignment_options['seq2_max']),
+            '--grow={0}'.format(str(self.alignment_options['grow']).lower())
+        ])
+        return corpus_name
+
+    async def train_async(self, lexicon_file_name, ngram):
+        corpus_name = await self.align_async(lexicon_file_name)
+        model_dir = os.path.dirname(corpus_name)
+        arpa_name = os.path.join(model_dir, 'russian_g2p.{0}gram.arpa'.format(ngram))
+        await self._run_stage(u'{0}-gram model'.format(ngram), arpa_name, lambda output_name: [
+            'estimate-ngram', '-o', str(ngram), '-t', corpus_name, '-wl', output_name
+        ])
+        fst_name = os.path.join(model_dir, 'russian_g2p.{0}gram.fst'.format(ngram))
+        await self._run_stage(u'{0}-gram FST'.format(ngram), fst_name, lambda output_name: [
+            'phonetisaurus-arpa2wfst', '--lm={0}'.format(arpa_name), '--ofile={0}'.format(output_name)
+        ])
+        return fst_name
+
+    def align(self, lexicon_file_name):
+        return run_until_complete(self.align_async(lexicon_file_name))
+
+    def train(self, lexicon_file_name, ngram):
+        return run_until_complete(self.train_async(lexicon_file_name, ngram))
+
+
+def calculate_dir_size(dir_name):
+    dir_size = 0
+    for root_dir, _, file_names in os.walk(dir_name):
+        for cur_name in file_names:
+            try:
+                dir_size += os.path.getsize(os.path.join(root_dir, cur_name))
+            except OSError:
+                pass
+    return dir_size
+
+
+def prune_model_store(store_dir, max_size, keep_dirs=()):
+    """ Remove least recently used subdirectories of the model store until its total size is not greater than
+    `max_size` bytes. Subdirectories from `keep_dirs` (e.g. the directory of the final model) are never removed.
+    Return the number of removed subdirectories and the number of freed bytes.
+    """
+    if not os.path.isdir(store_dir):
+        return 0, 0
+    keep_dirs = set(os.path.abspath(cur) for cur in keep_dirs)
+    model_dirs = list()
+    for cur_name in os.listdir(store_dir):
+        model_dir = os.path.join(store_dir, cur_name)
+        if os.path.isdir(model_dir):
+            model_dirs.append((os.path.getmtime(model_dir), model_dir, calculate_dir_size(model_dir)))
+    total_size = sum(cur[2] for cur in model_dirs)
+    n_removed = 0
+    freed_size = 0
+    for _, model_dir, dir_size in sorted(model_dirs):
+        if total_size - freed_size <= max_size:
+            break
+        if os.path.abspath(model_dir) in keep_dirs:
+            continue
+        shutil.rmtree(model_dir, ignore_errors=True)
+        n_removed += 1
+        freed_size += dir_size
+    return n_removed, freed_size
+
+
+def install_model(fst_name, model_dir):
+    target_name = os.path.join(model_dir, 'russian_g2p.fst')
+    tmp_name = u'{0}.tmp{1}'.format(target_name, os.getpid())
+    shutil.copyfile(fst_name, tmp_name)
+    os.rename(tmp_name, target_name)
+    return target_name
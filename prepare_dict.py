@@ -2,39 +2,45 @@
 # -*- coding: utf-8 -*-
 
 from argparse import ArgumentParser
-import codecs
+from array import array
+from bisect import bisect_left
+import hashlib
+import json
+import mmap
 import os
+import re
+import struct
+import sys
+
+import numpy as np
+
+from lexicon_io import STDIN_NAME, is_compressed, is_readable, open_for_reading, write_lexicon
+
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
+
+PHONE_RE = re.compile(u'[A-Z][0-9A-Za-z]*\\Z')
+TRANSCRIPTION_RE = re.compile(u'[A-Z][0-9A-Za-z]*(?: [A-Z][0-9A-Za-z]*)*\\Z')
+BINARY_LEXICON_MAGIC = b'RUG2PLEX'
+BINARY_LEXICON_VERSION = 1
 
 
 def check_transcription(phones_list):
     if len(phones_list) == 0:
         return False
-    ok = True
-    admissible_characters = set(u'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
     for cur_phone in phones_list:
-        if len(cur_phone) == 0:
-            ok = False
-            break
-        if cur_phone[0].isdigit():
-            ok = False
-            break
-        if not(set(cur_phone) <= admissible_characters):
-            ok = False
-            break
-        if not cur_phone[0].isupper():
-            ok = False
-            break
-    return ok
+        if PHONE_RE.match(cur_phone) is None:
+            return False
+    return True
 
 
 def check_token(checked):
     if len(checked) == 0:
         return False
-    if checked.isalpha():
-        return True
-    if u'\'' not in checked:
-        return False
-    return all(filter(lambda it: (len(it) > 0) and it.isalpha(), checked.split(u'\'')))
+    return checked.isalpha() or (u'\'' in checked)
 
 
 def get_token(source_word):
@@ -43,52 +49,314 @@ def get_token(source_word):
     if (found_idx1 < 0) and (found_idx2 < 0):
         cleaned_word = source_word
     else:
-        if (found_idx1 >= 0) and (found_idx2 >= 0):
-            if (found_idx1 > 0) and (found_idx2 == len(source_word) - 1):
-                if source_word[(found_idx1 + 1):found_idx2].isdigit():
-                    cleaned_word = source_word[:found_idx1]
-                else:
-                    cleaned_word = u''
-            else:
-                cleaned_word = u''
+        if (found_idx1 > 0) and (found_idx2 == len(source_word) - 1) and \
+                source_word[(found_idx1 + 1):found_idx2].isdigit():
+            cleaned_word = source_word[:found_idx1]
         else:
             cleaned_word = u''
-    if len(cleaned_word) > 0:
-        if u'-' in cleaned_word:
-            if not all(filter(lambda it: check_token(it), cleaned_word.split(u'-'))):
-                cleaned_word = u''
-        else:
-            if not check_token(cleaned_word):
-                cleaned_word = u''
+    # a variant mark "(N)" is removed, and a word with a hyphen is accepted as is, without checking of its characters
+    if (len(cleaned_word) > 0) and (u'-' not in cleaned_word) and (not check_token(cleaned_word)):
+        cleaned_word = u''
     return cleaned_word
 
 
-def load_lexicon(file_name):
-    line_idx = 1
+def parse_lexicon_line(source_line, file_name, line_idx):
+    parts = source_line.split()
+    if len(parts) == 0:
+        return None
+    assert len(parts) >= 2, 'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    new_transcription = u' '.join(parts[1:])
+    assert TRANSCRIPTION_RE.match(new_transcription) is not None, \
+        u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    new_token = get_token(parts[0])
+    assert len(new_token) > 0, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+    return new_token, new_transcription
+
+
+def add_to_lexicon(words, new_token, new_transcription):
+    if new_token in words:
+        words[new_token].append(new_transcription)
+    else:
+        words[new_token] = [new_transcription]
+
+
+def iterate_lines(fp, chunk_size=1 << 22):
+    tail = u''
+    chunk = fp.read(chunk_size)
+    while len(chunk) > 0:
+        lines = (tail + chunk).splitlines(True)
+        tail = lines.pop()
+        for cur_line in lines:
+            yield cur_line
+        chunk = fp.read(chunk_size)
+    if len(tail) > 0:
+        yield tail
+
+
+class CompactLexicon(Mapping):
+    """ Read-only lexicon, in which phones are interned into small integer IDs.
+
+    Words are kept in a sorted list, and transcriptions are kept in array-backed buffers: `word_offsets[i]` is the
+    index of the first transcription of the i-th word, and `transcription_offsets[j]` is the position of the first
+    phone of the j-th transcription in the `codes` buffer. Transcriptions of each word keep their source order.
+    """
+
+    def __init__(self, words, word_offsets, transcription_offsets, codes, phones):
+        self.words = words
+        self.word_offsets = word_offsets
+        self.transcription_offsets = transcription_offsets
+        self.codes = codes
+        self.phones = phones
+
+    def _find(self, word):
+        idx = bisect_left(self.words, word)
+        if (idx >= len(self.words)) or (self.words[idx] != word):
+            return -1
+        return idx
+
+    def __contains__(self, word):
+        return self._find(word) >= 0
+
+    def __getitem__(self, word):
+        return [u' '.join([self.phones[cur_code] for cur_code in cur_codes]) for cur_codes in self.get_codes(word)]
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def get_codes(self, word):
+        idx = self._find(word)
+        if idx < 0:
+            raise KeyError(word)
+        return [self.codes[self.transcription_offsets[cur]:self.transcription_offsets[cur + 1]]
+                for cur in range(self.word_offsets[idx], self.word_offsets[idx + 1])]
+
+
+def create_compact_lexicon(entries):
+    word_ids = dict()
+    phone_ids = dict()
+    phones = list()
+    entry_words = array('L')
+    entry_offsets = array('L', [0])
+    entry_codes = array('H')
+    for new_token, new_transcription in entries:
+        word_id = word_ids.get(new_token)
+        if word_id is None:
+            word_id = len(word_ids)
+            word_ids[new_token] = word_id
+        entry_words.append(word_id)
+        new_phones = new_transcription.split()
+        try:
+            entry_codes.extend([phone_ids[cur_phone] for cur_phone in new_phones])
+        except KeyError:
+            for cur_phone in new_phones:
+                if cur_phone not in phone_ids:
+                    phone_ids[cur_phone] = len(phones)
+                    phones.append(cur_phone)
+            entry_codes.extend([phone_ids[cur_phone] for cur_phone in new_phones])
+        entry_offsets.append(len(entry_codes))
+    words = sorted(word_ids.keys())
+    word_ranks = np.empty(len(words), dtype=np.int64)
+    for rank, cur_word in enumerate(words):
+        word_ranks[word_ids[cur_word]] = rank
+    del word_ids
+    entry_ranks = word_ranks[np.array(entry_words, dtype=np.int64)]
+    del entry_words, word_ranks
+    word_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(entry_ranks, minlength=len(words)), out=word_offsets[1:])
+    order = np.argsort(entry_ranks, kind='stable')
+    entry_offsets = np.array(entry_offsets, dtype=np.int64)
+    transcription_lengths = np.diff(entry_offsets)[order]
+    transcription_offsets = np.zeros(order.shape[0] + 1, dtype=np.int64)
+    np.cumsum(transcription_lengths, out=transcription_offsets[1:])
+    code_positions = np.repeat(entry_offsets[order] - transcription_offsets[:-1], transcription_lengths) + \
+        np.arange(transcription_offsets[-1], dtype=np.int64)
+    codes = np.array(entry_codes, dtype=np.uint16)[code_positions]
+    return CompactLexicon(words, word_offsets, transcription_offsets, codes, phones)
+
+
+class MappedWordTable(Sequence):
+    def __init__(self, buffer, base_offset, positions):
+        self.buffer = buffer
+        self.base_offset = base_offset
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[cur] for cur in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if (idx < 0) or (idx >= len(self)):
+            raise IndexError(idx)
+        return self.buffer[(self.base_offset + self.positions[idx]):
+                           (self.base_offset + self.positions[idx + 1])].decode('utf-8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class MappedLexicon(CompactLexicon):
+    """ Compact lexicon, which is opened from the binary lexicon file through mmap without parsing.
+
+    The word table, offsets and phone codes are views of the mapped file, so opening is near-instant, memory pages
+    are shared by all processes which open the same file (the mapped lexicon cannot be pickled, so each process has to
+    open the file itself), and each lookup by word is a binary search.
+    """
+
+    def __init__(self, words, word_offsets, transcription_offsets, codes, phones, content_hash, metadata):
+        super(MappedLexicon, self).__init__(words, word_offsets, transcription_offsets, codes, phones)
+        self.content_hash = content_hash
+        self.metadata = metadata
+
+    def _find(self, word):
+        key = word.encode('utf-8')
+        buffer = self.words.buffer
+        base_offset = self.words.base_offset
+        positions = self.words.positions
+        left = 0
+        right = len(self.words)
+        while left < right:
+            middle = (left + right) // 2
+            if buffer[(base_offset + positions[middle]):(base_offset + positions[middle + 1])] < key:
+                left = middle + 1
+            else:
+                right = middle
+        if (left < len(self.words)) and \
+                (buffer[(base_offset + positions[left]):(base_offset + positions[left + 1])] == key):
+            return left
+        return -1
+
+
+def calculate_lexicon_hash(lexicon):
+    hasher = hashlib.sha256()
+    for cur_word in sorted(lexicon.keys()):
+        for cur_transcription in lexicon[cur_word]:
+            hasher.update(u'{0}\t{1}\n'.format(cur_word, cur_transcription).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def save_binary_lexicon(lexicon, file_name, metadata=None):
+    if not isinstance(lexicon, CompactLexicon):
+        lexicon = create_compact_lexicon(
+            (cur_word, cur_transcription)
+            for cur_word in sorted(lexicon.keys()) for cur_transcription in lexicon[cur_word]
+        )
+    encoded_words = [cur_word.encode('utf-8') for cur_word in lexicon.words]
+    word_positions = np.zeros(len(encoded_words) + 1, dtype=np.int64)
+    np.cumsum([len(cur_word) for cur_word in encoded_words], out=word_positions[1:])
+    assert max(int(word_positions[-1]), len(lexicon.codes)) < (1 << 32), u'Lexicon is too large!'
+    sections = [
+        ('word_positions', np.asarray(word_positions, dtype='<u4').tobytes(), word_positions.shape[0]),
+        ('word_offsets', np.asarray(lexicon.word_offsets, dtype='<u4').tobytes(), len(lexicon.word_offsets)),
+        ('transcription_offsets', np.asarray(lexicon.transcription_offsets, dtype='<u4').tobytes(),
+         len(lexicon.transcription_offsets)),
+        ('codes', np.asarray(lexicon.codes, dtype='<u2').tobytes(), len(lexicon.codes)),
+        ('words', b''.join(encoded_words), int(word_positions[-1]))
+    ]
+    header = {
+        'version': BINARY_LEXICON_VERSION,
+        'phones': list(lexicon.phones),
+        'content_hash': calculate_lexicon_hash(lexicon),
+        'metadata': dict() if metadata is None else metadata,
+        'sections': dict()
+    }
+    section_offset = 0
+    for section_name, section_data, section_size in sections:
+        header['sections'][section_name] = [section_offset, section_size]
+        section_offset += len(section_data) + (-len(section_data)) % 8
+    header_data = json.dumps(header, sort_keys=True).encode('utf-8')
+    header_data += b' ' * ((-len(header_data)) % 8)
+    with open(file_name, 'wb') as fp:
+        fp.write(BINARY_LEXICON_MAGIC)
+        fp.write(struct.pack('<Q', len(header_data)))
+        fp.write(header_data)
+        for section_name, section_data, section_size in sections:
+            fp.write(section_data)
+            fp.write(b'\x00' * ((-len(section_data)) % 8))
+
+
+def is_binary_lexicon(file_name):
+    # the binary lexicon is opened through mmap, so it can be neither compressed nor read from the standard input
+    if (file_name == STDIN_NAME) or is_compressed(file_name):
+        return False
+    with open(file_name, 'rb') as fp:
+        return fp.read(len(BINARY_LEXICON_MAGIC)) == BINARY_LEXICON_MAGIC
+
+
+def load_binary_lexicon(file_name):
+    with open(file_name, 'rb') as fp:
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    magic_size = len(BINARY_LEXICON_MAGIC)
+    assert buffer[:magic_size] == BINARY_LEXICON_MAGIC, u'File "{0}" is not a binary lexicon!'.format(file_name)
+    header_size = struct.unpack('<Q', buffer[magic_size:(magic_size + 8)])[0]
+    header = json.loads(buffer[(magic_size + 8):(magic_size + 8 + header_size)].decode('utf-8'))
+    assert header['version'] == BINARY_LEXICON_VERSION, \
+        u'File "{0}": version {1} of the binary lexicon is not supported!'.format(file_name, header['version'])
+    data_offset = magic_size + 8 + header_size
+
+    def get_section(section_name, dtype):
+        section_offset, section_size = header['sections'][section_name]
+        return np.frombuffer(buffer, dtype=dtype, count=section_size, offset=data_offset + section_offset)
+
+    word_positions = get_section('word_positions', '<u4')
+    if sys.byteorder == 'little':
+        word_positions = memoryview(word_positions).cast('B').cast('I')
+    else:
+        word_positions = word_positions.tolist()
+    words = MappedWordTable(buffer, data_offset + header['sections']['words'][0], word_positions)
+    return MappedLexicon(words, get_section('word_offsets', '<u4'), get_section('transcription_offsets', '<u4'),
+                         get_section('codes', '<u2'), header['phones'], header['content_hash'], header['metadata'])
+
+
+def iterate_lexicon_entries(file_name):
+    with open_for_reading(file_name, newline='') as fp:
+        for line_idx, cur in enumerate(iterate_lines(fp), start=1):
+            res = parse_lexicon_line(cur, file_name, line_idx)
+            if res is not None:
+                yield res
+
+
+def load_lexicon(file_name, compact=False):
+    if is_binary_lexicon(file_name):
+        return load_binary_lexicon(file_name)
+    if compact:
+        return create_compact_lexicon(iterate_lexicon_entries(file_name))
     words = dict()
-    with codecs.open(file_name, mode='r', encoding='utf-8', errors='ignore') as fp:
-        cur = fp.readline()
-        while len(cur) > 0:
-            prep = cur.strip()
-            if len(prep) > 0:
-                parts = prep.split()
-                assert len(parts) >= 2, 'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
-                assert check_transcription(parts[1:]), u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
-                new_token = get_token(parts[0])
-                assert len(new_token) > 0, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
-                new_transcription = ' '.join(parts[1:])
-                if new_token in words:
-                    words[new_token].append(new_transcription)
-                else:
-                    words[new_token] = [new_transcription]
-            cur = fp.readline()
-            line_idx += 1
+    for new_token, new_transcription in iterate_lexicon_entries(file_name):
+        if new_token in words:
+            words[new_token].append(new_transcription)
+        else:
+            words[new_token] = [new_transcription]
     return words
 
 
+def normalize_word(source_word):
+    return source_word.strip().lower()
+
+
+def read_word_list(file_name):
+    with open_for_reading(file_name, errors='strict') as fp:
+        curline = fp.readline()
+        while len(curline) > 0:
+            prepline = normalize_word(curline)
+            if len(prepline) > 0:
+                yield prepline
+            curline = fp.readline()
+
+
 def main():
     parser = ArgumentParser()
-    parser.add_argument('-s', '--src', dest='src', type=str, required=True, help=u'Source name of dictionary.')
+    parser.add_argument('command', type=str, nargs='?', choices=['format', 'compile'], default='format',
+                        help=u'"format" writes the dictionary as a text file in the training format, and "compile" '
+                             u'writes it as a binary lexicon for fast loading through mmap.')
+    parser.add_argument('-s', '--src', dest='src', type=str, required=True,
+                        help=u'Source name of dictionary (it may be compressed, and "-" means the standard input).')
     parser.add_argument('-d', '--dst', dest='dst', type=str, required=True,
                         help=u'Destination name of dictionary (after its formatting).')
     args = parser.parse_args()
@@ -96,15 +364,17 @@ def main():
     src_name = os.path.normpath(args.src)
     dst_name = os.path.normpath(args.dst)
 
-    assert os.path.isfile(src_name), u'File "{0}" does not exist!'.format(src_name)
+    assert is_readable(src_name), u'File "{0}" does not exist!'.format(src_name)
     dst_dir = os.path.dirname(dst_name)
-    assert os.path.isdir(dst_dir), u'Directory "{0}" does not exist!'.format(dst_dir)
+    assert (len(dst_dir) == 0) or os.path.isdir(dst_dir), u'Directory "{0}" does not exist!'.format(dst_dir)
 
+    if args.command == 'compile':
+        assert not is_compressed(dst_name), u'Binary lexicon "{0}" cannot be compressed!'.format(dst_name)
+        save_binary_lexicon(load_lexicon(src_name, compact=True), dst_name)
+        return
     words_and_transcriptions = load_lexicon(src_name)
-    with codecs.open(dst_name, mode='w', encoding='utf-8', errors='ignore') as fp:
-        for cur_word in sorted(list(words_and_transcriptions.keys())):
-            for cur_transcirption in words_and_transcriptions[cur_word]:
-                fp.write(u'{0}\t{1}\n'.format(cur_word, cur_transcirption))
+    write_lexicon(dst_name, ((cur_word, words_and_transcriptions[cur_word])
+                             for cur_word in sorted(words_and_transcriptions.keys())), 'tab')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import codecs
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_cpu_time():
+    try:
+        return time.process_time()
+    except AttributeError:
+        cur_times = os.times()
+        return cur_times[0] + cur_times[1]
+
+
+def get_max_rss_so_far():
+    if resource is None:
+        return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+class StageProfiler(object):
+    """ Recorder of wall time, CPU time, maximal RSS and item counts for pipeline stages.
+
+    Each stage is measured by the `stage()` context manager, which yields a record (a dictionary); the caller may set
+    the `items` key of this record to the number of processed items. Finished records (including records of failed
+    stages, which are marked by the `failed` key) are passed to all registered hooks, so progress can be tracked
+    outside of the pipeline, and they can be saved as a JSON report. CPU time of child processes (i.e. Phonetisaurus
+    tools) is measured separately from CPU time of the Python process. Records of worker processes are merged by
+    `extend()`.
+
+    The maximal RSS is the high-water mark of the process (and of its finished children) since its start, not a peak
+    of the stage itself: `ru_maxrss` cannot be reset, so it is reported as `max_rss_so_far`, and a stage, which is not
+    the largest one so far, reports the value of a previous stage.
+    """
+
+    def __init__(self):
+        self.records = list()
+        self.hooks = list()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextmanager
+    def stage(self, stage_name, **labels):
+        record = {'stage': stage_name, 'labels': labels, 'items': None, 'pid': os.getpid()}
+        start_wall_time = time.time()
+        start_cpu_time = get_cpu_time()
+        start_times = os.times()
+        is_failed = True
+        try:
+            yield record
+            is_failed = False
+        finally:
+            finish_times = os.times()
+            record['failed'] = is_failed
+            record['wall_time'] = time.time() - start_wall_time
+            record['cpu_time'] = get_cpu_time() - start_cpu_time
+            record['children_cpu_time'] = (finish_times[2] - start_times[2]) + (finish_times[3] - start_times[3])
+            record['max_rss_so_far'], record['children_max_rss_so_far'] = get_max_rss_so_far()
+            if (record['items'] is not None) and (record['wall_time'] > 0.0):
+                record['items_per_second'] = record['items'] / record['wall_time']
+            self.add_record(record)
+
+    def add_record(self, record):
+        self.records.append(record)
+        for cur_hook in self.hooks:
+            cur_hook(record)
+
+    def extend(self, records):
+        for cur_record in records:
+            self.add_record(cur_record)
+
+    def summarize(self):
+        summary = dict()
+        for cur_record in self.records:
+            if cur_record['stage'] not in summary:
+                summary[cur_record['stage']] = {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                                'children_cpu_time': 0.0, 'items': 0, 'max_rss_so_far': None}
+            stage_summary = summary[cur_record['stage']]
+            stage_summary['count'] += 1
+            for key in ('wall_time', 'cpu_time', 'children_cpu_time'):
+                stage_summary[key] += cur_record[key]
+            if cur_record['items'] is not None:
+                stage_summary['items'] += cur_record['items']
+            if cur_record['max_rss_so_far'] is not None:
+                stage_summary['max_rss_so_far'] = max(stage_summary['max_rss_so_far'] or 0,
+                                                      cur_record['max_rss_so_far'])
+        return summary
+
+    def save_json(self, file_name, script_name=None):
+        report = {
+            'script': script_name,
+            'argv': sys.argv,
+            'stages': self.records,
+            'summary': self.summarize()
+        }
+        with codecs.open(file_name, mode='w', encoding='utf-8', errors='ignore') as fp:
+            fp.write(json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True))
+
+
+profiler = StageProfiler()
+
+
+def profile_stage(stage_name, **labels):
+    return profiler.stage(stage_name, **labels)
+
+
+def add_hook(hook):
+    profiler.add_hook(hook)
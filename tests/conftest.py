@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'benchmarks')
+
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BENCHMARKS_DIR, TESTS_DIR
+from lexicon_io import open_for_reading
+from synthetic_lexicon import iterate_synthetic_lexicon
+
+
+APPLY_NAME = os.path.join(os.path.dirname(TESTS_DIR), 'apply.py')
+STUB_DECODER_NAME = os.path.join(BENCHMARKS_DIR, 'stub_decoder.py')
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    dir_name = tmp_path / 'model'
+    dir_name.mkdir()
+    (dir_name / 'russian_g2p.fst').write_bytes(b'')
+    return str(dir_name)
+
+
+@pytest.fixture
+def word_list_name(tmp_path):
+    file_name = str(tmp_path / 'words.txt')
+    with io.open(file_name, mode='w', encoding='utf-8') as fp:
+        for cur_word, _ in iterate_synthetic_lexicon(300, seed=1):
+            fp.write(cur_word + u'\n')
+        # a word, which the stub cannot transcribe
+        fp.write(u'нет\n')
+    return file_name
+
+
+def apply_model(model_dir, word_list_name, destination_name, *args):
+    subprocess.check_call([sys.executable, APPLY_NAME, '-s', word_list_name, '-d', destination_name, '-m', model_dir,
+                           '--decoder', STUB_DECODER_NAME, '-p', '0.9'] + list(args), stdout=subprocess.DEVNULL)
+    with io.open(destination_name, mode='r', encoding='utf-8') as fp:
+        return fp.read()
+
+
+def test_streaming_mode(model_dir, word_list_name, tmp_path):
+    expected = apply_model(model_dir, word_list_name, str(tmp_path / 'in_memory.dic'))
+    assert len(expected.splitlines()) == 300
+    assert apply_model(model_dir, word_list_name, str(tmp_path / 'streamed.dic'), '--stream',
+                       '--chunk-size', '7') == expected
+    assert apply_model(model_dir, word_list_name, str(tmp_path / 'streamed.txt'), '--stream',
+                       '--chunk-size', '7', '--format', 'tab') == \
+        apply_model(model_dir, word_list_name, str(tmp_path / 'in_memory.txt'), '--format', 'tab')
+
+
+def test_parallel_decoding(model_dir, word_list_name, tmp_path):
+    expected = apply_model(model_dir, word_list_name, str(tmp_path / 'single.dic'))
+    assert apply_model(model_dir, word_list_name, str(tmp_path / 'parallel.dic'), '-j', '3') == expected
+    assert apply_model(model_dir, word_list_name, str(tmp_path / 'parallel_streamed.dic'), '-j', '3', '--stream',
+                       '--chunk-size', '50') == expected
+
+
+def test_standard_input_and_compression(model_dir, word_list_name, tmp_path):
+    expected = apply_model(model_dir, word_list_name, str(tmp_path / 'plain.dic'))
+    destination_name = str(tmp_path / 'compressed.dic.xz')
+    with open(word_list_name, 'rb') as fp:
+        subprocess.check_call([sys.executable, APPLY_NAME, '-s', '-', '-d', destination_name, '-m', model_dir,
+                               '--decoder', STUB_DECODER_NAME, '-p', '0.9', '--stream'], stdin=fp,
+                              stdout=subprocess.DEVNULL)
+    with open_for_reading(destination_name) as fp:
+        assert fp.read() == expected
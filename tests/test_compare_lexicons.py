@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import io
+import random
+
+import pytest
+
+from compare_lexicons import ErrorStatistics, calculate_error_rates, compare_lexicons, count_errors, \
+    merge_error_statistics, save_error_analysis
+from synthetic_lexicon import distort_transcription, iterate_synthetic_lexicon
+
+
+TRUE_LEXICON = {
+    u'кот': [u'K O T'],
+    u'дом': [u'D O M', u'D A0 M'],
+    u'сад': [u'S A T'],
+    u'лес': [u'L E S']
+}
+PREDICTED_LEXICON = {
+    u'кот': [u'K A0 T'],
+    u'дом': [u'D A0 M'],
+    u'сад': [u'S A T A0'],
+    u'рот': [u'R O T']
+}
+
+
+def create_lexicons(n_words):
+    rnd = random.Random(1)
+    true_lexicon = dict()
+    predicted_lexicon = dict()
+    for cur_word, transcriptions in iterate_synthetic_lexicon(n_words, max_variants=3):
+        if rnd.random() > 0.05:
+            true_lexicon[cur_word] = transcriptions
+        if rnd.random() > 0.05:
+            predicted_lexicon[cur_word] = [distort_transcription(cur, rnd, 0.2) for cur in transcriptions[:2]]
+    return true_lexicon, predicted_lexicon
+
+
+def write_lexicon_file(file_name, lexicon):
+    with io.open(file_name, mode='w', encoding='utf-8') as fp:
+        for cur_word in sorted(lexicon):
+            for cur_transcription in lexicon[cur_word]:
+                fp.write(u'{0}\t{1}\n'.format(cur_word, cur_transcription))
+    return file_name
+
+
+def select_words(lexicon, words):
+    return dict((cur, lexicon[cur]) for cur in words if cur in lexicon)
+
+
+def get_confusion(statistics):
+    phones, confusion = statistics.get_sorted()
+    return dict(((phones[true_id], phones[predicted_id]), int(confusion[true_id, predicted_id]))
+                for true_id, predicted_id in zip(*confusion.nonzero()))
+
+
+def test_count_errors():
+    statistics = count_errors(TRUE_LEXICON, PREDICTED_LEXICON)
+    assert statistics.counters == {'substitutions': 1, 'deletions': 3, 'insertions': 4, 'phones': 12,
+                                   'word_errors': 4, 'words': 5}
+    word_error_rate, phone_error_rate = statistics.get_error_rates()
+    assert word_error_rate == pytest.approx(4 / 5.0)
+    assert phone_error_rate == pytest.approx(8 / 12.0)
+    assert statistics.length_counters[3].tolist() == [5, 4, 12, 8]
+
+
+def test_report():
+    report_fp = io.StringIO()
+    count_errors(TRUE_LEXICON, PREDICTED_LEXICON, report_fp=report_fp)
+    report = report_fp.getvalue().splitlines()
+    assert [cur.split(u'\t')[0] for cur in report[1:]] == [u'кот', u'лес', u'рот', u'сад']
+    assert report[1].split(u'\t')[1:] == [u'K O T', u'K A0 T', u'1', u'0', u'0', u'O>A0']
+    assert report[2].split(u'\t')[1:] == [u'L E S', u'', u'0', u'3', u'0', u'-L -E -S']
+
+
+def test_parallel_scoring():
+    true_lexicon, predicted_lexicon = create_lexicons(5000)
+    expected_report = io.StringIO()
+    expected = count_errors(true_lexicon, predicted_lexicon, report_fp=expected_report)
+    assert expected.counters['word_errors'] > 0
+    report = io.StringIO()
+    statistics = count_errors(true_lexicon, predicted_lexicon, n_jobs=2, report_fp=report)
+    assert statistics.counters == expected.counters
+    assert report.getvalue() == expected_report.getvalue()
+
+
+def test_compare_lexicons(tmp_path):
+    true_lexicon, predicted_lexicon = create_lexicons(300)
+    assert compare_lexicons(write_lexicon_file(str(tmp_path / 'true.dic'), true_lexicon),
+                            write_lexicon_file(str(tmp_path / 'predicted.dic'), predicted_lexicon)) == \
+        calculate_error_rates(true_lexicon, predicted_lexicon)
+
+
+def test_confusion_matrix():
+    assert get_confusion(count_errors(TRUE_LEXICON, PREDICTED_LEXICON)) == {
+        (u'K', u'K'): 1, (u'O', u'A0'): 1, (u'T', u'T'): 2,
+        (u'D', u'D'): 1, (u'A0', u'A0'): 1, (u'M', u'M'): 1,
+        (u'S', u'S'): 1, (u'A', u'A'): 1, (u'<eps>', u'A0'): 1,
+        (u'L', u'<eps>'): 1, (u'E', u'<eps>'): 1, (u'S', u'<eps>'): 1,
+        (u'<eps>', u'R'): 1, (u'<eps>', u'O'): 1, (u'<eps>', u'T'): 1
+    }
+
+
+def test_confusion_matrix_agrees_with_counters():
+    true_lexicon, predicted_lexicon = create_lexicons(2000)
+    statistics = count_errors(true_lexicon, predicted_lexicon, n_jobs=2)
+    confusion = statistics.confusion
+    n_substitutions = int(confusion[1:, 1:].sum() - confusion[1:, 1:].trace())
+    assert (n_substitutions, int(confusion[1:, 0].sum()), int(confusion[0, 1:].sum())) == (
+        statistics.counters['substitutions'], statistics.counters['deletions'], statistics.counters['insertions']
+    )
+    assert int(confusion[1:].sum()) == statistics.counters['phones']
+    assert statistics.length_counters.sum(axis=0).tolist() == [
+        statistics.counters['words'], statistics.counters['word_errors'], statistics.counters['phones'],
+        statistics.counters['substitutions'] + statistics.counters['deletions'] + statistics.counters['insertions']
+    ]
+
+
+def test_merging():
+    words = sorted(set(TRUE_LEXICON) | set(PREDICTED_LEXICON))
+    statistics_list = [count_errors(select_words(TRUE_LEXICON, cur), select_words(PREDICTED_LEXICON, cur))
+                       for cur in (words[:2], words[2:])]
+    merged = merge_error_statistics(statistics_list)
+    expected = count_errors(TRUE_LEXICON, PREDICTED_LEXICON)
+    assert merged.counters == expected.counters
+    assert get_confusion(merged) == get_confusion(expected)
+    assert merged.length_counters.tolist() == expected.length_counters.tolist()
+    assert ErrorStatistics().get_sorted()[0] == [u'<eps>']
+
+
+def test_error_analysis(tmp_path):
+    file_prefix = str(tmp_path / 'analysis')
+    save_error_analysis(file_prefix, [(u'1', count_errors(select_words(TRUE_LEXICON, [u'кот']),
+                                                          select_words(PREDICTED_LEXICON, [u'кот']))),
+                                      (u'2', count_errors(TRUE_LEXICON, PREDICTED_LEXICON))])
+    with io.open(file_prefix + u'_confusion.csv', mode='r', encoding='utf-8') as fp:
+        lines = fp.read().splitlines()
+    assert lines[0] == u'fold,true,predicted,count'
+    assert u'1,O,A0,1' in lines
+    assert u'2,L,<eps>,1' in lines
+    with io.open(file_prefix + u'_lengths.csv', mode='r', encoding='utf-8') as fp:
+        assert fp.read().splitlines()[1:] == [u'1,3,1,1,3,1,1.000000,0.333333',
+                                              u'2,3,5,4,12,8,0.800000,0.666667']
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import io
+import random
+
+import numpy as np
+import pytest
+
+from compare_lexicons import count_errors, load_error_statistics, save_error_statistics
+from do_experiments import CrossValidationRun, split_words_and_transcriptions_for_cv
+
+
+def create_lexicon(n_words):
+    return dict((u'слово{0}'.format(word_idx), [u'S L O V A0', u'S L O V O'][:(word_idx % 2 + 1)])
+                for word_idx in range(n_words))
+
+
+@pytest.mark.parametrize('n_words,cv', [(10, 3), (11, 3), (13, 5), (29, 4), (7, 7)])
+def test_folds_cover_all_words(n_words, cv):
+    random.seed(0)
+    folds = list(split_words_and_transcriptions_for_cv(create_lexicon(n_words), cv))
+    assert len(folds) == cv
+    assert max(len(cur) for cur in folds) - min(len(cur) for cur in folds) <= 1
+    testing_indices = np.concatenate([cur.get_testing_indices() for cur in folds])
+    assert sorted(testing_indices.tolist()) == list(range(n_words))
+    for cur_fold in folds:
+        assert sorted(cur_fold.get_training_indices().tolist() + cur_fold.get_testing_indices().tolist()) == \
+            list(range(n_words))
+
+
+def test_fold_parts(tmp_path):
+    lexicon = create_lexicon(11)
+    folds = list(split_words_and_transcriptions_for_cv(lexicon, 3, permutation=np.arange(11)[::-1]))
+    # 11 words do not divide into 3 folds, and rounded boundaries give the remainder to the last folds
+    assert [len(cur) for cur in folds] == [3, 4, 4]
+    testing_words = set()
+    for fold_idx, cur_fold in enumerate(folds):
+        training_name = str(tmp_path / 'train{0}.txt'.format(fold_idx))
+        testing_name = str(tmp_path / 'test{0}.txt'.format(fold_idx))
+        n_entries = cur_fold.save_training_part(training_name) + cur_fold.save_testing_part(testing_name)
+        assert n_entries == sum(len(cur) for cur in lexicon.values())
+        with io.open(testing_name, mode='r', encoding='utf-8') as fp:
+            cur_words = set(cur_line.split(u'\t')[0] for cur_line in fp)
+        assert len(cur_words) == len(cur_fold)
+        testing_words |= cur_words
+    assert testing_words == set(lexicon)
+
+
+def test_saving_of_error_statistics(tmp_path):
+    statistics_list = [count_errors({u'кот': [u'K O T']}, {u'кот': [u'K A0 T']}),
+                       count_errors({u'дом': [u'D O M'], u'сад': [u'S A T']}, {u'дом': [u'D O M']})]
+    file_name = str(tmp_path / 'fold1.npz')
+    save_error_statistics(file_name, statistics_list)
+    loaded = load_error_statistics(file_name)
+    assert len(loaded) == 2
+    for loaded_statistics, cur_statistics in zip(loaded, statistics_list):
+        assert loaded_statistics.counters == cur_statistics.counters
+        assert loaded_statistics.phones == cur_statistics.phones
+        assert loaded_statistics.confusion.tolist() == cur_statistics.confusion.tolist()
+        assert loaded_statistics.length_counters.tolist() == cur_statistics.length_counters.tolist()
+        assert loaded_statistics.get_error_rates() == cur_statistics.get_error_rates()
+
+
+def test_resuming_of_run(tmp_path):
+    run_dir = str(tmp_path / 'run')
+    settings = {'cv': 3, 'seed': 0, 'ngram': 5, 'pmass': 0.85, 'sweep': None}
+    cv_run = CrossValidationRun(run_dir, settings)
+    assert not cv_run.start(resume=True)
+    assert cv_run.load_permutation() is None
+    cv_run.save_permutation(np.arange(11)[::-1])
+    folds = list(enumerate(split_words_and_transcriptions_for_cv(create_lexicon(11), 3, cv_run.load_permutation())))
+    handled_folds = list()
+
+    def handle_fold_result(fold_idx, result, fold_records):
+        handled_folds.append((fold_idx, result[0].counters, result[1], fold_records))
+
+    statistics = count_errors({u'кот': [u'K O T']}, {u'кот': [u'K A0 T']})
+    stages_log = [(u'alignment', u'russian_g2p.corpus', True)]
+    fold_records = [{'stage': u'fold', 'labels': {'fold': 2}, 'wall_time': 1.5}]
+    cv_run.create_fold_handler(handle_fold_result, lambda result: [result[0]])(1, (statistics, stages_log),
+                                                                               fold_records)
+    del handled_folds[:]
+
+    cv_run = CrossValidationRun(run_dir, settings)
+    assert cv_run.start(resume=True)
+    assert cv_run.load_permutation().tolist() == list(range(11))[::-1]
+    remaining_folds = cv_run.restore_folds(folds, handle_fold_result,
+                                           lambda statistics_list, restored_log: (statistics_list[0], restored_log))
+    assert [fold_idx for fold_idx, _ in remaining_folds] == [0, 2]
+    assert handled_folds == [(1, statistics.counters, stages_log,
+                              [{'stage': u'fold', 'labels': {'fold': 2, 'restored': True}, 'wall_time': 1.5}])]
+
+    with pytest.raises(AssertionError):
+        CrossValidationRun(run_dir, dict(settings, seed=1)).start(resume=True)
+    cv_run = CrossValidationRun(run_dir, dict(settings, seed=1))
+    assert not cv_run.start(resume=False)
+    assert cv_run.load_permutation() is None
+    assert len(cv_run.restore_folds(folds, handle_fold_result, None)) == 3
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from conftest import BENCHMARKS_DIR
+from g2p_engine import G2PEngine, ParallelG2PEngine, filter_by_pmass
+from job_runner import run_until_complete
+
+
+STUB_DECODER_NAME = os.path.join(BENCHMARKS_DIR, 'stub_decoder.py')
+WORDS = [u'бабаба', u'кото', u'лумина']
+
+
+@pytest.fixture
+def model_name(tmp_path):
+    # the stub decoder only checks that the model file exists
+    file_name = tmp_path / 'russian_g2p.fst'
+    file_name.write_bytes(b'')
+    return str(file_name)
+
+
+def test_transcribe_with_stub_decoder(model_name):
+    with G2PEngine(model_name, pmass=0.85, decoder=STUB_DECODER_NAME) as g2p_engine:
+        assert g2p_engine.model is None
+        predicted = g2p_engine.transcribe(WORDS + [u'нет'])
+    assert predicted == {
+        u'бабаба': [u'B A B A0 B A0'],
+        u'кото': [u'K O T A0'],
+        u'лумина': [u'L U M I0 N A0']
+    }
+
+
+def test_transcribe_with_scores_and_pmass(model_name):
+    g2p_engine = G2PEngine(model_name, decoder=STUB_DECODER_NAME)
+    scored = run_until_complete(g2p_engine.transcribe_with_scores_async(WORDS))
+    assert [score for score, _ in scored[u'бабаба']] == pytest.approx([0.0, 1.5, 3.0])
+    assert [transcription for _, transcription in scored[u'бабаба']] == [
+        u'B A B A0 B A0', u'B A0 B A B A0', u'B A0 B A0 B A'
+    ]
+    assert filter_by_pmass(scored[u'бабаба'], 0.5) == [u'B A B A0 B A0']
+    assert filter_by_pmass(scored[u'бабаба'], 0.85) == [u'B A B A0 B A0', u'B A0 B A B A0']
+    assert len(filter_by_pmass(scored[u'бабаба'], 0.99)) == 3
+    assert filter_by_pmass([], 0.85) == []
+
+
+
+def test_parallel_engine_statistics(model_name):
+    with ParallelG2PEngine(model_name, decoder=STUB_DECODER_NAME, n_jobs=2) as g2p_engine:
+        first_predicted = g2p_engine.transcribe(WORDS)
+        second_predicted = g2p_engine.transcribe(WORDS[:1])
+        shard_statistics = g2p_engine.shard_statistics
+    with G2PEngine(model_name, decoder=STUB_DECODER_NAME) as g2p_engine:
+        assert first_predicted == g2p_engine.transcribe(WORDS)
+        assert second_predicted == g2p_engine.transcribe(WORDS[:1])
+    assert [(shard_idx, n_words) for shard_idx, n_words, _ in shard_statistics] == [(0, 2), (1, 1), (2, 1)]
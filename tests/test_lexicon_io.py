@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import TESTS_DIR
+from lexicon_io import LexiconWriter, iterate_merged_entries, merge_transcriptions, open_for_reading, \
+    open_for_writing, write_lexicon
+from prepare_dict import is_binary_lexicon, load_lexicon, read_word_list
+
+
+PREPARE_DICT_NAME = os.path.join(os.path.dirname(TESTS_DIR), 'prepare_dict.py')
+
+
+TRAINING_LEXICON = {u'дом': [u'D O M'], u'кот': [u'K O T', u'K A0 T']}
+PREDICTED_LEXICON = {u'кот': [u'K A0 T', u'K O0 T', u'K A0 T'], u'сад': [u'S A T'], u'лес': []}
+
+
+def read_text(file_name):
+    with io.open(file_name, mode='r', encoding='utf-8', newline=u'') as fp:
+        return fp.read()
+
+
+def test_merge_transcriptions():
+    assert merge_transcriptions([u'A', u'B'], [u'B', u'C', u'A'], []) == [u'A', u'B', u'C']
+    assert list(iterate_merged_entries(TRAINING_LEXICON, PREDICTED_LEXICON)) == [
+        (u'дом', [u'D O M']), (u'кот', [u'K O T', u'K A0 T', u'K O0 T']), (u'сад', [u'S A T'])
+    ]
+
+
+@pytest.mark.parametrize('lexicon_format,expected', [
+    ('cmu', u'дом D O M\nкот K O T\nкот(2) K A0 T\nкот(3) K O0 T\nсад S A T\n'),
+    ('tab', u'дом\tD O M\nкот\tK O T\nкот\tK A0 T\nкот\tK O0 T\nсад\tS A T\n')
+])
+def test_write_lexicon(tmp_path, lexicon_format, expected):
+    file_name = str(tmp_path / 'lexicon.dic')
+    assert write_lexicon(file_name, iterate_merged_entries(TRAINING_LEXICON, PREDICTED_LEXICON), lexicon_format) == 3
+    assert read_text(file_name) == expected
+    assert load_lexicon(file_name) == {u'дом': [u'D O M'], u'кот': [u'K O T', u'K A0 T', u'K O0 T'],
+                                       u'сад': [u'S A T']}
+
+
+def test_writer_chunks(tmp_path):
+    file_name = str(tmp_path / 'lexicon.dic')
+    with LexiconWriter(file_name, 'tab', chunk_size=16) as writer:
+        for word_idx in range(100):
+            writer.write(u'слово{0}'.format(word_idx), [u'S L O V A0', u'S L O V O'])
+        writer.write(u'пусто', [])
+    assert (writer.n_words, writer.n_entries) == (100, 200)
+    assert len(read_text(file_name).splitlines()) == 200
+
+
+@pytest.mark.parametrize('extension', ['.gz', '.xz', '.zst'])
+def test_compressed_files(tmp_path, extension):
+    if extension == '.zst':
+        pytest.importorskip('zstandard')
+    file_name = str(tmp_path / ('lexicon.dic' + extension))
+    write_lexicon(file_name, iterate_merged_entries(TRAINING_LEXICON, PREDICTED_LEXICON))
+    with open(file_name, 'rb') as fp:
+        assert u'кот'.encode('utf-8') not in fp.read()
+    assert not is_binary_lexicon(file_name)
+    assert load_lexicon(file_name) == load_lexicon(file_name, compact=True) == {
+        u'дом': [u'D O M'], u'кот': [u'K O T', u'K A0 T', u'K O0 T'], u'сад': [u'S A T']
+    }
+    word_list_name = str(tmp_path / ('words.txt' + extension))
+    with open_for_writing(word_list_name) as fp:
+        fp.write(u'Кот\n\n  дом \r\nсад')
+    assert list(read_word_list(word_list_name)) == [u'кот', u'дом', u'сад']
+    with open_for_reading(word_list_name) as fp:
+        assert fp.read() == u'Кот\n\n  дом \nсад'
+
+
+def test_standard_input(tmp_path):
+    file_name = str(tmp_path / 'lexicon.dic')
+    with io.open(file_name, mode='w', encoding='utf-8') as fp:
+        fp.write(u'кот K O T\nдом D O M\nкот(2) K A0 T\n')
+    destination_name = str(tmp_path / 'formatted.dic.gz')
+    with open(file_name, 'rb') as fp:
+        subprocess.check_call([sys.executable, PREPARE_DICT_NAME, '-s', '-', '-d', destination_name], stdin=fp)
+    assert load_lexicon(destination_name) == load_lexicon(file_name)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+from lookup_table import LookupTableTranscriber, build_lookup_table, open_lookup_table, read_word_frequencies
+
+
+class FixedEngine(object):
+
+    def __init__(self, phones):
+        self.phones = phones
+        self.decoded_words = list()
+
+    def transcribe(self, words):
+        self.decoded_words += list(words)
+        return dict((cur_word, [self.phones]) for cur_word in words)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    frequency_list_name = str(tmp_path / 'frequencies.txt')
+    with io.open(frequency_list_name, mode='w', encoding='utf-8') as fp:
+        fp.write(u'     15 кот\nДом 20\nсад 3\nкот 10\nлес\n')
+    training_lexicon_name = str(tmp_path / 'train.dic')
+    with io.open(training_lexicon_name, mode='w', encoding='utf-8') as fp:
+        fp.write(u'дом D O M\nдом(2) D A0 M\n')
+    model_name = tmp_path / 'russian_g2p.fst'
+    model_name.write_bytes(b'first model')
+    return frequency_list_name, training_lexicon_name, str(model_name)
+
+
+def test_read_word_frequencies(sources):
+    assert read_word_frequencies(sources[0]) == {u'кот': (25, 0), u'дом': (20, 1), u'сад': (3, 2), u'лес': (0, 4)}
+
+
+def test_lookup_table_is_rebuilt_after_model_change(sources, tmp_path):
+    frequency_list_name, training_lexicon_name, model_name = sources
+    table_name = str(tmp_path / 'lookup.lex')
+    g2p_engine = FixedEngine(u'K O T')
+    assert build_lookup_table(table_name, frequency_list_name, 2, training_lexicon_name, model_name, 0.85,
+                              g2p_engine) == 2
+    assert g2p_engine.decoded_words == [u'кот']
+    table = open_lookup_table(table_name, model_name, 0.85, FixedEngine(u'K A0 T'))
+    assert dict(table) == {u'кот': [u'K O T'], u'дом': [u'D O M', u'D A0 M']}
+    del table
+    with open(model_name, 'wb') as fp:
+        fp.write(b'retrained model')
+    g2p_engine = FixedEngine(u'K A0 T')
+    table = open_lookup_table(table_name, model_name, 0.85, g2p_engine)
+    assert dict(table) == {u'кот': [u'K A0 T'], u'дом': [u'D O M', u'D A0 M']}
+    assert table.metadata['top_n'] == 2
+    assert g2p_engine.decoded_words == [u'кот']
+    del table
+    g2p_engine = FixedEngine(u'K O0 T')
+    assert dict(open_lookup_table(table_name, model_name, 0.5, g2p_engine))[u'кот'] == [u'K O0 T']
+    assert g2p_engine.decoded_words == [u'кот']
+
+
+def test_lookup_table_transcriber(sources, tmp_path):
+    frequency_list_name, training_lexicon_name, model_name = sources
+    table_name = str(tmp_path / 'lookup.lex')
+    build_lookup_table(table_name, frequency_list_name, 2, training_lexicon_name, model_name, 0.85,
+                       FixedEngine(u'K O T'))
+    transcriber = LookupTableTranscriber(open_lookup_table(table_name, model_name, 0.85, None), table_name)
+    g2p_engine = FixedEngine(u'S A T')
+    assert transcriber.transcribe([u' Кот', u'сад'], g2p_engine.transcribe) == {
+        u' Кот': [u'K O T'], u'сад': [u'S A T']
+    }
+    assert g2p_engine.decoded_words == [u'сад']
+    assert (transcriber.n_hits, transcriber.n_misses) == (1, 1)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import io
+
+import pytest
+
+from prepare_dict import calculate_lexicon_hash, get_token, is_binary_lexicon, load_binary_lexicon, load_lexicon, \
+    save_binary_lexicon
+
+
+LEXICON_LINES = [
+    u'кот K O T',
+    u'дом D O M',
+    u'дом(2)  D A0 M',
+    u'',
+    u'   ',
+    u'д\'артаньян D A R T A0 N J A N',
+    u'северо-запад S E V E R A0 Z A P A T',
+    u'cat K AE1 T',
+    u'кот(3) K O0 T'
+]
+WRONG_LINES = [
+    u'кот',
+    u'кот K 0 T',
+    u'кот k O T',
+    u'кот K-O T',
+    u'кот(2 K O T',
+    u'кот(a) K O T',
+    u'(2) K O T',
+    u'кот2 K O T',
+    u'к)от K O T'
+]
+
+
+def check_transcription_in_old_style(phones_list):
+    """ Check of transcription by the loader before its optimization. """
+    if len(phones_list) == 0:
+        return False
+    admissible_characters = set(u'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+    for cur_phone in phones_list:
+        if (len(cur_phone) == 0) or cur_phone[0].isdigit() or (not (set(cur_phone) <= admissible_characters)) or \
+                (not cur_phone[0].isupper()):
+            return False
+    return True
+
+
+def check_token_in_old_style(checked):
+    if len(checked) == 0:
+        return False
+    if checked.isalpha():
+        return True
+    if u'\'' not in checked:
+        return False
+    return all(filter(lambda it: (len(it) > 0) and it.isalpha(), checked.split(u'\'')))
+
+
+def get_token_in_old_style(source_word):
+    found_idx1 = source_word.find(u'(')
+    found_idx2 = source_word.find(u')')
+    if (found_idx1 < 0) and (found_idx2 < 0):
+        cleaned_word = source_word
+    elif (found_idx1 > 0) and (found_idx2 == len(source_word) - 1) and \
+            source_word[(found_idx1 + 1):found_idx2].isdigit():
+        cleaned_word = source_word[:found_idx1]
+    else:
+        cleaned_word = u''
+    if len(cleaned_word) > 0:
+        if u'-' in cleaned_word:
+            if not all(filter(lambda it: check_token_in_old_style(it), cleaned_word.split(u'-'))):
+                cleaned_word = u''
+        elif not check_token_in_old_style(cleaned_word):
+            cleaned_word = u''
+    return cleaned_word
+
+
+def load_lexicon_in_old_style(file_name):
+    line_idx = 1
+    words = dict()
+    with codecs.open(file_name, mode='r', encoding='utf-8', errors='ignore') as fp:
+        cur = fp.readline()
+        while len(cur) > 0:
+            prep = cur.strip()
+            if len(prep) > 0:
+                parts = prep.split()
+                assert len(parts) >= 2, 'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+                assert check_transcription_in_old_style(parts[1:]), \
+                    u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+                new_token = get_token_in_old_style(parts[0])
+                assert len(new_token) > 0, u'File "{0}": line {1} is wrong!'.format(file_name, line_idx)
+                words.setdefault(new_token, []).append(' '.join(parts[1:]))
+            cur = fp.readline()
+            line_idx += 1
+    return words
+
+
+def write_lines(file_name, lines, newline=u'\n'):
+    with io.open(file_name, mode='w', encoding='utf-8', newline=u'') as fp:
+        fp.write(newline.join(lines) + newline)
+    return file_name
+
+
+def load_and_catch(load, file_name):
+    try:
+        return load(file_name)
+    except AssertionError as err:
+        # pytest appends an explanation to messages of asserts in this module (i.e. of the old loader)
+        return err.args[0].split(u'\n')[0]
+
+
+@pytest.mark.parametrize('newline', [u'\n', u'\r\n'])
+def test_load_lexicon_as_before(tmp_path, newline):
+    file_name = write_lines(str(tmp_path / 'lexicon.dic'), LEXICON_LINES, newline)
+    expected = load_lexicon_in_old_style(file_name)
+    assert expected[u'дом'] == [u'D O M', u'D A0 M']
+    assert load_lexicon(file_name) == expected
+    assert dict(load_lexicon(file_name, compact=True)) == expected
+
+
+@pytest.mark.parametrize('wrong_line', WRONG_LINES)
+def test_wrong_lines_as_before(tmp_path, wrong_line):
+    file_name = write_lines(str(tmp_path / 'lexicon.dic'), LEXICON_LINES[:4] + [wrong_line] + LEXICON_LINES[4:])
+    expected = load_and_catch(load_lexicon_in_old_style, file_name)
+    assert expected == u'File "{0}": line 5 is wrong!'.format(file_name)
+    assert load_and_catch(load_lexicon, file_name) == expected
+    assert load_and_catch(lambda it: load_lexicon(it, compact=True), file_name) == expected
+
+
+def test_get_token_as_before():
+    for cur_word in [u'кот', u'кот(2)', u'кот(22)', u'кот()', u'кот(x)', u'(2)', u'кот(2)x', u'к(2)от', u'рок-н-ролл',
+                     u'рок--ролл', u'-', u'д\'', u'\'', u'кот1', u'кот-1', u'к\'о\'т', u'']:
+        assert get_token(cur_word) == get_token_in_old_style(cur_word), cur_word
+
+
+def test_binary_lexicon(tmp_path):
+    lexicon = load_lexicon(write_lines(str(tmp_path / 'lexicon.dic'), LEXICON_LINES))
+    file_name = str(tmp_path / 'lexicon.lex')
+    save_binary_lexicon(lexicon, file_name, metadata={'source': 'lexicon.dic'})
+    assert is_binary_lexicon(file_name)
+    loaded = load_binary_lexicon(file_name)
+    assert dict(loaded) == lexicon
+    assert list(loaded) == sorted(lexicon)
+    assert (u'кот' in loaded) and (u'собака' not in loaded) and (u'' not in loaded)
+    with pytest.raises(KeyError):
+        loaded[u'собака']
+    assert loaded.content_hash == calculate_lexicon_hash(lexicon)
+    assert loaded.metadata == {'source': 'lexicon.dic'}
+    assert dict(load_lexicon(file_name)) == lexicon
+    second_file_name = str(tmp_path / 'lexicon2.lex')
+    save_binary_lexicon(loaded, second_file_name)
+    reloaded = load_binary_lexicon(second_file_name)
+    assert dict(reloaded) == lexicon
+    assert (reloaded.content_hash == loaded.content_hash) and (reloaded.metadata == dict())
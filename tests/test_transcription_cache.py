@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from transcription_cache import TranscriptionCache
+
+
+class CountingEngine(object):
+
+    def __init__(self, phones):
+        self.phones = phones
+        self.decoded_words = list()
+
+    def transcribe(self, words):
+        self.decoded_words += list(words)
+        return dict((cur_word, [self.phones]) for cur_word in words if cur_word != u'нет')
+
+
+@pytest.fixture
+def model_name(tmp_path):
+    file_name = tmp_path / 'russian_g2p.fst'
+    file_name.write_bytes(b'first model')
+    return str(file_name)
+
+
+def test_memory_cache(model_name):
+    g2p_engine = CountingEngine(u'K O T')
+    with TranscriptionCache(model_name, 0.85, capacity=2) as cache:
+        assert cache.transcribe(g2p_engine, [u'кот', u'нет']) == {u'кот': [u'K O T']}
+        assert cache.transcribe(g2p_engine, [u'кот', u'нет']) == {u'кот': [u'K O T']}
+        assert (cache.n_hits, cache.n_misses) == (2, 2)
+        cache.transcribe(g2p_engine, [u'дом'])
+        cache.transcribe(g2p_engine, [u'кот'])
+    assert g2p_engine.decoded_words == [u'кот', u'нет', u'дом', u'кот']
+
+
+def test_persistent_cache(model_name, tmp_path):
+    db_name = str(tmp_path / 'russian_g2p.cache')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name) as cache:
+        cache.transcribe(CountingEngine(u'K O T'), [u'кот', u'нет'])
+    g2p_engine = CountingEngine(u'K A0 T')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name) as cache:
+        assert cache.transcribe(g2p_engine, [u'кот', u'нет']) == {u'кот': [u'K O T']}
+    assert g2p_engine.decoded_words == []
+    with TranscriptionCache(model_name, 0.5, db_name=db_name) as cache:
+        assert cache.transcribe(g2p_engine, [u'кот']) == {u'кот': [u'K A0 T']}
+    assert g2p_engine.decoded_words == [u'кот']
+
+
+def test_cache_is_invalidated_by_model_change(model_name, tmp_path):
+    db_name = str(tmp_path / 'russian_g2p.cache')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name) as cache:
+        cache.transcribe(CountingEngine(u'K O T'), [u'кот'])
+    with open(model_name, 'wb') as fp:
+        fp.write(b'retrained model')
+    g2p_engine = CountingEngine(u'K A0 T')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name) as cache:
+        assert cache.transcribe(g2p_engine, [u'кот']) == {u'кот': [u'K A0 T']}
+    assert g2p_engine.decoded_words == [u'кот']
+
+
+def test_cache_is_keyed_by_decoder(model_name, tmp_path):
+    db_name = str(tmp_path / 'russian_g2p.cache')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name, decoder=u'stub_decoder.py') as cache:
+        cache.transcribe(CountingEngine(u'K O T'), [u'кот'])
+    g2p_engine = CountingEngine(u'K A0 T')
+    with TranscriptionCache(model_name, 0.85, db_name=db_name, decoder=u'phonetisaurus-apply') as cache:
+        assert cache.transcribe(g2p_engine, [u'кот']) == {u'кот': [u'K A0 T']}
+    with TranscriptionCache(model_name, 0.85, db_name=db_name, decoder=u'stub_decoder.py') as cache:
+        assert cache.transcribe(g2p_engine, [u'кот']) == {u'кот': [u'K O T']}
+    assert g2p_engine.decoded_words == [u'кот']
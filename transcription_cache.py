@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+
+
+def calculate_model_fingerprint(model_name, chunk_size=1 << 20):
+    assert os.path.isfile(model_name), u'File "{0}" does not exist!'.format(model_name)
+    hasher = hashlib.sha1()
+    with open(model_name, 'rb') as fp:
+        chunk = fp.read(chunk_size)
+        while len(chunk) > 0:
+            hasher.update(chunk)
+            chunk = fp.read(chunk_size)
+    return hasher.hexdigest()
+
+
+class TranscriptionCache(object):
+    """ Cache of generated transcriptions keyed by (model fingerprint, decoder, pmass, word).
+
+    The decoder is a command of the external decoder, or None for the Phonetisaurus Python binding (see
+    `resolve_decoder()`). Recently used words are kept in a bounded in-memory LRU. If the database name is specified,
+    then all transcriptions are also persisted into SQLite. The database keeps transcriptions of one model only:
+    records of other model fingerprints are removed when the cache is opened, so retraining of the model invalidates
+    the cache automatically, and records of other decoders and pmass values of the same model are kept.
+    """
+
+    def __init__(self, model_name, pmass, capacity=100000, db_name=None, decoder=None):
+        assert capacity > 0, u'Capacity of the transcription cache must be a positive integer value!'
+        self.fingerprint = calculate_model_fingerprint(model_name)
+        self.decoder = u'' if decoder is None else decoder
+        self.pmass = float(pmass)
+        self.capacity = capacity
+        self.n_hits = 0
+        self.n_misses = 0
+        self._memory = OrderedDict()
+        self._db = None
+        if db_name is not None:
+            self._db = sqlite3.connect(db_name)
+            columns = [cur[1] for cur in self._db.execute(u'PRAGMA table_info(transcriptions)')]
+            if (len(columns) > 0) and (u'decoder' not in columns):
+                # the cache was created before decoders were distinguished, so the decoder of its records is unknown
+                self._db.execute(u'DROP TABLE transcriptions')
+            self._db.execute(u'CREATE TABLE IF NOT EXISTS transcriptions (fingerprint TEXT NOT NULL, '
+                             u'decoder TEXT NOT NULL, pmass REAL NOT NULL, word TEXT NOT NULL, '
+                             u'transcriptions TEXT NOT NULL, PRIMARY KEY (fingerprint, decoder, pmass, word))')
+            self._db.execute(u'DELETE FROM transcriptions WHERE fingerprint != ?', (self.fingerprint,))
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, word, transcriptions):
+        if word in self._memory:
+            del self._memory[word]
+        self._memory[word] = transcriptions
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get_many(self, words):
+        found = dict()
+        not_in_memory = list()
+        for cur_word in words:
+            if cur_word in self._memory:
+                found[cur_word] = self._memory.pop(cur_word)
+                self._memory[cur_word] = found[cur_word]
+            else:
+                not_in_memory.append(cur_word)
+        if (self._db is not None) and (len(not_in_memory) > 0):
+            batch_size = 500
+            for batch_start in range(0, len(not_in_memory), batch_size):
+                batch = not_in_memory[batch_start:(batch_start + batch_size)]
+                cursor = self._db.execute(
+                    u'SELECT word, transcriptions FROM transcriptions WHERE fingerprint = ? AND decoder = ? '
+                    u'AND pmass = ? AND word IN ({0})'.format(u', '.join([u'?'] * len(batch))),
+                    [self.fingerprint, self.decoder, self.pmass] + batch
+                )
+                for cur_word, cur_transcriptions in cursor:
+                    found[cur_word] = tuple(cur_transcriptions.split(u'\t')) if len(cur_transcriptions) > 0 \
+                        else tuple()
+                    self._remember(cur_word, found[cur_word])
+        return found
+
+    def put_many(self, words_and_transcriptions):
+        for cur_word in words_and_transcriptions:
+            self._remember(cur_word, tuple(words_and_transcriptions[cur_word]))
+        if self._db is not None:
+            self._db.executemany(
+                u'INSERT OR REPLACE INTO transcriptions (fingerprint, decoder, pmass, word, transcriptions) '
+                u'VALUES (?, ?, ?, ?, ?)',
+                [(self.fingerprint, self.decoder, self.pmass, cur_word,
+                  u'\t'.join(words_and_transcriptions[cur_word]))
+                 for cur_word in words_and_transcriptions]
+            )
+            self._db.commit()
+
+    def transcribe(self, g2p_engine, words):
+        words = list(words)
+        found = self.get_many(words)
+        missed_words = [cur_word for cur_word in words if cur_word not in found]
+        self.n_hits += len(words) - len(missed_words)
+        self.n_misses += len(missed_words)
+        predicted = dict((cur_word, list(found[cur_word])) for cur_word in found if len(found[cur_word]) > 0)
+        if len(missed_words) > 0:
+            decoded = g2p_engine.transcribe(missed_words)
+            self.put_many(dict((cur_word, decoded.get(cur_word, [])) for cur_word in missed_words))
+            for cur_word in decoded:
+                predicted[cur_word] = decoded[cur_word]
+        return predicted